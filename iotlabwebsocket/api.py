@@ -1,15 +1,134 @@
 """Client class for REST API."""
 
 import json
+import time
+from collections import OrderedDict
 
 import tornado
 from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.simple_httpclient import SimpleAsyncHTTPClient
+
+try:
+    from tornado.curl_httpclient import CurlAsyncHTTPClient
+except ImportError:  # pragma: no cover
+    CurlAsyncHTTPClient = None
 
 from . import DEFAULT_API_HOST, DEFAULT_API_PORT
+from .logger import LOGGER
+from .metrics import API_FETCH_SECONDS
+
+API_CACHE_TTL = 10  # seconds
+API_CACHE_SIZE = 1024
+API_BACKENDS = ("simple", "curl")
+API_MAX_CLIENTS = 10
+API_CONNECT_TIMEOUT = 5  # seconds
+API_REQUEST_TIMEOUT = 10  # seconds
+
+
+def nodes_index(nodes):
+    """Return the set of ``(site, node)`` tuples of a list of node hostnames.
+
+    >>> sorted(nodes_index(["m3-1.grenoble.iot-lab.info", "a8-2.lille"]))
+    [('grenoble', 'm3-1'), ('lille', 'a8-2')]
+    """
+    node_elems = (hostname.split(".", 2) for hostname in nodes)
+    return frozenset(
+        (node_elem[1], node_elem[0]) for node_elem in node_elems if len(node_elem) > 1
+    )
+
+
+class ApiCache:
+    # pylint:disable=too-many-instance-attributes
+    """LRU cache with time-to-live for API responses.
+
+    Entries are keyed by ``(exp_id, resource)``. Concurrent misses for the
+    same key share a single in-flight fetch.
+    """
+
+    def __init__(self, ttl=API_CACHE_TTL, size=API_CACHE_SIZE, clock=time.monotonic):
+        self.ttl = ttl
+        self.size = size
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries = OrderedDict()
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get(self, key):
+        expires, value = self._entries[key]
+        if expires <= self.clock():
+            del self._entries[key]
+            raise KeyError(key)
+        self._entries.move_to_end(key)
+        return value
+
+    def _set(self, key, value):
+        if self.ttl <= 0 or self.size <= 0:
+            return
+        self._entries[key] = (self.clock() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    @gen.coroutine
+    def fetch(self, exp_id, resource, fetch_func):
+        """Return the cached value or fetch it with ``fetch_func``.
+
+        ``fetch_func`` is only called when there is neither a valid cached
+        entry nor an in-flight fetch for the same key.
+        """
+        key = (exp_id, resource)
+        try:
+            value = self._get(key)
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            raise gen.Return(value)
+
+        future = self._pending.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            future = self._fetch(key, fetch_func)
+            if not future.done():  # pylint:disable=no-member
+                self._pending[key] = future
+        value = yield future
+        raise gen.Return(value)
+
+    @gen.coroutine
+    def _fetch(self, key, fetch_func):
+        try:
+            value = yield fetch_func()
+        finally:
+            self._pending.pop(key, None)
+        self._set(key, value)
+        raise gen.Return(value)
+
+    def invalidate(self, exp_id=None):
+        """Drop cached entries of an experiment, or all entries if None."""
+        if exp_id is None:
+            self._entries.clear()
+            return
+        for key in [key for key in self._entries if key[0] == exp_id]:
+            del self._entries[key]
 
 
 class ApiClient:
-    """Class that store information about the REST API."""
+    # pylint:disable=too-many-instance-attributes
+    """Class that store information about the REST API.
+
+    HTTP clients are shared by all requests to the API. With the ``curl``
+    backend (requires pycurl), connections to the API are kept alive and
+    reused between requests. ``max_clients`` limits the number of
+    concurrent requests, the others are queued.
+    """
 
     def __init__(
         self,
@@ -18,6 +137,13 @@ class ApiClient:
         port=DEFAULT_API_PORT,
         username="",
         password="",
+        *,
+        cache_ttl=API_CACHE_TTL,
+        cache_size=API_CACHE_SIZE,
+        backend="simple",
+        max_clients=API_MAX_CLIENTS,
+        connect_timeout=API_CONNECT_TIMEOUT,
+        request_timeout=API_REQUEST_TIMEOUT,
     ):
         # pylint:disable=too-many-arguments
         self.protocol = protocol
@@ -25,6 +151,17 @@ class ApiClient:
         self.port = port
         self.username = username
         self.password = password
+        self.cache = ApiCache(ttl=cache_ttl, size=cache_size)
+        self.client_class = ApiClient._client_class(backend)
+        self.client_options = {
+            "max_clients": max_clients,
+            "defaults": {
+                "connect_timeout": connect_timeout,
+                "request_timeout": request_timeout,
+            },
+        }
+        self._async_client = None
+        self._sync_client = None
 
     def __eq__(self, other):
         return (
@@ -35,23 +172,49 @@ class ApiClient:
             and self.password == other.password
         )
 
+    @staticmethod
+    def _client_class(backend):
+        if backend not in API_BACKENDS:
+            raise ValueError(f"Invalid API client backend '{backend}'")
+        if backend == "curl":
+            if CurlAsyncHTTPClient is not None:
+                return CurlAsyncHTTPClient
+            LOGGER.warning("pycurl is not available, using the simple API client")
+        return SimpleAsyncHTTPClient
+
     @property
     def url(self):
         """Returns the base URL for experiments in the API."""
         return f"{self.protocol}://{self.host}:{self.port}/api/experiments"
 
-    @staticmethod
-    def _fetch_sync(request):
+    @property
+    def async_client(self):
+        """Returns the asynchronous HTTP client of the current IOLoop."""
+        if self._async_client is None or self._async_client.io_loop is not (
+            IOLoop.current()
+        ):
+            self._async_client = self.client_class(
+                force_instance=True, **self.client_options
+            )
+        return self._async_client
+
+    @property
+    def sync_client(self):
+        """Returns the synchronous HTTP client."""
+        if self._sync_client is None:
+            self._sync_client = tornado.httpclient.HTTPClient(
+                self.client_class, **self.client_options
+            )
+        return self._sync_client
+
+    def _fetch_sync(self, request):
         request.headers["Content-Type"] = "application/json"
-        client = tornado.httpclient.HTTPClient()
-        return client.fetch(request).buffer.read()
+        return self.sync_client.fetch(request).buffer.read()
 
-    @staticmethod
     @gen.coroutine
-    def _fetch_async(request):
+    def _fetch_async(self, request):
         request.headers["Content-Type"] = "application/json"
-        client = tornado.httpclient.AsyncHTTPClient()
-        response = yield client.fetch(request)
+        response = yield self.async_client.fetch(request)
         raise gen.Return(response.buffer.read())
 
     def _request(self, exp_id, resource):
@@ -63,28 +226,81 @@ class ApiClient:
             )
         return tornado.httpclient.HTTPRequest(_url, **kwargs)
 
+    @gen.coroutine
+    def _fetch_resource_async(self, exp_id, resource, parse):
+        start = time.perf_counter()
+        try:
+            response = yield self._fetch_async(self._request(exp_id, resource))
+        finally:
+            API_FETCH_SECONDS.labels(resource or "nodes").observe(
+                time.perf_counter() - start
+            )
+        raise gen.Return(parse(response.decode()))
+
     @staticmethod
     def _parse_nodes_response(response):
         return json.loads(response)["nodes"]
 
+    @staticmethod
+    def _parse_token_response(response):
+        return json.loads(response)["token"]
+
     def fetch_nodes_sync(self, exp_id):
         """Fetch the list of nodes using a synchronous call."""
-        response = ApiClient._fetch_sync(self._request(exp_id, ""))
+        response = self._fetch_sync(self._request(exp_id, ""))
         return ApiClient._parse_nodes_response(response.decode())
 
     @gen.coroutine
     def fetch_nodes_async(self, exp_id):
-        """Fetch the list of nodes using an asynchronous call."""
-        response = yield ApiClient._fetch_async(self._request(exp_id, ""))
-        raise gen.Return(ApiClient._parse_nodes_response(response.decode()))
+        """Fetch the list of nodes using an asynchronous call.
+
+        The result is cached per experiment.
+        """
+        nodes = yield self.cache.fetch(
+            exp_id,
+            "",
+            lambda: self._fetch_resource_async(
+                exp_id, "", ApiClient._parse_nodes_response
+            ),
+        )
+        raise gen.Return(nodes)
+
+    @gen.coroutine
+    def _fetch_nodes_index_async(self, exp_id):
+        nodes = yield self.fetch_nodes_async(exp_id)
+        raise gen.Return(nodes_index(nodes))
+
+    @gen.coroutine
+    def fetch_nodes_index_async(self, exp_id):
+        """Fetch the ``(site, node)`` index of the experiment nodes.
+
+        The index is built once per nodes fetch and cached per experiment.
+        """
+        index = yield self.cache.fetch(
+            exp_id, "nodes-index", lambda: self._fetch_nodes_index_async(exp_id)
+        )
+        raise gen.Return(index)
 
     def fetch_token_sync(self, exp_id):
         """Fetch the experiment token using a synchronous call."""
-        response = ApiClient._fetch_sync(self._request(exp_id, "token"))
-        return json.loads(response.decode())["token"]
+        response = self._fetch_sync(self._request(exp_id, "token"))
+        return ApiClient._parse_token_response(response.decode())
 
     @gen.coroutine
     def fetch_token_async(self, exp_id):
-        """Fetch the experiment token using an asynchronous call."""
-        response = yield ApiClient._fetch_async(self._request(exp_id, "token"))
-        raise gen.Return(json.loads(response.decode())["token"])
+        """Fetch the experiment token using an asynchronous call.
+
+        The result is cached per experiment.
+        """
+        token = yield self.cache.fetch(
+            exp_id,
+            "token",
+            lambda: self._fetch_resource_async(
+                exp_id, "token", ApiClient._parse_token_response
+            ),
+        )
+        raise gen.Return(token)
+
+    def invalidate(self, exp_id=None):
+        """Forget cached API responses of an experiment (or all of them)."""
+        self.cache.invalidate(exp_id)
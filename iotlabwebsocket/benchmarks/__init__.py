@@ -0,0 +1,23 @@
+"""iotlabwebsocket benchmarks module.
+
+Each benchmark is a module that can be run with
+``python -m iotlabwebsocket.benchmarks.<name>``. The load benchmark of the
+whole relay is also installed as ``iotlab-websocket-benchmark``.
+"""
+
+
+def percentile(values, percent):
+    """Return the nearest-rank ``percent`` percentile of ``values``.
+
+    Python 3.7 has no ``statistics.quantiles``.
+
+    >>> percentile(range(1, 101), 99)
+    99
+    >>> percentile([3, 1, 2], 50), percentile([], 50)
+    (2, 0)
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return 0
+    rank = -(-len(ordered) * percent // 100)
+    return ordered[max(rank, 1) - 1]
@@ -0,0 +1,89 @@
+"""Node broadcast throughput benchmark.
+
+Measures the number of chunks per second forwarded to an increasing number
+of websockets, with :class:`iotlabwebsocket.broadcast.NodeBroadcast` and
+with the previous per-websocket decoding and framing.
+"""
+
+import argparse
+import time
+
+from ..broadcast import NodeBroadcast, websocket_frame
+
+
+class FakeWebsocket:
+    """Websocket stand-in counting the bytes written to the connection."""
+
+    def __init__(self, text):
+        self.text = text
+        self.written = 0
+
+    def write_frame(self, frame):
+        """Account a frame written by NodeBroadcast."""
+        self.written += len(frame)
+
+    def write_message(self, message, binary=False):
+        """Account a message framed for this websocket only."""
+        if not binary:
+            message = message.encode("utf-8")
+        self.write_frame(websocket_frame(message, binary))
+
+
+def legacy_send(websockets, data):
+    """Forward data the way handle_tcp_data did before NodeBroadcast."""
+    for websocket in websockets:
+        message = data
+        if websocket.text:
+            try:
+                message = data.decode("utf-8")
+            except UnicodeDecodeError:
+                continue
+        websocket.write_message(message, binary=not websocket.text)
+
+
+def _chunks_per_second(send, websockets, data, duration):
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        for _ in range(100):
+            send(websockets, data)
+        count += 100
+    return count / (time.perf_counter() - start)
+
+
+def run(subscribers, chunk_size, duration):
+    """Return the chunks per second of the legacy and broadcast paths."""
+    data = ("é" * (chunk_size // 2)).encode("utf-8")
+    websockets = [FakeWebsocket(text=bool(i % 2)) for i in range(subscribers)]
+    broadcast = NodeBroadcast("node-1", websockets)
+    legacy = _chunks_per_second(legacy_send, websockets, data, duration)
+    shared = _chunks_per_second(
+        lambda websockets, data: broadcast.send(data), websockets, data, duration
+    )
+    return legacy, shared
+
+
+def main(args=None):
+    """Run the broadcast benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--subscribers",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8, 16, 32],
+        help="number of websockets connected to the node",
+    )
+    parser.add_argument("--chunk-size", type=int, default=1024, help="chunk size")
+    parser.add_argument(
+        "--duration", type=float, default=0.5, help="duration of each run"
+    )
+    args = parser.parse_args(args)
+
+    print(f"{'subscribers':>12} {'legacy chunks/s':>16} {'broadcast chunks/s':>19}")
+    for subscribers in args.subscribers:
+        legacy, shared = run(subscribers, args.chunk_size, args.duration)
+        print(f"{subscribers:>12} {legacy:>16.0f} {shared:>19.0f}")
+
+
+if __name__ == "__main__":
+    main()
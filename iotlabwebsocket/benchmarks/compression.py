@@ -0,0 +1,116 @@
+"""Websocket compression benchmark.
+
+Compresses representative serial traces the way permessage-deflate does
+(one deflate stream per websocket, flushed after each message) and reports
+the CPU cost against the bandwidth saved for several compression settings.
+"""
+
+import argparse
+import random
+import time
+import zlib
+
+SETTINGS = [
+    # (compression level, memory level, window bits)
+    (1, 8, 15),
+    (6, 8, 15),
+    (9, 8, 15),
+    (1, 4, 10),
+    (6, 4, 10),
+]
+
+
+def serial_trace(lines, seed=0):
+    """Return lines looking like the output of an IoT-LAB node firmware."""
+    rand = random.Random(seed)
+    templates = [
+        "[{time:.3f}] sensor: temperature={temp:.2f} C humidity={hum:.1f} %\n",
+        "[{time:.3f}] rpl: parent fe80::{addr:04x} rank {rank} etx {etx}\n",
+        "[{time:.3f}] mac: tx seq {seq} to {addr:04x} status OK retries {retry}\n",
+        "> ping fe80::{addr:04x}\n12 bytes from fe80::{addr:04x}: icmp_seq={seq}\n",
+    ]
+    trace = []
+    for i in range(lines):
+        trace.append(
+            rand.choice(templates).format(
+                time=i * 0.01,
+                temp=20 + rand.random() * 5,
+                hum=40 + rand.random() * 10,
+                addr=rand.randrange(0x100),
+                rank=rand.randrange(256, 1024),
+                etx=rand.randrange(128, 512),
+                seq=i,
+                retry=rand.randrange(3),
+            )
+        )
+    return trace
+
+
+def messages(trace, size):
+    """Group trace lines into messages of about ``size`` bytes."""
+    result, current = [], ""
+    for line in trace:
+        current += line
+        if len(current) >= size:
+            result.append(current.encode())
+            current = ""
+    if current:
+        result.append(current.encode())
+    return result
+
+
+def run(payloads, level, mem_level, wbits, min_size):
+    """Return the compression ratio and CPU time per MB of raw data."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -wbits, mem_level)
+    raw = wire = 0
+    start = time.process_time()
+    for payload in payloads:
+        raw += len(payload)
+        if len(payload) < min_size:
+            wire += len(payload)
+            continue
+        # Same as tornado: sync flush and strip the trailing 4 bytes
+        data = compressor.compress(payload) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        wire += len(data) - 4
+    cpu = time.process_time() - start
+    return wire / raw, cpu / (raw / 1e6)
+
+
+def main(args=None):
+    """Run the compression benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, default=50000, help="trace lines")
+    parser.add_argument(
+        "--message-sizes",
+        type=int,
+        nargs="+",
+        default=[1, 1024],
+        help="message sizes, 1 means one line per message",
+    )
+    parser.add_argument(
+        "--min-sizes",
+        type=int,
+        nargs="+",
+        default=[0, 128],
+        help="compression minimum sizes",
+    )
+    args = parser.parse_args(args)
+
+    trace = serial_trace(args.lines)
+    print(
+        f"{'message':>8} {'min':>5} {'level':>5} {'mem':>4} {'wbits':>5} "
+        f"{'wire/raw':>9} {'CPU ms/MB':>10}"
+    )
+    for size in args.message_sizes:
+        payloads = messages(trace, size)
+        for min_size in args.min_sizes:
+            for level, mem_level, wbits in SETTINGS:
+                ratio, cpu = run(payloads, level, mem_level, wbits, min_size)
+                print(
+                    f"{size:>8} {min_size:>5} {level:>5} {mem_level:>4} {wbits:>5} "
+                    f"{ratio:>9.3f} {cpu * 1000:>10.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Websocket handshake latency benchmark.
+
+Measures the time needed to open a websocket when the REST API answers
+with a given round-trip time, and compares it with the time spent fetching
+the token and the nodes one after the other.
+"""
+
+import time
+import argparse
+import logging
+import statistics
+
+from tornado import gen, web, ioloop, websocket
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+
+from ..api import ApiClient
+from ..handlers.http_handler import HttpApiRequestHandler
+from ..logger import LOGGER
+from ..web_application import WebApplication
+
+EXP_ID = "123"
+NODE_URL = f"/ws/local/{EXP_ID}/localhost/serial/raw"
+
+
+class DelayedApiRequestHandler(HttpApiRequestHandler):
+    # pylint:disable=abstract-method,arguments-differ
+    """Local API handler answering after a fixed delay."""
+
+    def initialize(self, token, nodes=None, delay=0):
+        super().initialize(token, nodes)
+        self.delay = delay  # pylint:disable=attribute-defined-outside-init
+
+    @gen.coroutine
+    def get(self):
+        yield gen.sleep(self.delay)
+        super().get()
+
+
+def start_api(delay, token="token"):
+    """Start a local API stand-in and return its port."""
+    sock, port = bind_unused_port()
+    app = web.Application(
+        [
+            (
+                r"/api/experiments/[0-9]+/.*",
+                DelayedApiRequestHandler,
+                dict(token=token, delay=delay),
+            )
+        ]
+    )
+    HTTPServer(app).add_sockets([sock])
+    return port
+
+
+@gen.coroutine
+def _time_sequential_fetch(api, count):
+    durations = []
+    for _ in range(count):
+        start = time.perf_counter()
+        yield api.fetch_token_async(EXP_ID)
+        yield api.fetch_nodes_async(EXP_ID)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+@gen.coroutine
+def _time_handshake(port, count):
+    durations = []
+    url = f"ws://localhost:{port}{NODE_URL}"
+    for _ in range(count):
+        start = time.perf_counter()
+        connection = yield websocket.websocket_connect(
+            url, subprotocols=["user", "token", "token"]
+        )
+        durations.append(time.perf_counter() - start)
+        connection.close()
+    return durations
+
+
+@gen.coroutine
+def run(rtt, count):
+    """Return the mean sequential fetch and handshake durations."""
+    api_port = start_api(rtt)
+    api = ApiClient("http", "localhost", api_port, cache_ttl=0)
+    sock, port = bind_unused_port()
+    HTTPServer(WebApplication(api)).add_sockets([sock])
+
+    sequential = yield _time_sequential_fetch(api, count)
+    handshake = yield _time_handshake(port, count)
+    return statistics.mean(sequential), statistics.mean(handshake)
+
+
+def main(args=None):
+    """Run the handshake benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--rtt", type=float, default=0.05, help="API response delay in seconds"
+    )
+    parser.add_argument("--count", type=int, default=20, help="number of handshakes")
+    args = parser.parse_args(args)
+
+    LOGGER.addHandler(logging.NullHandler())
+    sequential, handshake = ioloop.IOLoop.current().run_sync(
+        lambda: run(args.rtt, args.count)
+    )
+    print(f"API RTT:                  {args.rtt * 1000:8.1f} ms")
+    print(
+        f"sequential token + nodes: {sequential * 1000:8.1f} ms "
+        f"({sequential / args.rtt:.2f} x RTT)"
+    )
+    print(
+        f"websocket handshake:      {handshake * 1000:8.1f} ms "
+        f"({handshake / args.rtt:.2f} x RTT)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Line framing benchmark.
+
+Simulates a node printing one short line per TCP read and compares the
+frames sent to a websocket using the default framing (one frame per read)
+with a websocket using the line framing.
+"""
+
+import argparse
+import statistics
+import time
+
+from tornado import gen, ioloop
+
+from ..broadcast import NodeBroadcast
+
+# IPv4 and TCP (with timestamps option) headers of the segment carrying a
+# frame, websockets set TCP_NODELAY so frames are not merged by the kernel.
+TCP_IP_OVERHEAD = 52
+
+
+class FakeWebsocket:
+    """Websocket stand-in recording the frames written to the connection."""
+
+    def __init__(self, framing):
+        self.text = True
+        self.framing = framing
+        self.frames = []
+
+    def write_frame(self, frame):
+        """Record a frame and the time it was written."""
+        self.frames.append((time.perf_counter(), frame))
+
+    def stats(self, sent, duration):
+        """Return frames/s, payload, frame and wire bytes, line latencies."""
+        payload = header = 0
+        latencies = []
+        for written, frame in self.frames:
+            # Frames are shorter than 64 KiB in this benchmark
+            length = frame[1] & 0x7F
+            header_size = 4 if length == 126 else 2
+            payload += len(frame) - header_size
+            header += header_size
+            for line in frame[header_size:].decode().splitlines():
+                latencies.append(written - sent[int(line.split()[1])])
+        return {
+            "frames/s": len(self.frames) / duration,
+            "payload bytes": payload,
+            "frame bytes": payload + header,
+            "wire bytes": payload + header + TCP_IP_OVERHEAD * len(self.frames),
+            "mean latency ms": statistics.mean(latencies) * 1000,
+            "max latency ms": max(latencies) * 1000,
+        }
+
+
+@gen.coroutine
+def run(lines, interval, max_latency):
+    """Send lines to both websockets and return their statistics."""
+    websockets = [FakeWebsocket("chunk"), FakeWebsocket("line")]
+    broadcast = NodeBroadcast("node-1", websockets, line_max_latency=max_latency)
+    sent = []
+    start = time.perf_counter()
+    for i in range(lines):
+        sent.append(time.perf_counter())
+        broadcast.send(f"sample {i} value={i * 7 % 1000}\n".encode())
+        yield gen.sleep(interval)
+    yield gen.sleep(max_latency * 2)
+    duration = time.perf_counter() - start
+    return [websocket.stats(sent, duration) for websocket in websockets]
+
+
+def main(args=None):
+    """Run the line framing benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, default=2000, help="number of lines")
+    parser.add_argument(
+        "--interval", type=float, default=0.0005, help="delay between lines"
+    )
+    parser.add_argument(
+        "--max-latency", type=float, default=0.005, help="line framing max latency"
+    )
+    args = parser.parse_args(args)
+
+    chunk, line = ioloop.IOLoop.current().run_sync(
+        lambda: run(args.lines, args.interval, args.max_latency)
+    )
+    print(f"{'':16} {'pass-through':>14} {'line framing':>14}")
+    for key in chunk:
+        print(f"{key:16} {chunk[key]:>14.1f} {line[key]:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
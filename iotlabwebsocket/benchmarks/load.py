@@ -0,0 +1,285 @@
+"""Websocket relay load benchmark.
+
+Runs the web application and a local API in a child process, then drives
+it from this process with stand-in nodes streaming timestamped lines on
+``NODE_TCP_PORT`` and websocket clients reading them. Reports the
+handshake rate, relay throughput, line latencies and the CPU usage and
+peak RSS of the relay, as text or JSON to compare commits.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import resource
+import threading
+import time
+
+from tornado import gen, web
+from tornado.httpserver import HTTPServer
+from tornado.iostream import StreamClosedError
+from tornado.netutil import Resolver
+from tornado.tcpserver import TCPServer
+from tornado.testing import bind_unused_port
+from tornado.websocket import websocket_connect
+
+from .. import __version__
+from ..api import ApiClient
+from ..clients.tcp_client import NODE_TCP_PORT
+from ..handlers.http_handler import HttpApiRequestHandler
+from ..logger import LOGGER
+from ..web_application import WebApplication, MAX_WEBSOCKETS_PER_NODE
+from . import percentile
+
+EXP_ID = "123"
+SITE = "local"
+TOKEN = "token"
+# Period of the writes of the stand-in nodes
+NODE_PERIOD = 0.01  # seconds
+
+
+def node_names(count):
+    """Return the names of the stand-in nodes.
+
+    >>> node_names(2)
+    ['node-1', 'node-2']
+    """
+    return [f"node-{index}" for index in range(1, count + 1)]
+
+
+def _measure(conn, stop):
+    """Send the relay CPU time and peak RSS between two parent requests."""
+    conn.recv()
+    start = resource.getrusage(resource.RUSAGE_SELF)
+    conn.recv()
+    end = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = end.ru_utime + end.ru_stime - start.ru_utime - start.ru_stime
+    conn.send((cpu, end.ru_maxrss))
+    stop()
+
+
+async def _relay(conn, nodes):
+    # Nodes are all served by the stand-in nodes of the parent process
+    Resolver.configure(
+        "tornado.netutil.OverrideResolver",
+        resolver=Resolver(),
+        mapping={node: "127.0.0.1" for node in nodes},
+    )
+    api_sock, api_port = bind_unused_port()
+    hostnames = [f"{node}.{SITE}" for node in nodes]
+    api_app = web.Application(
+        [
+            (
+                r"/api/experiments/[0-9]+/.*",
+                HttpApiRequestHandler,
+                dict(token=TOKEN, nodes=hostnames),
+            )
+        ]
+    )
+    HTTPServer(api_app).add_sockets([api_sock])
+    api = ApiClient("http", "localhost", api_port)
+    sock, port = bind_unused_port()
+    app = WebApplication(api, rate_limits={}, autoreload=False)
+    HTTPServer(app).add_sockets([sock])
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    threading.Thread(
+        target=_measure,
+        args=(conn, lambda: loop.call_soon_threadsafe(stopped.set)),
+        daemon=True,
+    ).start()
+    conn.send(port)
+    await stopped.wait()
+    app.stop()
+    # Let the websockets close
+    await asyncio.sleep(0.1)
+
+
+def relay_process(conn, nodes):
+    """Run the web application until the parent process stops measuring."""
+    LOGGER.addHandler(logging.NullHandler())
+    asyncio.run(_relay(conn, nodes))
+
+
+class NodeStandIn(TCPServer):
+    """Nodes stand-in streaming ``rate`` bytes per second of timestamped lines."""
+
+    def __init__(self, rate, line_size):
+        super().__init__()
+        self.rate = rate
+        self.line_size = line_size
+        self.streams = []
+
+    def _line(self):
+        stamp = f"{time.perf_counter():.6f} ".encode()
+        return stamp.ljust(self.line_size - 1, b"x") + b"\n"
+
+    @gen.coroutine
+    def handle_stream(self, stream, address):
+        self.streams.append(stream)
+        start = time.perf_counter()
+        sent = 0
+        try:
+            while True:
+                due = int(self.rate * (time.perf_counter() - start))
+                lines = (due - sent) // self.line_size
+                if lines:
+                    yield stream.write(b"".join(self._line() for _ in range(lines)))
+                    sent += lines * self.line_size
+                yield gen.sleep(NODE_PERIOD)
+        except StreamClosedError:
+            pass
+
+    def close(self):
+        """Stop listening and close the node connections."""
+        self.stop()
+        for stream in self.streams:
+            stream.close()
+
+
+class Client:
+    """Websocket client accounting the bytes and latencies of the lines."""
+
+    def __init__(self):
+        self.bytes = 0
+        self.latencies = []
+
+    def reset(self):
+        """Forget the data received so far."""
+        self.bytes = 0
+        self.latencies = []
+
+    async def receive(self, connection):
+        """Read the lines relayed by the websocket until it is closed."""
+        pending = b""
+        while True:
+            message = await connection.read_message()
+            if message is None:
+                break
+            if isinstance(message, str):
+                message = message.encode()
+            now = time.perf_counter()
+            self.bytes += len(message)
+            lines = (pending + message).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                self.latencies.append(now - float(line.split(b" ", 1)[0]))
+
+
+async def _connect(url, user):
+    start = time.perf_counter()
+    connection = await websocket_connect(url, subprotocols=[user, "token", TOKEN])
+    return connection, time.perf_counter() - start
+
+
+async def run(nodes, clients, rate, duration, *, line_size=128, text=False):
+    """Return the results of a load run."""
+    # pylint:disable=too-many-locals
+    names = node_names(nodes)
+    conn, child_conn = multiprocessing.Pipe()
+    process = multiprocessing.Process(
+        target=relay_process, args=(child_conn, names), daemon=True
+    )
+    process.start()
+    port = await asyncio.get_running_loop().run_in_executor(None, conn.recv)
+    node_server = NodeStandIn(rate, line_size)
+    node_server.listen(NODE_TCP_PORT, address="127.0.0.1")
+    suffix = "" if text else "/raw"
+    urls = [
+        f"ws://localhost:{port}/ws/{SITE}/{EXP_ID}/{node}/serial{suffix}"
+        for node in names
+        for _ in range(clients)
+    ]
+    try:
+        start = time.perf_counter()
+        connections = await asyncio.gather(
+            *(_connect(url, f"user-{index}") for index, url in enumerate(urls))
+        )
+        handshakes = time.perf_counter() - start
+        readers = [Client() for _ in connections]
+        for reader, (connection, _) in zip(readers, connections):
+            asyncio.ensure_future(reader.receive(connection))
+        while len(node_server.streams) < nodes:
+            await asyncio.sleep(NODE_PERIOD)
+
+        for reader in readers:
+            reader.reset()
+        conn.send("start")
+        await asyncio.sleep(duration)
+        conn.send("stop")
+        received = sum(reader.bytes for reader in readers)
+        cpu, rss = await asyncio.get_running_loop().run_in_executor(None, conn.recv)
+        latencies = [latency for reader in readers for latency in reader.latencies]
+        for connection, _ in connections:
+            connection.close()
+    finally:
+        node_server.close()
+        process.join(5)
+    return {
+        "version": __version__,
+        "nodes": nodes,
+        "clients_per_node": clients,
+        "rate": rate,
+        "line_size": line_size,
+        "text": text,
+        "duration": duration,
+        "handshakes_per_second": len(connections) / handshakes,
+        "handshake_p50_ms": percentile([elapsed for _, elapsed in connections], 50)
+        * 1e3,
+        "throughput_bytes_per_second": received / duration,
+        "latency_p50_ms": percentile(latencies, 50) * 1e3,
+        "latency_p99_ms": percentile(latencies, 99) * 1e3,
+        "cpu_percent": cpu / duration * 100,
+        "rss_kib": rss,
+    }
+
+
+def main(args=None):
+    """Run the load benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=10, help="number of nodes")
+    parser.add_argument(
+        "--clients",
+        type=int,
+        default=1,
+        choices=range(1, MAX_WEBSOCKETS_PER_NODE + 1),
+        help="number of websocket clients of each node",
+    )
+    parser.add_argument(
+        "--rate", type=int, default=10000, help="bytes per second sent by each node"
+    )
+    parser.add_argument(
+        "--line-size", type=int, default=128, help="size of the lines sent"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=5, help="measurement duration in seconds"
+    )
+    parser.add_argument(
+        "--text", action="store_true", help="use text instead of raw websockets"
+    )
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(args)
+
+    LOGGER.addHandler(logging.NullHandler())
+    results = asyncio.run(
+        run(
+            args.nodes,
+            args.clients,
+            args.rate,
+            args.duration,
+            line_size=args.line_size,
+            text=args.text,
+        )
+    )
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, value in results.items():
+        if isinstance(value, float):
+            value = f"{value:.2f}"
+        print(f"{name:>28} {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Event loop stall benchmark of the file logging.
+
+Logs debug records from the event loop at a given rate and measures how
+late a periodic timer of the loop fires, with file logging disabled,
+with the file handler called from the loop, and with the queue handler
+of :func:`iotlabwebsocket.logger.setup_server_logger`. Slow storage can be
+simulated by adding a latency to the writes of the log file.
+"""
+
+import argparse
+import asyncio
+import os.path
+import tempfile
+import time
+from logging.handlers import RotatingFileHandler
+
+from ..logger import LOGGER, setup_server_logger
+from . import percentile
+
+VARIANTS = ("disabled", "file", "queue")
+# Period of the timer measuring the loop stalls
+TIMER_PERIOD = 0.001  # seconds
+
+
+class SlowStream:  # pylint:disable=too-few-public-methods
+    """Log file stream whose writes take at least ``latency`` seconds."""
+
+    def __init__(self, stream, latency):
+        self.stream = stream
+        self.latency = latency
+
+    def write(self, text):
+        """Write to the stream after the latency."""
+        time.sleep(self.latency)
+        return self.stream.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+async def _timer(duration):
+    lags = []
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        start = time.perf_counter()
+        await asyncio.sleep(TIMER_PERIOD)
+        lags.append(time.perf_counter() - start - TIMER_PERIOD)
+    return lags
+
+
+async def _log(rate, stopped):
+    start = time.perf_counter()
+    logged = 0
+    while not stopped.is_set():
+        due = int(rate * (time.perf_counter() - start))
+        for index in range(logged, due):
+            LOGGER.debug("Websocket of node '%s' is closed, frame %d", "m3-1", index)
+        logged = max(logged, due)
+        await asyncio.sleep(0)
+    return logged
+
+
+async def _measure(rate, duration):
+    stopped = asyncio.Event()
+    logging_task = asyncio.ensure_future(_log(rate, stopped))
+    lags = await _timer(duration)
+    stopped.set()
+    logged = await logging_task
+    return lags, logged / duration
+
+
+def run(variant, rate, duration, log_dir, write_latency=0):
+    # pylint:disable=too-many-arguments,too-many-positional-arguments
+    """Return the timer lags and the rate of logged records of a variant."""
+    log_file = os.path.join(log_dir, f"{variant}.log")
+    handlers, listener = [], None
+    if variant == "file":
+        handlers = [RotatingFileHandler(log_file, "a", maxBytes=1000000, backupCount=1)]
+        LOGGER.addHandler(handlers[0])
+    elif variant == "queue":
+        listener = setup_server_logger(log_file=log_file)
+        handlers = listener.handlers
+    for handler in handlers:
+        if write_latency:
+            handler.stream = SlowStream(handler.stream, write_latency)
+            # A rotation would reopen a stream without latency
+            handler.maxBytes = 0
+    try:
+        return asyncio.run(_measure(rate, duration))
+    finally:
+        if listener is not None:
+            listener.stop()
+        for handler in list(LOGGER.handlers):
+            LOGGER.removeHandler(handler)
+            handler.close()
+
+
+def main(args=None):
+    """Run the logging stall benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--rate", type=int, default=20000, help="debug records logged per second"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=5, help="duration of each variant"
+    )
+    parser.add_argument(
+        "--write-latency",
+        type=float,
+        default=0,
+        help="simulated latency of the log file writes in milliseconds",
+    )
+    args = parser.parse_args(args)
+
+    print(
+        f"{'variant':>8} {'records/s':>10} {'p50 us':>8} {'p99 us':>8} "
+        f"{'max ms':>8} {'stalled ms':>10}"
+    )
+    with tempfile.TemporaryDirectory() as log_dir:
+        for variant in VARIANTS:
+            lags, logged = run(
+                variant, args.rate, args.duration, log_dir, args.write_latency / 1e3
+            )
+            print(
+                f"{variant:>8} {logged:>10.0f} {percentile(lags, 50) * 1e6:>8.0f} "
+                f"{percentile(lags, 99) * 1e6:>8.0f} {max(lags) * 1e3:>8.2f} "
+                f"{sum(lags) * 1e3:>10.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Metrics overhead benchmark.
+
+Compares the websocket relay throughput with the metrics updated and with
+the metric updates replaced by no-ops, alternating the runs.
+"""
+
+import argparse
+import asyncio
+import logging
+import statistics
+from unittest import mock
+
+from ..logger import LOGGER
+from ..metrics import Counter, Histogram
+from .relay import run as run_relay
+
+
+def _throughput(size):
+    throughput, _ = asyncio.run(run_relay(size, count=1))
+    return throughput
+
+
+def run(size, repeat):
+    """Return the relay throughputs with and without metrics."""
+    results = {"metrics": [], "no metrics": []}
+    for _ in range(repeat):
+        results["metrics"].append(_throughput(size))
+        with mock.patch.object(Counter, "inc", lambda *args: None):
+            with mock.patch.object(Histogram, "observe", lambda *args: None):
+                results["no metrics"].append(_throughput(size))
+    return results
+
+
+def main(args=None):
+    """Run the metrics overhead benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="number of runs of each variant"
+    )
+    parser.add_argument(
+        "--size", type=int, default=64, help="number of MiB relayed per run"
+    )
+    args = parser.parse_args(args)
+
+    LOGGER.addHandler(logging.NullHandler())
+    results = run(args.size * 1024 * 1024, args.repeat)
+    reference = statistics.median(results["no metrics"])
+    print(f"{'variant':>10} {'MiB/s':>8} {'overhead':>9}")
+    for name, throughputs in results.items():
+        throughput = statistics.median(throughputs)
+        print(
+            f"{name:>10} {throughput / 1024 / 1024:>8.1f} "
+            f"{(1 - throughput / reference) * 100:>8.1f}%"
+        )
+
+
+if __name__ == "__main__":
+    main()
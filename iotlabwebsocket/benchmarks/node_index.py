@@ -0,0 +1,56 @@
+"""Node membership check micro-benchmark.
+
+Compares the linear scan of the experiment nodes list with a lookup in the
+``(site, node)`` index built by :func:`iotlabwebsocket.api.nodes_index`.
+"""
+
+import argparse
+import timeit
+
+from ..api import nodes_index
+
+
+def linear_scan(nodes, site, node):
+    """Node membership check used before the index was introduced."""
+    for hostname in nodes:
+        node_elem = hostname.split(".")
+        if node_elem[0] == node and node_elem[1] == site:
+            return True
+    return False
+
+
+def make_nodes(count):
+    """Return a list of ``count`` node hostnames."""
+    return [f"m3-{i}.grenoble.iot-lab.info" for i in range(count)]
+
+
+def run(count, number):
+    """Return the per-call durations of the scan, the index build and lookup."""
+    nodes = make_nodes(count)
+    index = nodes_index(nodes)
+    # Worst case for the scan: the requested node is the last one
+    site, node = "grenoble", f"m3-{count - 1}"
+    assert linear_scan(nodes, site, node) and (site, node) in index
+
+    scan = timeit.timeit(lambda: linear_scan(nodes, site, node), number=number)
+    build = timeit.timeit(lambda: nodes_index(nodes), number=number)
+    lookup = timeit.timeit(lambda: (site, node) in index, number=number)
+    return scan / number, build / number, lookup / number
+
+
+def main(args=None):
+    """Run the node membership benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=10000, help="number of nodes")
+    parser.add_argument("--number", type=int, default=100, help="number of calls")
+    args = parser.parse_args(args)
+
+    scan, build, lookup = run(args.nodes, args.number)
+    print(f"nodes:              {args.nodes}")
+    print(f"linear scan:        {scan * 1e6:10.2f} us per handshake")
+    print(f"index build:        {build * 1e6:10.2f} us per experiment fetch")
+    print(f"index lookup:       {lookup * 1e6:10.2f} us per handshake")
+
+
+if __name__ == "__main__":
+    main()
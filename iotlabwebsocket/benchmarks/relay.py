@@ -0,0 +1,128 @@
+"""Websocket relay throughput and latency benchmark.
+
+Relays the data of a local stand-in node to a websocket client through the
+web application, with each requested event loop implementation.
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+
+from tornado import gen
+from tornado.httpserver import HTTPServer
+from tornado.tcpserver import TCPServer
+from tornado.testing import bind_unused_port
+from tornado.websocket import websocket_connect
+
+from ..api import ApiClient
+from ..clients.tcp_client import NODE_TCP_PORT
+from ..event_loop import EVENT_LOOPS, set_event_loop_policy
+from ..logger import LOGGER
+from ..web_application import WebApplication
+from . import percentile
+from .handshake import NODE_URL, start_api
+
+
+class NodeStandIn(TCPServer):
+    """Node stand-in exposing the stream of its connection."""
+
+    def __init__(self):
+        super().__init__()
+        self.connected = asyncio.get_event_loop().create_future()
+
+    @gen.coroutine
+    def handle_stream(self, stream, address):
+        self.connected.set_result(stream)
+
+
+async def _stream(stream, size):
+    block = b"x" * 1023 + b"\n"
+    for _ in range(size // len(block)):
+        await stream.write(block)
+
+
+async def _throughput(stream, connection, size):
+    start = time.perf_counter()
+    sending = asyncio.ensure_future(_stream(stream, size))
+    received = 0
+    while received < size // 1024 * 1024:
+        message = await connection.read_message()
+        received += len(message)
+    await sending
+    return received / (time.perf_counter() - start)
+
+
+async def _latencies(stream, connection, count):
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        stream.write(b"ping\n")
+        await connection.read_message()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def run(size, count):
+    """Return the relay throughput and message latencies of the loop."""
+    api = ApiClient("http", "localhost", start_api(0), cache_ttl=0)
+    sock, port = bind_unused_port()
+    server = HTTPServer(
+        WebApplication(
+            api, rate_limits={}, write_queue_size=16 * 1024 * 1024, autoreload=False
+        )
+    )
+    server.add_sockets([sock])
+    node = NodeStandIn()
+    node.listen(NODE_TCP_PORT, address="localhost")
+    try:
+        connection = await websocket_connect(
+            f"ws://localhost:{port}{NODE_URL}", subprotocols=["user", "token", "token"]
+        )
+        stream = await node.connected
+        throughput = await _throughput(stream, connection, size)
+        latencies = await _latencies(stream, connection, count)
+        connection.close()
+        # Let the application handle the websocket closure
+        await asyncio.sleep(0.1)
+    finally:
+        node.stop()
+        server.stop()
+    return throughput, latencies
+
+
+def main(args=None):
+    """Run the relay benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--event-loops",
+        nargs="+",
+        choices=EVENT_LOOPS,
+        default=list(EVENT_LOOPS),
+        help="event loop implementations to compare",
+    )
+    parser.add_argument(
+        "--size", type=int, default=64, help="number of MiB sent by the node"
+    )
+    parser.add_argument(
+        "--count", type=int, default=2000, help="number of latency samples"
+    )
+    args = parser.parse_args(args)
+
+    LOGGER.addHandler(logging.NullHandler())
+    print(f"{'event loop':>10} {'MiB/s':>8} {'p50 us':>8} {'p99 us':>8}")
+    for name in args.event_loops:
+        if set_event_loop_policy(name) != name:
+            print(f"{name:>10} not installed")
+            continue
+        throughput, latencies = asyncio.run(run(args.size * 1024 * 1024, args.count))
+        print(
+            f"{name:>10} {throughput / 1024 / 1024:>8.1f} "
+            f"{percentile(latencies, 50) * 1e6:>8.0f} "
+            f"{percentile(latencies, 99) * 1e6:>8.0f}"
+        )
+    set_event_loop_policy()
+
+
+if __name__ == "__main__":
+    main()
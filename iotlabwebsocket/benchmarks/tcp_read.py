@@ -0,0 +1,133 @@
+"""Node TCP read throughput and allocation benchmark.
+
+Streams data from a local stand-in node and compares the previous fixed
+size ``read_bytes`` loop with the adaptive ``read_into`` reads of
+:class:`iotlabwebsocket.clients.tcp_client.TCPClient`.
+"""
+
+import argparse
+import time
+import tracemalloc
+
+from tornado import gen, tcpclient
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.tcpserver import TCPServer
+
+from ..clients.tcp_client import TCPClient, NODE_TCP_PORT, CHUNK_SIZE
+
+
+class NodeStandIn(TCPServer):
+    """Node stand-in streaming ``total`` bytes of ``line`` as fast as it can."""
+
+    def __init__(self, total, line):
+        super().__init__()
+        self.total = total
+        self.data = line * max(1, 64 * 1024 // len(line))
+
+    @gen.coroutine
+    def handle_stream(self, stream, address):
+        sent = 0
+        while sent < self.total:
+            yield stream.write(self.data)
+            sent += len(self.data)
+        stream.close()
+
+
+class Counter:  # pylint:disable=too-few-public-methods
+    """Count the reads and bytes received."""
+
+    def __init__(self):
+        self.reads = 0
+        self.bytes = 0
+
+    def on_data(self, node, data):  # pylint:disable=unused-argument
+        """Account the data read from the node."""
+        self.reads += 1
+        self.bytes += len(data)
+
+
+@gen.coroutine
+def fixed_reads(on_data):
+    """Read the node the way TCPClient did before adaptive reads."""
+    stream = yield tcpclient.TCPClient().connect("localhost", NODE_TCP_PORT)
+    try:
+        while True:
+            data = yield stream.read_bytes(CHUNK_SIZE, partial=True)
+            on_data("localhost", data)
+    except StreamClosedError:
+        pass
+
+
+@gen.coroutine
+def adaptive_reads(on_data):
+    """Read the node with TCPClient."""
+    closed = Future()
+    client = TCPClient()
+    yield client.start(
+        "localhost", on_data, on_close=lambda node, reason: closed.set_result(None)
+    )
+    yield closed
+
+
+@gen.coroutine
+def _measure(read, trace):
+    counter = Counter()
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    yield read(counter.on_data)
+    elapsed = time.perf_counter() - start
+    peak = 0
+    if trace:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    raise gen.Return((counter, elapsed, peak))
+
+
+def run(total, line):
+    """Return the reads, bytes, seconds and peak memory of both readers."""
+    server = NodeStandIn(total, line)
+    server.listen(NODE_TCP_PORT, address="localhost")
+    results = {}
+    try:
+        for name, read in (("fixed", fixed_reads), ("adaptive", adaptive_reads)):
+            counter, elapsed, _ = IOLoop.current().run_sync(
+                lambda read=read: _measure(read, trace=False)
+            )
+            _, _, peak = IOLoop.current().run_sync(
+                lambda read=read: _measure(read, trace=True)
+            )
+            results[name] = (counter.reads, counter.bytes, elapsed, peak)
+    finally:
+        server.stop()
+    return results
+
+
+def main(args=None):
+    """Run the TCP read benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--size", type=int, default=64, help="number of MiB sent by the node"
+    )
+    parser.add_argument(
+        "--line-size", type=int, default=64, help="size of the lines sent"
+    )
+    args = parser.parse_args(args)
+
+    line = b"x" * (args.line_size - 1) + b"\n"
+    results = run(args.size * 1024 * 1024, line)
+    print(
+        f"{'reader':>9} {'reads':>9} {'bytes/read':>11} "
+        f"{'MiB/s':>8} {'peak KiB':>9}"
+    )
+    for name, (reads, received, elapsed, peak) in results.items():
+        print(
+            f"{name:>9} {reads:>9} {received / reads:>11.0f} "
+            f"{received / elapsed / 1024 / 1024:>8.1f} {peak / 1024:>9.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""Broadcast of the data received from a node to its websockets."""
+
+import codecs
+import struct
+
+from tornado.ioloop import IOLoop
+from tornado.websocket import WebSocketClosedError
+
+from .logger import LOGGER
+from .metrics import DECODE_ERRORS
+
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+FIN = 0x80
+
+# Policies applied to invalid UTF-8 bytes sent to text websockets
+TEXT_ERRORS = {"replace": "iotlabwebsocket-replace", "skip": "iotlabwebsocket-ignore"}
+DEFAULT_TEXT_ERRORS = "replace"
+
+# Framing of the data sent to text websockets: one frame per TCP read
+# ("chunk") or frames coalesced on line boundaries ("line").
+FRAMINGS = ("chunk", "line")
+LINE_MAX_LATENCY = 0.005  # seconds
+LINE_MAX_SIZE = 4096  # characters
+
+
+def _counted(errors):
+    """Return the ``errors`` codec error handler counting decode errors."""
+    handler = codecs.lookup_error(errors)
+
+    def _handler(exc):
+        DECODE_ERRORS.inc()
+        return handler(exc)
+
+    return _handler
+
+
+codecs.register_error("iotlabwebsocket-replace", _counted("replace"))
+codecs.register_error("iotlabwebsocket-ignore", _counted("ignore"))
+
+
+def websocket_frame(payload, binary):
+    """Return an unmasked and unfragmented websocket frame.
+
+    >>> websocket_frame(b"test", binary=False)
+    b'\\x81\\x04test'
+    >>> len(websocket_frame(b"a" * 126, binary=True))
+    130
+    """
+    first = FIN | (OPCODE_BINARY if binary else OPCODE_TEXT)
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", first, length)
+    elif length <= 0xFFFF:
+        header = struct.pack("!BBH", first, 126, length)
+    else:
+        header = struct.pack("!BBQ", first, 127, length)
+    return b"".join((header, payload))
+
+
+def frame_payload(frame):
+    """Return the payload and binary flag of a frame built by websocket_frame.
+
+    >>> frame_payload(websocket_frame(b"test", binary=True))
+    (b'test', True)
+    """
+    length = frame[1]
+    offset = 2 if length < 126 else 4 if length == 126 else 10
+    return frame[offset:], frame[0] & 0x0F == OPCODE_BINARY
+
+
+class LineFramer:
+    """Coalesces text on line boundaries.
+
+    Text is buffered and flushed with ``on_flush`` when the buffer reaches
+    ``max_size`` characters or when ``max_latency`` seconds elapsed since
+    the oldest buffered text arrived. Only complete lines are flushed,
+    unless the buffer contains no newline at all, so a byte never waits
+    more than twice ``max_latency``.
+    """
+
+    def __init__(self, on_flush, max_size=LINE_MAX_SIZE, max_latency=LINE_MAX_LATENCY):
+        self.on_flush = on_flush
+        self.max_size = max_size
+        self.max_latency = max_latency
+        self._buffer = []
+        self._size = 0
+        self._timeout = None
+
+    @property
+    def pending(self):
+        """Text buffered and not flushed yet."""
+        return "".join(self._buffer)
+
+    def feed(self, message):
+        """Add text to the buffer."""
+        self._buffer.append(message)
+        self._size += len(message)
+        if self._size >= self.max_size:
+            self.flush()
+        elif self._timeout is None:
+            self._timeout = IOLoop.current().call_later(self.max_latency, self.flush)
+
+    def flush(self):
+        """Flush the buffered complete lines, or everything if there's none."""
+        self.close()
+        text = "".join(self._buffer)
+        end = text.rfind("\n") + 1 or len(text)
+        remainder = text[end:]
+        self._buffer = [remainder] if remainder else []
+        self._size = len(remainder)
+        if remainder:
+            self._timeout = IOLoop.current().call_later(self.max_latency, self.flush)
+        if end:
+            self.on_flush(text[:end])
+
+    def close(self):
+        """Cancel the pending flush."""
+        if self._timeout is not None:
+            IOLoop.current().remove_timeout(self._timeout)
+            self._timeout = None
+
+
+def _kind(websocket):
+    if not websocket.text:
+        return "binary"
+    return websocket.framing
+
+
+class NodeBroadcast:
+    """Forwards the data received from a node to its websockets.
+
+    Each chunk of data is decoded at most once for text websockets, with an
+    incremental decoder so multi-byte characters split across chunks are
+    carried to the next chunk. Invalid bytes are replaced or skipped
+    depending on ``text_errors``. The websocket frame is built once per
+    kind of websocket (binary, text or line framed text), the same frame
+    bytes are then written to every websocket.
+
+    Text sent to websockets using the "line" framing goes through a
+    :class:`LineFramer` shared by all of them.
+    """
+
+    def __init__(
+        self,
+        node,
+        websockets,
+        text_errors=DEFAULT_TEXT_ERRORS,
+        line_max_size=LINE_MAX_SIZE,
+        line_max_latency=LINE_MAX_LATENCY,
+    ):
+        # pylint:disable=too-many-arguments
+        self.node = node
+        self.websockets = websockets
+        self._errors = TEXT_ERRORS[text_errors]
+        self._decoder = codecs.getincrementaldecoder("utf-8")(self._errors)
+        self._framer = LineFramer(self._send_lines, line_max_size, line_max_latency)
+
+    def send(self, data):
+        """Send data to all websockets connected to the node."""
+        kinds = {_kind(websocket) for websocket in self.websockets}
+        frames = {}
+        if "binary" in kinds:
+            frames["binary"] = websocket_frame(data, binary=True)
+        if "chunk" in kinds or "line" in kinds:
+            message = self._decoder.decode(data)
+            if message and "chunk" in kinds:
+                frames["chunk"] = websocket_frame(message.encode("utf-8"), binary=False)
+            if message and "line" in kinds:
+                self._framer.feed(message)
+        else:
+            # Partial characters are only relevant to text websockets
+            self._decoder.reset()
+        self._write(frames)
+
+    def send_scrollback(self, websocket, data):
+        """Send data received before it was connected to a websocket.
+
+        The data are sent in one frame. A character split at the end of the
+        data and text still buffered for line framed websockets are left
+        to the next frames.
+        """
+        if websocket.text:
+            decoder = codecs.getincrementaldecoder("utf-8")(self._errors)
+            message = decoder.decode(data)
+            pending = self._framer.pending if websocket.framing == "line" else ""
+            if pending and message.endswith(pending):
+                message = message[: -len(pending)]
+            data = message.encode("utf-8")
+        if data:
+            websocket.write_frame(websocket_frame(data, binary=not websocket.text))
+
+    def _send_lines(self, message):
+        self._write({"line": websocket_frame(message.encode("utf-8"), binary=False)})
+
+    def _write(self, frames):
+        if not frames:
+            return
+        for websocket in self.websockets:
+            frame = frames.get(_kind(websocket))
+            if frame is None:
+                continue
+            try:
+                websocket.write_frame(frame)
+            except WebSocketClosedError:
+                LOGGER.debug("Websocket of node '%s' is closed", self.node)
+
+    def close(self):
+        """Drop the pending line framed data."""
+        self._framer.close()
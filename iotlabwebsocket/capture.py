@@ -0,0 +1,150 @@
+"""Capture of the data received from the nodes.
+
+A capture file starts with `MAGIC` and the `START` time of the capture
+(seconds since the epoch), followed by one record per chunk of data
+received from the node: a `RECORD` header holding the reception time
+(seconds since the start, from the monotonic clock so that system clock
+steps don't change the delays between records) and the size of the data,
+then the data.
+"""
+
+import os
+import queue
+import struct
+import threading
+import time
+from datetime import datetime
+
+from tornado.ioloop import IOLoop
+
+from .logger import LOGGER
+from .metrics import CAPTURE_DROPPED_BYTES
+
+MAGIC = b"iotlab-websocket-capture 2\n"
+START = struct.Struct("!d")
+RECORD = struct.Struct("!dI")
+
+# Size of the batches of records handed to the writer thread, maximum time
+# a record waits in a batch and maximum number of batches waiting for the
+# writer thread.
+CAPTURE_BATCH_SIZE = 64 * 1024
+CAPTURE_FLUSH_INTERVAL = 1  # seconds
+CAPTURE_QUEUE_SIZE = 64
+
+
+def capture_path(directory, node):
+    """Return the path of a new capture file of a node."""
+    stamp = datetime.now().strftime("%Y%m%dT%H%M%S.%f")
+    return os.path.join(directory, f"{node}-{stamp}.capture")
+
+
+def read_records(buffer):
+    """Yield the time and data of the records of a capture.
+
+    Times are in seconds since the epoch. The data are memoryviews of
+    ``buffer``, which can be a memory mapped capture file. A truncated last
+    record is ignored.
+
+    >>> capture = MAGIC + START.pack(100) + RECORD.pack(1.5, 4) + b"test"
+    >>> capture += RECORD.pack(2, 8)
+    >>> [(timestamp, bytes(data)) for timestamp, data in read_records(capture)]
+    [(101.5, b'test')]
+    """
+    view = memoryview(buffer)
+    if view[: len(MAGIC)] != MAGIC:
+        raise ValueError("Not a capture file")
+    offset = len(MAGIC) + START.size
+    if offset > len(view):
+        return
+    (start,) = START.unpack_from(view, len(MAGIC))
+    while offset + RECORD.size <= len(view):
+        elapsed, size = RECORD.unpack_from(view, offset)
+        offset += RECORD.size
+        if offset + size > len(view):
+            break
+        yield start + elapsed, view[offset : offset + size]
+        offset += size
+
+
+class CaptureWriter:
+    """Append the data received from a node to a capture file.
+
+    Records are packed on the event loop into batches written to the file
+    by a background thread, when a batch reaches ``batch_size`` bytes or
+    ``flush_interval`` seconds after its first record. Batches are dropped
+    when ``queue_size`` batches are already waiting for a slow disk, so
+    the event loop never waits for the file.
+    """
+
+    # pylint:disable=too-many-instance-attributes
+
+    def __init__(
+        self,
+        path,
+        batch_size=CAPTURE_BATCH_SIZE,
+        flush_interval=CAPTURE_FLUSH_INTERVAL,
+        queue_size=CAPTURE_QUEUE_SIZE,
+    ):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.dropped = 0
+        self.started = time.time()
+        self._start = time.monotonic()
+        self._batch = bytearray()
+        self._timeout = None
+        # One more slot for the end of the capture
+        self._queue = queue.Queue(queue_size + 1)
+        # The thread writes the pending batches before the process exits
+        self._thread = threading.Thread(
+            target=self._write_batches, name=f"capture-{os.path.basename(path)}"
+        )
+        self._thread.start()
+
+    def write(self, data):
+        """Add the data received now to the capture."""
+        if not self._batch:
+            self._timeout = IOLoop.current().call_later(self.flush_interval, self.flush)
+        self._batch += RECORD.pack(time.monotonic() - self._start, len(data))
+        self._batch += data
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Hand the pending records to the writer thread."""
+        if self._timeout is not None:
+            IOLoop.current().remove_timeout(self._timeout)
+            self._timeout = None
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, bytearray()
+        # Only the event loop adds batches
+        if self._queue.qsize() >= self.queue_size:
+            self.dropped += len(batch)
+            CAPTURE_DROPPED_BYTES.inc(len(batch))
+            return
+        self._queue.put_nowait(batch)
+
+    def close(self):
+        """Write the pending records and close the file in the background."""
+        self.flush()
+        self._queue.put_nowait(None)
+
+    def join(self, timeout=None):
+        """Wait for the capture file to be closed."""
+        self._thread.join(timeout)
+
+    def _write_batches(self):
+        try:
+            with open(self.path, "xb") as capture:
+                capture.write(MAGIC + START.pack(self.started))
+                for batch in iter(self._queue.get, None):
+                    capture.write(batch)
+                    if self._queue.empty():
+                        capture.flush()
+        except OSError as exc:
+            LOGGER.error("Cannot write capture %s: %s", self.path, exc)
+            # Discard the next batches until the capture is closed
+            for _ in iter(self._queue.get, None):
+                pass
@@ -1,53 +1,103 @@
 """Management of the TCP connection to a node."""
 
-import time
 import socket
 
-from tornado import gen, tcpclient
+from tornado import gen, locks, tcpclient
 from tornado.iostream import StreamClosedError
 
 from ..logger import LOGGER
+from ..metrics import TCP_RECEIVED_BYTES, TCP_SENT_BYTES, RATE_LIMITED
 
 NODE_TCP_PORT = 20000
+# Bounds of the adaptive size of the reads from a node: it doubles when a
+# read fills the buffer and halves when a read fills less than a quarter.
 CHUNK_SIZE = 1024
-CHECK_BYTES_RECEIVED_PERIOD = 1  # seconds
-MAX_BYTES_RECEIVED_PER_PERIOD = 15000
+MAX_CHUNK_SIZE = 64 * 1024
+# Idle connections kept open for the next websockets of their node: maximum
+# number of them and of the most recent bytes buffered for each of them.
+LINGER_POOL_SIZE = 100
+LINGER_BUFFER_SIZE = 64 * 1024
 
 
 class TCPClient:
     """Class that manages the TCP client connection to a node."""
 
-    def __init__(self):
+    # pylint:disable=too-many-instance-attributes
+
+    def __init__(
+        self, min_chunk_size=CHUNK_SIZE, max_chunk_size=MAX_CHUNK_SIZE, tracer=None
+    ):
+        self.min_chunk_size = min_chunk_size
+        self.max_chunk_size = max(min_chunk_size, max_chunk_size)
+        self.chunk_size = min_chunk_size
+        self._buffer = memoryview(bytearray(min_chunk_size))
         self.ready = False
         self.node = None
         self._tcp = None
         self.on_close = None
         self.on_data = None
+        self.limiter = None
+        self.tracer = tracer
+        self._resumed = locks.Event()
+        self._resumed.set()
+
+    @property
+    def paused(self):
+        """True when reading from the node is paused."""
+        return not self._resumed.is_set()
+
+    def pause(self):
+        """Stop reading from the node until `resume` is called.
+
+        The node is then throttled by the TCP flow control of the kernel.
+        """
+        if not self.paused:
+            LOGGER.debug("Pausing TCP reads from node '%s'", self.node)
+            self._resumed.clear()
+
+    def resume(self):
+        """Resume reading from the node."""
+        if self.paused:
+            LOGGER.debug("Resuming TCP reads from node '%s'", self.node)
+            self._resumed.set()
 
     def send(self, data):
-        """Send data via the TCP connection."""
+        """Send data via the TCP connection.
+
+        Return the future of the write, None when the node is not connected.
+        """
         if not self.ready:
-            return
-        self._tcp.write(data)
+            return None
+        TCP_SENT_BYTES.inc(len(data))
+        return self._tcp.write(data)
 
     def stop(self):
         """Stop the TCP connection and close any opened websocket."""
         if self.ready:
             self._tcp.close()
+            # Let the read loop notice the stream is closed
+            self._resumed.set()
 
     @gen.coroutine
-    def start(self, node, on_data, on_close):
-        """Start the TCP connection and wait for incoming bytes."""
+    def start(self, node, on_data, on_close, limiter=None):
+        """Start the TCP connection and wait for incoming bytes.
+
+        ``on_data`` receives the bytes as a memoryview which is only valid
+        during the call. The incoming bytes rate is limited by the optional
+        `RateLimiter`.
+        """
         self.ready = False
         self.node = node
         self.on_close = on_close
         self.on_data = on_data
+        self.limiter = limiter
+        self._resumed.set()
         try:
-            LOGGER.debug(f"Opening TCP connection to '{node}:{NODE_TCP_PORT}'")
+            LOGGER.debug("Opening TCP connection to '%s:%d'", node, NODE_TCP_PORT)
             self._tcp = yield tcpclient.TCPClient().connect(node, NODE_TCP_PORT)
-            LOGGER.debug(f"TCP connection opened on '{node}:{NODE_TCP_PORT}'")
+            LOGGER.debug("TCP connection opened on '%s:%d'", node, NODE_TCP_PORT)
         except (StreamClosedError, socket.gaierror):
-            LOGGER.warning(f"Cannot open TCP connection to {node}:{NODE_TCP_PORT}")
+            LOGGER.warning("Cannot open TCP connection to %s:%d", node, NODE_TCP_PORT)
             # We can't connect to the node with TCP, closing all websockets
             self.on_close(self.node, reason=f"Cannot connect to node {self.node}")
             return
@@ -55,37 +105,59 @@ class TCPClient:
         self.ready = True
         self._read_stream()
 
+    def _received(self, size):
+        """Return the bytes read in the buffer and adapt the next read size.
+
+        The returned memoryview is only valid until the next read.
+        """
+        data = self._buffer[:size]
+        if size == self.chunk_size < self.max_chunk_size:
+            self.chunk_size = min(2 * size, self.max_chunk_size)
+            if len(self._buffer) < self.chunk_size:
+                # Previous buffer is released once no view is used anymore
+                self._buffer = memoryview(bytearray(self.chunk_size))
+        elif size < self.chunk_size // 4 and self.chunk_size > self.min_chunk_size:
+            self.chunk_size = max(self.chunk_size // 2, self.min_chunk_size)
+        return data
+
     @gen.coroutine
     def _read_stream(self):
         LOGGER.debug(
-            f"Listening to TCP connection for node {self.node}:{NODE_TCP_PORT}"
+            "Listening to TCP connection for node %s:%d", self.node, NODE_TCP_PORT
         )
-        received_bytes = 0
-        start = time.time()
         try:
             while True:
-                data = yield self._tcp.read_bytes(CHUNK_SIZE, partial=True)
-                received_bytes += len(data)
-
-                # Reset stream_byte every CHECK_BYTES_RECEIVED_PERIOD seconds
-                if time.time() - start > CHECK_BYTES_RECEIVED_PERIOD:
-                    if received_bytes > MAX_BYTES_RECEIVED_PER_PERIOD:
-                        LOGGER.warning(
-                            f"Node {self.node} is sending too fast, "
-                            f"received {received_bytes} bytes in "
-                            f"{CHECK_BYTES_RECEIVED_PERIOD} seconds, closing."
-                        )
-                        # Will close all websocket connections
-                        # and as a consequence, close the TCP connection
-                        self.on_close(
-                            self.node,
-                            reason=(f"Node {self.node} is sending too fast"),
-                        )
-                    received_bytes = 0
-                    start = time.time()
-
-                self.on_data(self.node, data)
+                if self.paused:
+                    yield self._resumed.wait()
+                size = yield self._tcp.read_into(
+                    self._buffer[: self.chunk_size], partial=True
+                )
+                TCP_RECEIVED_BYTES.inc(size)
+                if self.tracer is not None:
+                    self.tracer.read()
+                data = self._received(size)
+                if self.limiter is None:
+                    self.on_data(self.node, data)
+                elif self.limiter.action == "throttle":
+                    self.on_data(self.node, data)
+                    delay = self.limiter.throttle(len(data))
+                    if delay:
+                        RATE_LIMITED.labels("throttle").inc()
+                        yield gen.sleep(delay)
+                elif self.limiter.allow(len(data)):
+                    self.on_data(self.node, data)
+                elif self.limiter.action == "disconnect":
+                    LOGGER.warning("Node %s is sending too fast, closing.", self.node)
+                    RATE_LIMITED.labels("disconnect").inc()
+                    # Will close all websocket connections
+                    # and as a consequence, close the TCP connection
+                    self.on_close(
+                        self.node, reason=(f"Node {self.node} is sending too fast")
+                    )
+                else:
+                    LOGGER.debug("Node %s is sending too fast, dropping", self.node)
+                    RATE_LIMITED.labels("shed").inc()
         except StreamClosedError:
             self.ready = False
             self.on_close(self.node, f"Connection to {self.node} is closed")
-            LOGGER.info(f"TCP connection to '{self.node} is closed.")
+            LOGGER.info("TCP connection to '%s' is closed.", self.node)
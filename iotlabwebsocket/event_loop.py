@@ -0,0 +1,29 @@
+"""Selection of the asyncio event loop implementation."""
+
+import asyncio
+
+try:
+    import uvloop
+except ImportError:  # pragma: no cover
+    uvloop = None
+
+from .logger import LOGGER
+
+EVENT_LOOPS = ("asyncio", "uvloop")
+DEFAULT_EVENT_LOOP = "asyncio"
+
+
+def set_event_loop_policy(name=DEFAULT_EVENT_LOOP):
+    """Make ``asyncio.run`` use the ``name`` event loop implementation.
+
+    Fall back to the default asyncio event loop when uvloop is not
+    installed. Return the name of the selected implementation.
+    """
+    if name == "uvloop" and uvloop is None:
+        LOGGER.warning("uvloop is not installed, using the asyncio event loop")
+        name = "asyncio"
+    if name == "uvloop":
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    else:
+        asyncio.set_event_loop_policy(None)
+    return name
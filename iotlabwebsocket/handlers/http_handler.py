@@ -18,10 +18,15 @@ class HttpApiRequestHandler(web.RequestHandler):
     """Class that handle HTTP token requests."""
 
     token = None
+    nodes = None
 
-    def initialize(self, token):
-        """Initialize the authentication token during instantiation."""
+    def initialize(self, token, nodes=None):
+        """Initialize the authentication token during instantiation.
+
+        ``nodes`` replaces the default list of experiment nodes.
+        """
         self.token = token
+        self.nodes = nodes
 
     def get(self):
         """Return the authentication token."""
@@ -37,15 +42,17 @@ class HttpApiRequestHandler(web.RequestHandler):
 
             if msg is not None:
                 LOGGER.debug(
-                    f"Token request for experiment id '{experiment_id}' failed."
+                    "Token request for experiment id '%s' failed.", experiment_id
                 )
                 self.set_status(400)
                 self.finish(msg)
                 return
 
-            LOGGER.debug(f"Received request token for experiment '{experiment_id}'")
-            LOGGER.debug(f"Internal token: '{self.token}'")
+            LOGGER.debug("Received request token for experiment '%s'", experiment_id)
+            LOGGER.debug("Internal token: '%s'", self.token)
             self.write(json.dumps({"token": self.token}))
+        elif not resource and self.nodes is not None:
+            self.write(json.dumps({"nodes": self.nodes}))
         elif not resource:
             self.write(_nodes())
         else:
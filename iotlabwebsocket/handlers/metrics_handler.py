@@ -0,0 +1,17 @@
+"""iotlabwebsocket metrics request handler."""
+
+from tornado import web
+
+from ..metrics import CONTENT_TYPE, exposition
+
+
+class MetricsHandler(web.RequestHandler):
+    # pylint:disable=abstract-method
+    """Class that exposes the application metrics to Prometheus."""
+
+    def get(self):
+        """Return the metrics in the text exposition format."""
+        self.set_header("Content-Type", CONTENT_TYPE)
+        self.finish(
+            exposition(self.application.metrics, self.application.metric_labels)
+        )
@@ -0,0 +1,385 @@
+"""iotlabwebsocket multiplexed websocket connections handler."""
+
+import json
+from collections import defaultdict
+from datetime import timedelta
+
+from tornado import gen, websocket
+from tornado.concurrent import Future
+from tornado.httpclient import HTTPRequest
+from tornado.ioloop import IOLoop
+
+from ..broadcast import websocket_frame
+from ..logger import LOGGER
+from ..metrics import HANDSHAKES
+from ..mux import (
+    Subscription,
+    NODE_ID,
+    GROUP_ID,
+    MAX_NODE_ID,
+    control_frame,
+    group_message,
+    parse_group_message,
+)
+from .websocket_handler import WebsocketClientHandler, WORKER_HEADER
+
+
+class MuxWebsocketHandler(WebsocketClientHandler):
+    # pylint:disable=abstract-method,arguments-differ
+    # pylint:disable=attribute-defined-outside-init,too-many-instance-attributes
+    """Class that manage the websockets multiplexing the nodes of an experiment.
+
+    The connection is authenticated once, then the client subscribes to the
+    nodes of the experiment with JSON text control messages, choosing the id
+    tagging the binary frames of each node (see `Subscription`):
+
+    - ``{"subscribe": "m3-1", "id": 1}`` is answered by
+      ``{"subscribed": 1, "node": "m3-1"}``, the node data follow.
+    - ``{"unsubscribe": 1}`` is answered by ``{"unsubscribed": 1, "node":
+      "m3-1", "code": 1000, "reason": "..."}``, also sent when the server
+      ends the subscription.
+    - ``{"error": "...", "id": 1}`` reports an invalid control message or
+      data that could not be sent to a node.
+
+    Binary frames from the client are sent to the node of the subscription
+    whose id they start with. Binary frames starting with `GROUP_ID` send
+    their data to several nodes, see `group_message`, and are answered by
+    the result of each subscription, ``{"group": 1, "sent": {"1": "sent",
+    "2": "not connected"}}``, where ``group`` counts the group messages
+    of the connection. Subscriptions to the nodes owned by another worker
+    are forwarded to a multiplexed websocket to this worker, which does not
+    count in the websockets of the user.
+    """
+
+    def initialize(self, api, text=False):
+        super().initialize(api, text)
+        self.node = None
+        self.nodes_index = set()
+        self.subscriptions = {}
+        # Subscriptions handled by other workers, with their connection
+        self.forwarded = {}
+        self.workers = {}
+        self.subscribed = 0
+        # Opened by another worker to forward the subscriptions of its client
+        self.forwarding = False
+        self.groups = 0
+        # Group messages sent to each worker and their pending results
+        self._worker_groups = {}
+        self._group_results = {}
+
+    def _check_path(self):
+        path_elems = self.request.path.split("/")
+        self.site, self.experiment_id = path_elems[-3:-1]
+        return True
+
+    @gen.coroutine
+    def get(self, *args, **kwargs):  # pylint: disable=invalid-overridden-method
+        """Triggered before any websocket connection is opened.
+
+        The token of the user is checked and the nodes of the experiment are
+        fetched once for all the subscriptions.
+        """
+        LOGGER.info("Multiplexed websocket connection request")
+        self._check_path()
+        self.forwarding = self._from_worker()
+
+        nodes_index = yield self._authenticate()
+        if nodes_index is None:
+            return
+        self.nodes_index = nodes_index
+
+        if self.get_compression_options() is not None:
+            self._offer_window_bits()
+
+        yield super(WebsocketClientHandler, self).get(*args, **kwargs)
+
+        LOGGER.info(
+            "Multiplexed websocket connection for experiment '%s'",
+            self.experiment_id,
+        )
+
+    def _from_worker(self):
+        # The header is only trusted on the internal port of this worker
+        ports = self.settings["worker_ports"]
+        if WORKER_HEADER not in self.request.headers or not ports:
+            return False
+        address = self.request.connection.stream.socket.getsockname()
+        return address[1] == ports[self.settings["worker_id"]]
+
+    def _attach(self):
+        self.application.handle_mux_open(self)
+
+    def _control(self, **message):
+        try:
+            self.write_frame(control_frame(**message))
+        except websocket.WebSocketClosedError:
+            LOGGER.debug("Multiplexed websocket is closed")
+
+    @gen.coroutine
+    def on_message(self, message):
+        """Triggered when a message is received from the websocket client."""
+        if self.ws_connection is None or self.ws_connection.is_closing():
+            return
+        if isinstance(message, bytes):
+            self._on_data(message)
+            return
+        try:
+            request = json.loads(message)
+        except ValueError:
+            request = None
+        if isinstance(request, dict) and "subscribe" in request:
+            yield self._subscribe(request, message)
+        elif isinstance(request, dict) and "unsubscribe" in request:
+            self._unsubscribe(request, message)
+        else:
+            self._control(error="Invalid control message", id=None)
+
+    def _on_data(self, message):
+        if len(message) < NODE_ID.size:
+            self._control(error="Invalid data message", id=None)
+            return
+        (node_id,) = NODE_ID.unpack_from(message)
+        if node_id == GROUP_ID:
+            self._send_group(message)
+            return
+        self.frames_in += 1
+        self.bytes_in += len(message) - NODE_ID.size
+        if node_id in self.subscriptions:
+            subscription = self.subscriptions[node_id]
+            data = message[NODE_ID.size :]
+            self.application.handle_websocket_data(subscription, data)
+        elif self._forwarded(node_id) is not None:
+            self._forwarded(node_id).write_message(message, binary=True)
+        else:
+            self._control(error="Unknown subscription", id=node_id)
+
+    @gen.coroutine
+    def _send_group(self, message):
+        self.groups += 1
+        group = self.groups
+        try:
+            node_ids, data = parse_group_message(message)
+        except ValueError:
+            self._control(error="Invalid group message", group=group)
+            return
+        self.frames_in += 1
+        self.bytes_in += len(data)
+        results = {}
+        subscriptions = []
+        forwarded = defaultdict(list)
+        # Repeated ids don't send the data to a node again
+        for node_id in dict.fromkeys(node_ids):
+            if node_id in self.subscriptions:
+                subscriptions.append(self.subscriptions[node_id])
+            elif self._forwarded(node_id) is not None:
+                forwarded[self._forwarded(node_id)].append(node_id)
+            else:
+                results[node_id] = "unknown subscription"
+        worker_results = [
+            self._send_worker_group(upstream, forwarded_ids, data)
+            for upstream, forwarded_ids in forwarded.items()
+        ]
+        sent = yield self.application.handle_group_data(subscriptions, data)
+        results.update((subscription.id, sent[subscription]) for subscription in sent)
+        for worker_sent in (yield worker_results):
+            results.update(worker_sent)
+        self._control(group=group, sent=results)
+
+    @gen.coroutine
+    def _send_worker_group(self, upstream, node_ids, data):
+        # The worker counts the group messages like this handler does
+        group = self._worker_groups.get(upstream, 0) + 1
+        self._worker_groups[upstream] = group
+        result = self._group_results[(upstream, group)] = Future()
+        # Leave the worker one more second to answer
+        timeout = timedelta(seconds=self.settings["group_send_timeout"] + 1)
+        try:
+            upstream.write_message(group_message(node_ids, data), binary=True)
+            sent = yield gen.with_timeout(timeout, result)
+        except websocket.WebSocketClosedError:
+            sent = None
+        except gen.TimeoutError:
+            self._group_results.pop((upstream, group), None)
+            return {node_id: "timeout" for node_id in node_ids}
+        if sent is None:
+            return {node_id: "closed" for node_id in node_ids}
+        return {int(node_id): result for node_id, result in sent.items()}
+
+    @gen.coroutine
+    def _subscribe(self, request, message):
+        node, node_id = request["subscribe"], request.get("id")
+        if (
+            not isinstance(node_id, int)
+            or isinstance(node_id, bool)
+            or not 0 <= node_id <= MAX_NODE_ID
+        ):
+            self._control(error="Invalid subscription id", id=None)
+            return
+        if node_id in self.subscriptions or node_id in self.forwarded:
+            self._control(error="Subscription id already used", id=node_id)
+            return
+        if not isinstance(node, str) or (self.site, node) not in self.nodes_index:
+            LOGGER.warning("Reject subscription to invalid node '%s'", node)
+            HANDSHAKES.labels("rejected", "node").inc()
+            self._control(unsubscribed=node_id, node=node, reason="Invalid node")
+            return
+        if self._subscribed(node):
+            self._control(
+                unsubscribed=node_id, node=node, reason="Node already subscribed"
+            )
+            return
+
+        self.subscribed += 1
+        worker_port = self.application.worker_port(node)
+        if worker_port is not None:
+            yield self._forward(node, node_id, worker_port, message)
+            return
+
+        LOGGER.debug("Multiplexed websocket subscribed to node '%s'", node)
+        subscription = Subscription(self, node, node_id)
+        self.subscriptions[node_id] = subscription
+        self._control(subscribed=node_id, node=node)
+        self.application.handle_websocket_open(subscription)
+
+    @gen.coroutine
+    def _forward(self, node, node_id, port, message):
+        # The worker owning the node handles the subscription
+        self.forwarded[node_id] = (node, None)
+        upstream = yield self._worker(port)
+        if node_id not in self.forwarded:
+            return
+        if upstream is None:
+            del self.forwarded[node_id]
+            self._control(unsubscribed=node_id, node=node, reason="Worker unavailable")
+            return
+        self.forwarded[node_id] = (node, upstream)
+        upstream.write_message(message)
+
+    def _subscribed(self, node):
+        return any(
+            subscription.node == node for subscription in self.subscriptions.values()
+        ) or any(forwarded[0] == node for forwarded in self.forwarded.values())
+
+    def _unsubscribe(self, request, message):
+        node_id = request["unsubscribe"]
+        if not isinstance(node_id, int):
+            self._control(error="Invalid subscription id", id=None)
+        elif node_id in self.subscriptions:
+            self.subscriptions[node_id].close(code=1000, reason="Unsubscribed")
+        elif self._forwarded(node_id) is not None:
+            self._forwarded(node_id).write_message(message)
+        else:
+            self._control(error="Unknown subscription", id=node_id)
+
+    def _forwarded(self, node_id):
+        # Connection to the worker handling a subscription, once connected
+        return self.forwarded.get(node_id, (None, None))[1]
+
+    def unsubscribe(self, subscription, code, reason):
+        """End a subscription closed by the client or the application."""
+        LOGGER.debug("Multiplexed websocket unsubscribed from '%s'", subscription.node)
+        self.subscriptions.pop(subscription.id, None)
+        self._control(
+            unsubscribed=subscription.id,
+            node=subscription.node,
+            code=code,
+            reason=reason,
+        )
+        # The application may be iterating on the websockets of the node
+        IOLoop.current().add_callback(
+            self.application.handle_websocket_close, subscription
+        )
+
+    def _worker(self, port):
+        if port not in self.workers:
+            self.workers[port] = self._connect_worker(port)
+        return self.workers[port]
+
+    @gen.coroutine
+    def _connect_worker(self, port):
+        subprotocols = self.request.headers.get("Sec-WebSocket-Protocol", "")
+        LOGGER.debug("Forward subscriptions to worker %d", port)
+        try:
+            request = HTTPRequest(
+                f"ws://127.0.0.1:{port}{self.request.uri}",
+                headers={WORKER_HEADER: str(self.settings["worker_id"])},
+            )
+            upstream = yield websocket.websocket_connect(
+                request,
+                subprotocols=[protocol.strip() for protocol in subprotocols.split(",")],
+            )
+        except Exception:  # pylint:disable=broad-except
+            LOGGER.warning("Cannot connect to worker %d", port)
+            HANDSHAKES.labels("rejected", "worker").inc()
+            del self.workers[port]
+            return None
+        if self.ws_connection is None:
+            upstream.close()
+            return None
+        self._pump_worker(upstream)
+        return upstream
+
+    @gen.coroutine
+    def _pump_worker(self, upstream):
+        while True:
+            message = yield upstream.read_message()
+            if message is None:
+                break
+            if isinstance(message, bytes):
+                frame = websocket_frame(message, binary=True)
+            else:
+                reply = json.loads(message)
+                if "sent" in reply:
+                    result = self._group_results.pop((upstream, reply["group"]), None)
+                    if result is not None:
+                        result.set_result(reply["sent"])
+                    continue
+                if "unsubscribed" in reply:
+                    self.forwarded.pop(reply["unsubscribed"], None)
+                frame = websocket_frame(message.encode("utf-8"), binary=False)
+            try:
+                self.write_frame(frame)
+            except websocket.WebSocketClosedError:
+                break
+        self.workers = {
+            port: worker
+            for port, worker in self.workers.items()
+            if not worker.done() or worker.result() is not upstream
+        }
+        self._worker_groups.pop(upstream, None)
+        for (worker, group), result in list(self._group_results.items()):
+            if worker is upstream:
+                del self._group_results[(worker, group)]
+                result.set_result(None)
+        for node_id, (node, forwarded) in list(self.forwarded.items()):
+            if forwarded is upstream:
+                del self.forwarded[node_id]
+                self._control(
+                    unsubscribed=node_id,
+                    node=node,
+                    code=upstream.close_code,
+                    reason=upstream.close_reason,
+                )
+
+    def _drained(self):
+        # All the subscribed nodes may keep up with the websocket again
+        for subscription in self.subscriptions.values():
+            self.application.handle_websocket_drain(subscription)
+
+    def _detach(self):
+        for subscription in list(self.subscriptions.values()):
+            subscription.closed = True
+            self.application.handle_websocket_close(subscription)
+        self.subscriptions.clear()
+        self.forwarded.clear()
+        for worker in self.workers.values():
+            if worker.done() and worker.result() is not None:
+                worker.result().close()
+        self.application.handle_mux_close(self)
+
+    def session(self):
+        """Return the summary of the websocket session."""
+        summary = super().session()
+        summary["subscriptions"] = self.subscribed
+        summary["groups"] = self.groups
+        return summary
@@ -0,0 +1,101 @@
+"""iotlabwebsocket resumable websocket sessions handler."""
+
+from tornado import gen
+
+from ..logger import LOGGER
+from ..metrics import HANDSHAKES
+from ..sessions import session_id
+from .websocket_handler import WebsocketClientHandler, SESSION_ID_HEADER
+
+
+class SessionWebsocketHandler(WebsocketClientHandler):
+    # pylint:disable=abstract-method,arguments-differ
+    # pylint:disable=attribute-defined-outside-init
+    """Class that manage the websockets of resumable sessions.
+
+    A new session is authenticated like other websockets, its id is
+    returned in the ``X-Session-Id`` handshake response header. The node
+    data are sent in binary frames starting with their offset, see
+    `Session`. A websocket resumes a session with the ``session`` and
+    ``offset`` query arguments, without authentication. The client ends the
+    session by closing its websocket with the 1000 status code.
+    """
+
+    def initialize(self, api, text=False):
+        super().initialize(api, text)
+        self.session_id = None
+        self.resume_offset = None
+        self.resumable_session = None
+
+    @gen.coroutine
+    def get(self, *args, **kwargs):  # pylint: disable=invalid-overridden-method
+        """Triggered before any websocket connection is opened.
+
+        New sessions are checked like other websockets, resumed sessions
+        must belong to the requested node.
+        """
+        resumed_id = self.get_argument("session", None)
+        if resumed_id is None:
+            self.session_id = session_id()
+            yield super().get(*args, **kwargs)
+            return
+
+        LOGGER.info("Websocket session resume request")
+        self._check_path()
+
+        # The worker owning the node owns its sessions
+        worker_port = self.application.worker_port(self.node)
+        if worker_port is not None:
+            yield self._proxy(worker_port, *args, **kwargs)
+            return
+
+        if not self._check_session(resumed_id) or not self._check_offset():
+            return
+        self.session_id = resumed_id
+        self.user = self.resumable_session.user
+        self._set_handshake_headers()
+        yield super(WebsocketClientHandler, self).get(*args, **kwargs)
+
+    def _check_session(self, resumed_id):
+        session = self.application.sessions.get(resumed_id)
+        if (
+            session is None
+            or session.closed
+            or (session.site, session.experiment_id, session.node)
+            != (self.site, self.experiment_id, self.node)
+        ):
+            LOGGER.warning("Reject websocket connection: unknown session")
+            HANDSHAKES.labels("rejected", "session").inc()
+            self.set_status(404)
+            self.finish("Unknown session")
+            return False
+        self.resumable_session = session
+        return True
+
+    def _check_offset(self):
+        offset = self.get_argument("offset", "0")
+        if not offset.isdigit():
+            LOGGER.warning("Reject websocket connection: invalid offset '%s'", offset)
+            HANDSHAKES.labels("rejected", "offset").inc()
+            self.set_status(400)
+            self.finish(f"Invalid offset '{offset}'")
+            return False
+        self.resume_offset = int(offset)
+        return True
+
+    def _set_handshake_headers(self):
+        super()._set_handshake_headers()
+        self.set_header(SESSION_ID_HEADER, self.session_id)
+
+    def _attach(self):
+        self.application.handle_session_open(self)
+
+    def _detach(self):
+        self.application.handle_session_close(self)
+
+    def session(self):
+        """Return the summary of the websocket session."""
+        summary = super().session()
+        summary["session_id"] = self.session_id
+        summary["resumed"] = self.resume_offset is not None
+        return summary
@@ -1,13 +1,47 @@
 """iotlabwebserial websocket connections handler."""
 
-from tornado import websocket, gen
+import time
+import logging
+from collections import deque
 
-from ..logger import LOGGER
+from tornado import websocket, gen, httpclient
+from tornado.iostream import StreamClosedError
+
+from ..broadcast import FRAMINGS, frame_payload
+from ..logger import LOGGER, SESSION_LOGGER
+from ..metrics import HANDSHAKES, FRAMES_SENT, FRAMES_SENT_BYTES, DROPPED_FRAMES
+
+COMPRESSION_LEVEL = 1
+COMPRESSION_MEM_LEVEL = 8
+COMPRESSION_WINDOW_BITS = 15
+# Messages shorter than this are not compressed
+COMPRESSION_MIN_SIZE = 128
+# Maximum number of bytes waiting to be written to a websocket and policy
+# applied to frames that don't fit.
+WRITE_QUEUE_SIZE = 256 * 1024
+WRITE_QUEUE_POLICIES = ("drop-oldest", "drop-newest", "disconnect")
+# Reads from a node are paused when all its websockets buffer more than the
+# high-water mark and resumed when one buffers less than the low-water mark.
+WRITE_HIGH_WATER_MARK = 64 * 1024
+WRITE_LOW_WATER_MARK = 16 * 1024
+# Handshake response header of the offset of the first scrollback byte sent
+SCROLLBACK_OFFSET_HEADER = "X-Scrollback-Offset"
+# Handshake response header of the id of a resumable session
+SESSION_ID_HEADER = "X-Session-Id"
+# Request header of the multiplexed websockets forwarded by another worker
+WORKER_HEADER = "X-Iotlab-Worker"
+# Handshake response headers of the owning worker returned to proxied clients
+PROXIED_HEADERS = (SCROLLBACK_OFFSET_HEADER, SESSION_ID_HEADER)
+
+
+def _discard(future):
+    """Ignore the result of a future that is no longer awaited."""
+    future.add_done_callback(lambda future: future.cancelled() or future.exception())
 
 
 class WebsocketClientHandler(websocket.WebSocketHandler):
     # pylint:disable=abstract-method,arguments-differ
-    # pylint:disable=attribute-defined-outside-init
+    # pylint:disable=attribute-defined-outside-init,too-many-instance-attributes
     """Class that manage websocket connections."""
 
     def _check_path(self):
@@ -19,51 +53,92 @@ class WebsocketClientHandler(websocket.WebSocketHandler):
             self.site, self.experiment_id, self.node = path_elems[-5:-2]
         return True
 
+    def _check_framing(self):
+        # Line framing is only available to text websockets
+        if self.text:
+            self.framing = self.get_argument("framing", self.framing)
+        if self.framing not in FRAMINGS:
+            LOGGER.warning(
+                "Reject websocket connection: invalid framing '%s'", self.framing
+            )
+            HANDSHAKES.labels("rejected", "framing").inc()
+            self.set_status(400)
+            self.finish(f"Invalid framing '{self.framing}'")
+            return False
+        return True
+
+    def _check_since(self):
+        since = self.get_argument("since", None)
+        if since is None:
+            return True
+        if not since.isdigit():
+            LOGGER.warning("Reject websocket connection: invalid offset '%s'", since)
+            HANDSHAKES.labels("rejected", "since").inc()
+            self.set_status(400)
+            self.finish(f"Invalid offset '{since}'")
+            return False
+        self.since = int(since)
+        return True
+
+    def _offer_window_bits(self):
+        # Tornado only accepts the window size proposed by the client, the
+        # server size is added to the client offers when it's smaller.
+        window_bits = self.settings["compression_window_bits"]
+        extensions = self.request.headers.get("Sec-WebSocket-Extensions")
+        if not extensions or window_bits >= COMPRESSION_WINDOW_BITS:
+            return
+        offers = []
+        for offer in extensions.split(","):
+            if (
+                offer.strip().startswith("permessage-deflate")
+                and "server_max_window_bits" not in offer
+            ):
+                offer = f"{offer}; server_max_window_bits={window_bits}"
+            offers.append(offer)
+        self.request.headers["Sec-WebSocket-Extensions"] = ",".join(offers)
+
     def select_subprotocol(self, subprotocols):
         """Only accept the 'token' subprotocol"""
         if "token" in subprotocols:
             return "token"
         return None
 
-    @gen.coroutine
     def _check_subprotocols(self, subprotocols):
         if len(subprotocols) != 3 or subprotocols[1].strip() != "token":
             LOGGER.warning("Reject websocket connection: invalib subprotocol")
+            HANDSHAKES.labels("rejected", "subprotocol").inc()
             self.set_status(401)  # Authentication failed
             self.finish("Invalid subprotocols")
             return False
+        return True
 
-        req_token = subprotocols[2].strip()
-
-        # Fetch the token from the authentication server
-        api_token = yield self.api.fetch_token_async(self.experiment_id)
-
+    def _check_token(self, req_token, api_token):
         LOGGER.debug(
             "Fetched token '%s' for experiment id '%s'", api_token, self.experiment_id
         )
 
         if req_token != api_token:
-            LOGGER.warning(f"Reject websocket connection: invalib token '{req_token}'")
+            LOGGER.warning("Reject websocket connection: invalib token '%s'", req_token)
+            HANDSHAKES.labels("rejected", "token").inc()
             self.set_status(401)  # Authentication failed
             self.finish(f"Invalid token '{req_token}'")
             return False
 
-        LOGGER.debug(f"Provided token '{req_token}' verified")
+        LOGGER.debug("Provided token '%s' verified", req_token)
         return True
 
-    @gen.coroutine
-    def _check_node(self):
-        nodes = yield self.api.fetch_nodes_async(self.experiment_id)
-        for node in nodes:
-            node_elem = node.split(".")
-            if node_elem[0] == self.node and node_elem[1] == self.site:
-                LOGGER.debug("Requested node found in experiment")
-                return True
+    def _check_node(self, nodes_index):
+        if (self.site, self.node) in nodes_index:
+            LOGGER.debug("Requested node found in experiment")
+            return True
 
         LOGGER.warning(
-            f"Invalid node '{self.node}' for experiment id "
-            f"'{self.experiment_id}' in site '{self.site}'"
+            "Invalid node '%s' for experiment id '%s' in site '%s'",
+            self.node,
+            self.experiment_id,
+            self.site,
         )
+        HANDSHAKES.labels("rejected", "node").inc()
         # No node matches the requested ressource for the experiment and site.
         self.set_status(401)  # Authentication failed
         self.finish("Invalid node")
@@ -73,13 +148,38 @@ class WebsocketClientHandler(websocket.WebSocketHandler):
         """Initialize the api and binary information."""
         self.api = api
         self.text = text
+        self.framing = "chunk"
+        self.since = None
+        self.compressed = False
+        self.queue = deque()
+        self.queue_bytes = 0
+        self.dropped_frames = 0
+        self.dropped_bytes = 0
+        self._write_future = None
+        self._write_bytes = 0
+        self._queue_traces = []
+        self.upstream = None
+        # Session summary, see `session`
+        self.user = None
+        self.requested = time.monotonic()
+        self.opened = None
+        self.api_durations = {}
+        self.frames_in = 0
+        self.bytes_in = 0
+        self.frames_out = 0
+        self.bytes_out = 0
 
     @gen.coroutine
     def get(self, *args, **kwargs):  # pylint: disable=invalid-overridden-method
         """Triggered before any websocket connection is opened.
 
         This method checks if the url path is valid: the url path be in the
-        form /ws/<experiment_id>/<node_id>.
+        form /ws/<experiment_id>/<node_id>. Text websockets can request
+        line framing with the ``framing=line`` query argument.
+        When the scrollback is enabled, the websocket first receives the
+        last bytes of the node from the ``since`` query argument offset, the
+        offset of the first byte sent is returned in the
+        ``X-Scrollback-Offset`` header.
         This method also checks that the token provided in the websocket
         connection matches the corresponding one generated on the
         authentication host.
@@ -92,45 +192,155 @@ class WebsocketClientHandler(websocket.WebSocketHandler):
         # Check path is always True
         self._check_path()
 
-        # Verify token provided in subprotocols, since there's an asynchronous
-        # call to the API, we wait for it to complete.
-        subprotocols = self.request.headers.get("Sec-WebSocket-Protocol", "").split(",")
-        valid_subprotocols = yield self._check_subprotocols(subprotocols)
-        if not valid_subprotocols:
+        if not self._check_framing() or not self._check_since():
             return
 
-        self.user = subprotocols[0].strip()
+        # The worker owning the node checks and handles the connection
+        worker_port = self.application.worker_port(self.node)
+        if worker_port is not None:
+            yield self._proxy(worker_port, *args, **kwargs)
+            return
 
         # Check that the requested node is in the experiment
-        node_valid = yield self._check_node()
-        if not node_valid:
+        nodes_index = yield self._authenticate()
+        if nodes_index is None or not self._check_node(nodes_index):
             return
 
+        if self.get_compression_options() is not None:
+            self._offer_window_bits()
+
+        self._set_handshake_headers()
+
         # Let parent class correctly configure the websocket connection
         yield super(WebsocketClientHandler, self).get(*args, **kwargs)
 
         LOGGER.info(
-            f"Websocket connection for experiment '{self.experiment_id}' "
-            f"on node '{self.node}'"
+            "Websocket connection for experiment '%s' on node '%s'",
+            self.experiment_id,
+            self.node,
         )
 
+    @gen.coroutine
+    def _authenticate(self):
+        """Check the token of the user and return the experiment nodes index.
+
+        Return None when the connection is rejected.
+        """
+        # Verify the format of the subprotocols before querying the API
+        subprotocols = self.request.headers.get("Sec-WebSocket-Protocol", "").split(",")
+        if not self._check_subprotocols(subprotocols):
+            return None
+
+        # Fetch the token and the experiment nodes concurrently, so the
+        # handshake only waits for one API round-trip.
+        token_future = self.api.fetch_token_async(self.experiment_id)
+        nodes_future = self.api.fetch_nodes_index_async(self.experiment_id)
+
+        try:
+            api_token = yield token_future
+        except Exception:
+            HANDSHAKES.labels("rejected", "api").inc()
+            _discard(nodes_future)
+            raise
+        self.api_durations["token"] = time.monotonic() - self.requested
+        if not self._check_token(subprotocols[2].strip(), api_token):
+            _discard(nodes_future)
+            return None
+
+        self.user = subprotocols[0].strip()
+
+        try:
+            nodes_index = yield nodes_future
+        except Exception:
+            HANDSHAKES.labels("rejected", "api").inc()
+            raise
+        self.api_durations["nodes"] = time.monotonic() - self.requested
+        return nodes_index
+
+    def _set_handshake_headers(self):
+        scrollbacks = self.application.scrollbacks
+        if scrollbacks is not None:
+            # Data received until the websocket is opened are sent too
+            self.since = scrollbacks.offset(self.node, self.since)
+            self.set_header(SCROLLBACK_OFFSET_HEADER, str(self.since))
+
+    @gen.coroutine
+    def _proxy(self, port, *args, **kwargs):
+        subprotocols = self.request.headers.get("Sec-WebSocket-Protocol", "")
+        LOGGER.debug("Proxy websocket connection for node '%s' to %d", self.node, port)
+        try:
+            self.upstream = yield websocket.websocket_connect(
+                f"ws://127.0.0.1:{port}{self.request.uri}",
+                subprotocols=[protocol.strip() for protocol in subprotocols.split(",")],
+            )
+        except httpclient.HTTPClientError as exc:
+            self.set_status(exc.code)
+            self.finish(exc.response.body if exc.response is not None else None)
+            return
+        except (OSError, StreamClosedError):
+            LOGGER.warning("Cannot connect to the worker of node '%s'", self.node)
+            HANDSHAKES.labels("rejected", "worker").inc()
+            self.set_status(502)
+            self.finish("Worker unavailable")
+            return
+        for header in PROXIED_HEADERS:
+            if header in self.upstream.headers:
+                self.set_header(header, self.upstream.headers[header])
+        yield super(WebsocketClientHandler, self).get(*args, **kwargs)
+        if self.ws_connection is None:
+            self.upstream.close()
+
+    @gen.coroutine
+    def _pump_upstream(self):
+        while True:
+            message = yield self.upstream.read_message()
+            if message is None:
+                break
+            try:
+                yield self.write_message(message, binary=isinstance(message, bytes))
+            except websocket.WebSocketClosedError:
+                break
+        self.close(self.upstream.close_code, self.upstream.close_reason)
+
     def check_origin(self, origin):
         """Allow connections from anywhere."""
         return True
 
+    def get_compression_options(self):
+        """Enable permessage-deflate when configured in the application."""
+        return self.settings.get("websocket_compression_options")
+
     @gen.coroutine
     def open(self):
         """Accept all incoming connections.
 
         After 2s, if the connection is not authentified, it's closed.
         """
+        self.opened = time.monotonic()
         self.set_nodelay(True)
-        LOGGER.debug(f"Websocket connection opened for node '{self.node}'")
+        self.compressed = (
+            self.get_compression_options() is not None
+            and "permessage-deflate"
+            in self.request.headers.get("Sec-WebSocket-Extensions", "")
+        )
+        LOGGER.debug("Websocket connection opened for node '%s'", self.node)
+        if self.upstream is not None:
+            self._pump_upstream()
+            return
+        self._attach()
+
+    def _attach(self):
         self.application.handle_websocket_open(self)
 
     @gen.coroutine
     def on_message(self, message):
         """Triggered when data is received from the websocket client."""
+        if self.upstream is not None:
+            try:
+                self.upstream.write_message(message, binary=isinstance(message, bytes))
+            except websocket.WebSocketClosedError:
+                LOGGER.debug("Proxied websocket of node '%s' is closed", self.node)
+            return
         if self.text:
             try:
                 data = message.encode("utf-8")
@@ -138,12 +348,162 @@ class WebsocketClientHandler(websocket.WebSocketHandler):
                 return
         else:
             data = message
+        self.frames_in += 1
+        self.bytes_in += len(data)
         self.application.handle_websocket_data(self, data)
 
+    @property
+    def buffered_bytes(self):
+        """Number of bytes being written or queued for this websocket."""
+        return self._write_bytes + self.queue_bytes
+
+    def write_frame(self, frame):
+        """Write a websocket frame built by the application.
+
+        Only one write is pending on the connection at a time, frames written
+        in the meantime are queued. When the queue exceeds the
+        ``write_queue_size`` setting, the ``write_queue_policy`` setting
+        decides whether the oldest or the newest frames are dropped, or if
+        the websocket is closed.
+
+        When compression is negotiated, frames longer than the
+        ``compression_min_size`` setting are compressed before being sent.
+        Raises `WebSocketClosedError` if the connection is already closed.
+        """
+        if self.ws_connection is None or self.ws_connection.is_closing():
+            raise websocket.WebSocketClosedError()
+        if self._write_future is None:
+            self._send([frame])
+        else:
+            self._enqueue(frame)
+
+    def trace_write(self, trace):
+        """Follow the write of the last frame given to `write_frame`."""
+        if self.queue:
+            self._queue_traces.append(trace)
+        elif self._write_future is not None:
+            trace.follow(self._write_future)
+
+    def _enqueue(self, frame):
+        max_size = self.settings["write_queue_size"]
+        policy = self.settings["write_queue_policy"]
+        if self.queue_bytes + len(frame) > max_size:
+            if policy == "disconnect":
+                LOGGER.warning("Websocket client of node '%s' is too slow", self.node)
+                self._drop(list(self.queue) + [frame])
+                self._clear_queue()
+                self.close(code=1008, reason="Websocket client is too slow")
+                return
+            if policy == "drop-newest" or len(frame) > max_size:
+                self._drop([frame])
+                return
+            while self.queue_bytes + len(frame) > max_size:
+                oldest = self.queue.popleft()
+                self.queue_bytes -= len(oldest)
+                self._drop([oldest])
+        self.queue.append(frame)
+        self.queue_bytes += len(frame)
+
+    def _drop(self, frames):
+        if not self.dropped_frames:
+            LOGGER.warning("Dropping frames of slow websocket for node '%s'", self.node)
+        self.dropped_frames += len(frames)
+        self.dropped_bytes += sum(len(frame) for frame in frames)
+        DROPPED_FRAMES.inc(len(frames))
+
+    def _clear_queue(self):
+        frames = list(self.queue)
+        self.queue.clear()
+        self.queue_bytes = 0
+        return frames
+
+    def _send(self, frames):
+        if not self.compressed:
+            future = self.ws_connection.stream.write(b"".join(frames))
+        else:
+            for frame in frames:
+                if len(frame) >= self.settings["compression_min_size"]:
+                    payload, binary = frame_payload(frame)
+                    future = self.ws_connection.write_message(payload, binary=binary)
+                else:
+                    future = self.ws_connection.stream.write(frame)
+        self._write_future = future
+        self._write_bytes = sum(len(frame) for frame in frames)
+        self.frames_out += len(frames)
+        self.bytes_out += self._write_bytes
+        FRAMES_SENT.inc(len(frames))
+        FRAMES_SENT_BYTES.inc(self._write_bytes)
+        future.add_done_callback(self._on_write_done)
+
+    def _on_write_done(self, future):
+        self._write_future = None
+        self._write_bytes = 0
+        frames = self._clear_queue()
+        traces, self._queue_traces = self._queue_traces, []
+        if (
+            future.exception() is not None
+            or self.ws_connection is None
+            or self.ws_connection.is_closing()
+        ):
+            return
+        if frames:
+            self._send(frames)
+            for trace in traces:
+                trace.follow(self._write_future)
+        if self.buffered_bytes < self.settings["write_low_water_mark"]:
+            self._drained()
+
+    def _drained(self):
+        self.application.handle_websocket_drain(self)
+
     def on_close(self):
         """Manage the disconnection of the websocket."""
         LOGGER.info(
-            f"Websocket connection closed for node '{self.node}', "
-            f"code: {self.close_code}, reason: '{self.close_reason}'"
+            "Websocket connection closed for node '%s', code: %s, reason: '%s'",
+            self.node,
+            self.close_code,
+            self.close_reason,
         )
+        if self.upstream is not None:
+            self.upstream.close(self.close_code, self.close_reason)
+            return
+        if SESSION_LOGGER.isEnabledFor(logging.INFO):
+            SESSION_LOGGER.info(self.session())
+        self._detach()
+
+    def _detach(self):
         self.application.handle_websocket_close(self)
+
+    def session(self):
+        """Return the summary of the websocket session.
+
+        Durations are in seconds, API fetch durations are measured from the
+        connection request. The handshake and session durations are null
+        when the connection was closed before it was opened. Data "in" is
+        received from the websocket client, data "out" is sent to it.
+        """
+        closed = time.monotonic()
+        handshake_duration = duration = None
+        if self.opened is not None:
+            handshake_duration = self.opened - self.requested
+            duration = closed - self.opened
+        return {
+            "user": self.user,
+            "site": self.site,
+            "experiment_id": self.experiment_id,
+            "node": self.node,
+            "text": self.text,
+            "framing": self.framing,
+            "compressed": self.compressed,
+            "handshake_duration": handshake_duration,
+            "api_durations": self.api_durations,
+            "duration": duration,
+            "frames_in": self.frames_in,
+            "bytes_in": self.bytes_in,
+            "frames_out": self.frames_out,
+            "bytes_out": self.bytes_out,
+            "dropped_frames": self.dropped_frames,
+            "dropped_bytes": self.dropped_bytes,
+            "close_code": self.close_code,
+            "close_reason": self.close_reason,
+        }
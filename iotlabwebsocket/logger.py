@@ -1,26 +1,172 @@
 """Common variables module."""
 
 import sys
+import json
+import queue
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+
+from .metrics import DROPPED_LOGS
 
 LOGGER = logging.getLogger("iotlabwebsocket")
 LOGGER.setLevel(logging.DEBUG)
 
+# Websocket session records are info records of their own logger, only
+# enabled by setup_session_logger.
+SESSION_LOGGER = logging.getLogger("iotlabwebsocket.sessions")
+SESSION_LOGGER.setLevel(logging.WARNING)
+SESSION_LOGGER.propagate = False
+SESSION_LOG_MAX_BYTES = 10000000
+SESSION_LOG_BACKUP_COUNT = 5
+
+# Maximum number of log records waiting to be written and number of
+# characters of formatted records written to the log file at once.
+LOG_QUEUE_SIZE = 10000
+LOG_BUFFER_SIZE = 64 * 1024
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Queue handler dropping records when the bounded queue is full.
+
+    Unlike `QueueHandler`, records are not formatted when enqueued: the
+    message arguments are formatted by the handlers of the listener thread.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        if record.exc_info:
+            # Tracebacks are formatted while the frames are still alive
+            logging.Formatter().format(record)
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            DROPPED_LOGS.inc()
+
+
+class BufferedRotatingFileHandler(RotatingFileHandler):
+    """Rotating file handler writing formatted records by batches.
+
+    Records are written when `flush` is called or when more than
+    ``buffer_size`` characters are buffered. The file is rotated before a
+    batch would make it exceed ``maxBytes``.
+    """
+
+    def __init__(self, filename, max_bytes, backup_count, buffer_size=LOG_BUFFER_SIZE):
+        super().__init__(filename, "a", maxBytes=max_bytes, backupCount=backup_count)
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._buffered = 0
+
+    def emit(self, record):
+        try:
+            message = self.format(record) + self.terminator
+        except Exception:  # pylint:disable=broad-except
+            self.handleError(record)
+            return
+        self._buffer.append(message)
+        self._buffered += len(message)
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self._buffer:
+                return
+            text = "".join(self._buffer)
+            self._buffer = []
+            self._buffered = 0
+            if self.stream is None:
+                self.stream = self._open()
+            # An empty file is not rotated, even for a batch larger than maxBytes
+            position = self.stream.tell()
+            if self.maxBytes and position > 0 and position + len(text) > self.maxBytes:
+                self.doRollover()
+            self.stream.write(text)
+            super().flush()
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records whose message is a dictionary as JSON lines."""
+
+    def format(self, record):
+        return json.dumps({"time": round(record.created, 6), **record.msg})
+
+
+class LogListener(QueueListener):
+    """Queue listener flushing its handlers when the queue is empty."""
+
+    def dequeue(self, block):
+        if block:
+            try:
+                return self.queue.get_nowait()
+            except queue.Empty:
+                for handler in self.handlers:
+                    handler.flush()
+        return self.queue.get(block)
+
+    def stop(self):
+        super().stop()
+        for handler in self.handlers:
+            handler.flush()
+
 
 def setup_server_logger(log_file=None, log_console=False):
-    """Setup logger for client application."""
+    """Setup logger for client application.
+
+    Records are written by a background thread, the returned `LogListener`
+    must be stopped to flush them. Return None when there is no log
+    handler.
+    """
     formatter = logging.Formatter(
         "%(asctime)-15s %(levelname)-7s %(filename)20s:%(lineno)-3d %(message)s"
     )
+    handlers = []
     if log_console:
         console_handler = logging.StreamHandler(sys.stdout)
         console_handler.setFormatter(formatter)
         console_handler.setLevel(logging.INFO)
-        LOGGER.addHandler(console_handler)
+        handlers.append(console_handler)
 
     if log_file is not None:
-        server = RotatingFileHandler(log_file, "a", maxBytes=1000000, backupCount=1)
+        server = BufferedRotatingFileHandler(log_file, 1000000, 1)
         server.setFormatter(formatter)
         server.setLevel(logging.DEBUG)
-        LOGGER.addHandler(server)
+        handlers.append(server)
+
+    if not handlers:
+        return None
+    # Records no handler writes are neither created nor queued
+    LOGGER.setLevel(min(handler.level for handler in handlers))
+    return _start_listener(LOGGER, handlers)
+
+
+def setup_session_logger(session_log=None):
+    """Setup the JSON records of the websocket sessions.
+
+    Records are written to ``session_log`` by a background thread, the
+    returned `LogListener` must be stopped to flush them. Return None when
+    there is no session log.
+    """
+    if session_log is None:
+        return None
+    handler = BufferedRotatingFileHandler(
+        session_log, SESSION_LOG_MAX_BYTES, SESSION_LOG_BACKUP_COUNT
+    )
+    handler.setFormatter(JsonFormatter())
+    SESSION_LOGGER.setLevel(logging.INFO)
+    return _start_listener(SESSION_LOGGER, [handler])
+
+
+def _start_listener(logger, handlers):
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    logger.addHandler(DroppingQueueHandler(log_queue))
+    listener = LogListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
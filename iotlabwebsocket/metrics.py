@@ -0,0 +1,242 @@
+"""Metrics of the relay in the Prometheus text exposition format.
+
+Metrics are updated from the event loop only, updates don't lock and
+only touch numbers: labels and values are formatted when scraped.
+"""
+
+import bisect
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+PREFIX = "iotlab_websocket_"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+RELAY_LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _sample(name, labels, value):
+    """Return a sample line of the exposition format.
+
+    >>> _sample("up", {"node": 'm3-"1"'}, 1)
+    'up{node="m3-\\\\"1\\\\""} 1'
+    """
+    if not labels:
+        return f"{name} {value}"
+    pairs = ",".join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+    return f"{name}{{{pairs}}} {value}"
+
+
+class Metric:
+    """Base class of the metrics."""
+
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labelnames = labelnames
+
+    def samples(self, labels=None):
+        """Return the exposition lines of the metric samples.
+
+        ``labels`` are added to the labels of every sample.
+        """
+        raise NotImplementedError
+
+    def exposition(self, labels=None):
+        """Return the metric in the exposition format."""
+        return "\n".join(
+            [
+                f"# HELP {self.name} {self.documentation}",
+                f"# TYPE {self.name} {self.kind}",
+            ]
+            + self.samples(labels)
+        )
+
+
+class LabelledMetric(Metric):
+    """Base class of the metrics updated by the application.
+
+    `labels` returns the child metric of the label values, children can be
+    kept by the callers to update them without any lookup.
+    """
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._children = {}
+
+    def _new_child(self):
+        return type(self)(self.name, self.documentation)
+
+    def labels(self, *values):
+        """Return the child metric of the label values."""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+            child.name = self.name
+        return child
+
+    def labelled_samples(self, labels):
+        """Return the exposition lines of the metric with ``labels``."""
+        raise NotImplementedError
+
+    def samples(self, labels=None):
+        if not self.labelnames:
+            return self.labelled_samples(dict(labels or {}))
+        lines = []
+        for values, child in sorted(self._children.items()):
+            lines.extend(
+                child.labelled_samples(
+                    {**dict(zip(self.labelnames, values)), **(labels or {})}
+                )
+            )
+        return lines
+
+
+class Counter(LabelledMetric):
+    """Monotonic counter."""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.value = 0
+
+    def inc(self, amount=1):
+        """Increment the counter."""
+        self.value += amount
+
+    def labelled_samples(self, labels):
+        return [_sample(f"{self.name}_total", labels, self.value)]
+
+
+class Histogram(LabelledMetric):
+    """Distribution of observed values in cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def _new_child(self):
+        return Histogram(self.name, self.documentation, buckets=self.buckets)
+
+    def observe(self, value):
+        """Account an observed value."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def labelled_samples(self, labels):
+        lines = []
+        count = 0
+        for bound, bucket_count in zip(self.buckets + ("+Inf",), self.counts):
+            count += bucket_count
+            lines.append(_sample(f"{self.name}_bucket", {**labels, "le": bound}, count))
+        lines.append(_sample(f"{self.name}_sum", labels, self.sum))
+        lines.append(_sample(f"{self.name}_count", labels, count))
+        return lines
+
+
+class Gauge(Metric):
+    """Value computed when the metrics are scraped.
+
+    ``collect`` returns a dictionary of the values by label values tuple.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), collect=dict):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def samples(self, labels=None):
+        return [
+            _sample(
+                self.name,
+                {**dict(zip(self.labelnames, values)), **(labels or {})},
+                value,
+            )
+            for values, value in sorted(self.collect().items())
+        ]
+
+
+HANDSHAKES = Counter(
+    "handshakes",
+    "Websocket handshakes by result and rejection reason.",
+    ("result", "reason"),
+)
+API_FETCH_SECONDS = Histogram(
+    "api_fetch_seconds", "Latency of the REST API requests.", ("resource",)
+)
+TCP_RECEIVED_BYTES = Counter("tcp_received_bytes", "Bytes received from the nodes.")
+TCP_SENT_BYTES = Counter("tcp_sent_bytes", "Bytes sent to the nodes.")
+FRAMES_SENT = Counter("frames_sent", "Websocket frames sent to the clients.")
+FRAMES_SENT_BYTES = Counter(
+    "frames_sent_bytes", "Bytes of the websocket frames sent to the clients."
+)
+DROPPED_FRAMES = Counter(
+    "dropped_frames", "Frames dropped from the write queues of slow websockets."
+)
+DECODE_ERRORS = Counter(
+    "decode_errors", "Invalid UTF-8 sequences received by text websockets."
+)
+RATE_LIMITED = Counter(
+    "rate_limited", "Chunks of node data exceeding the rate limits.", ("action",)
+)
+DROPPED_LOGS = Counter(
+    "dropped_logs", "Log records dropped because the log queue was full."
+)
+CAPTURE_DROPPED_BYTES = Counter(
+    "capture_dropped_bytes", "Captured bytes dropped because the disk was too slow."
+)
+RELAY_LATENCY_SECONDS = Histogram(
+    "relay_latency_seconds",
+    "Latency of sampled node data from the TCP read to its fan-out "
+    "(dispatch), then to the end of the websocket writes (write), and both "
+    "(total).",
+    ("stage",),
+    buckets=RELAY_LATENCY_BUCKETS,
+)
+
+METRICS = (
+    HANDSHAKES,
+    API_FETCH_SECONDS,
+    TCP_RECEIVED_BYTES,
+    TCP_SENT_BYTES,
+    FRAMES_SENT,
+    FRAMES_SENT_BYTES,
+    DROPPED_FRAMES,
+    DECODE_ERRORS,
+    RATE_LIMITED,
+    DROPPED_LOGS,
+    CAPTURE_DROPPED_BYTES,
+    RELAY_LATENCY_SECONDS,
+)
+
+
+def exposition(metrics, labels=None):
+    """Return the metrics in the Prometheus text exposition format.
+
+    ``labels`` are added to the labels of every sample, e.g. the worker
+    process serving the request.
+    """
+    return "\n".join(metric.exposition(labels) for metric in metrics) + "\n"
@@ -0,0 +1,112 @@
+"""Subscriptions of the multiplexed websockets to the nodes."""
+
+import json
+import struct
+
+from .broadcast import websocket_frame, frame_payload
+
+# Id of the node subscription of the data of a multiplexed frame
+NODE_ID = struct.Struct("!H")
+# Id of the messages sending the same data to several subscriptions
+GROUP_ID = 0xFFFF
+MAX_NODE_ID = GROUP_ID - 1
+# Maximum time in seconds to write the data of a group message to the nodes
+GROUP_SEND_TIMEOUT = 5
+
+
+def mux_frame(node_id, data):
+    """Return the binary frame of the data of subscription ``node_id``.
+
+    >>> mux_frame(1, b"test")
+    b'\\x82\\x06\\x00\\x01test'
+    """
+    return websocket_frame(NODE_ID.pack(node_id) + data, binary=True)
+
+
+def group_message(node_ids, data):
+    """Return the message sending ``data`` to the subscriptions ``node_ids``.
+
+    The message starts with `GROUP_ID`, the number of subscriptions and
+    their ids.
+
+    >>> group_message([1, 2], b"reset")
+    b'\\xff\\xff\\x00\\x02\\x00\\x01\\x00\\x02reset'
+    """
+    count = len(node_ids)
+    return struct.pack(f"!HH{count}H", GROUP_ID, count, *node_ids) + data
+
+
+def parse_group_message(message):
+    """Return the subscription ids and a memoryview of the data of a group message.
+
+    >>> node_ids, data = parse_group_message(group_message([1, 2], b"reset"))
+    >>> node_ids, bytes(data)
+    ((1, 2), b'reset')
+    >>> parse_group_message(group_message([1, 2], b"")[:-1])
+    Traceback (most recent call last):
+    ...
+    ValueError: Truncated group message
+    """
+    try:
+        (count,) = NODE_ID.unpack_from(message, NODE_ID.size)
+        node_ids = struct.unpack_from(f"!{count}H", message, 2 * NODE_ID.size)
+    except struct.error as exc:
+        raise ValueError("Truncated group message") from exc
+    return node_ids, memoryview(message)[(2 + count) * NODE_ID.size :]
+
+
+def control_frame(**message):
+    """Return the text frame of a control message.
+
+    >>> control_frame(subscribed=1, node="m3-1")
+    b'\\x81!{"subscribed": 1, "node": "m3-1"}'
+    """
+    return websocket_frame(json.dumps(message).encode("utf-8"), binary=False)
+
+
+class Subscription:
+    """Subscription of a multiplexed websocket to a node.
+
+    The subscription takes the place of a websocket among the websockets of
+    the node, so it is limited like them. The data of the node are sent
+    on the multiplexed websocket in binary frames starting with the
+    `NODE_ID` chosen by the client when it subscribed.
+    """
+
+    # Data are relayed in binary frames
+    text = False
+    framing = "chunk"
+    since = None
+
+    def __init__(self, websocket, node, node_id):
+        self.id = node_id  # pylint:disable=invalid-name
+        self.site = websocket.site
+        self.experiment_id = websocket.experiment_id
+        self.node = node
+        self.user = websocket.user
+        self.websocket = websocket
+        self.closed = False
+
+    @property
+    def buffered_bytes(self):
+        """Number of bytes being written or queued for the websocket."""
+        return self.websocket.buffered_bytes
+
+    def write_frame(self, frame):
+        """Send the data of a binary frame built by the application."""
+        data, _ = frame_payload(frame)
+        self.websocket.write_frame(mux_frame(self.id, data))
+
+    def write_message(self, message):
+        """Send an error message about the subscription."""
+        self.websocket.write_frame(control_frame(error=message, id=self.id))
+
+    def trace_write(self, trace):
+        """Follow the write of the last frame given to `write_frame`."""
+        self.websocket.trace_write(trace)
+
+    def close(self, code=None, reason=None):
+        """Unsubscribe from the node."""
+        if not self.closed:
+            self.closed = True
+            self.websocket.unsubscribe(self, code, reason)
@@ -4,6 +4,101 @@ import os
 import argparse
 
 from . import DEFAULT_APPLICATION_PORT, DEFAULT_API_HOST, DEFAULT_API_PORT
+from .broadcast import (
+    TEXT_ERRORS,
+    DEFAULT_TEXT_ERRORS,
+    LINE_MAX_LATENCY,
+    LINE_MAX_SIZE,
+)
+from .handlers.websocket_handler import (
+    COMPRESSION_LEVEL,
+    COMPRESSION_MEM_LEVEL,
+    COMPRESSION_WINDOW_BITS,
+    COMPRESSION_MIN_SIZE,
+    WRITE_QUEUE_SIZE,
+    WRITE_QUEUE_POLICIES,
+    WRITE_HIGH_WATER_MARK,
+    WRITE_LOW_WATER_MARK,
+)
+from .clients.tcp_client import (
+    CHUNK_SIZE,
+    MAX_CHUNK_SIZE,
+    LINGER_POOL_SIZE,
+    LINGER_BUFFER_SIZE,
+)
+from .scrollback import SCROLLBACK_TOTAL_SIZE
+from .sessions import SESSION_BUFFER_SIZE, SESSION_GRACE
+from .mux import GROUP_SEND_TIMEOUT
+from .event_loop import EVENT_LOOPS, DEFAULT_EVENT_LOOP
+from .rate_limiter import (
+    RATE_LIMIT_SCOPES,
+    RATE_LIMIT_ACTIONS,
+    DEFAULT_RATE_LIMIT_ACTION,
+)
+from .api import (
+    API_CACHE_TTL,
+    API_CACHE_SIZE,
+    API_BACKENDS,
+    API_MAX_CLIENTS,
+    API_CONNECT_TIMEOUT,
+    API_REQUEST_TIMEOUT,
+)
+
+
+def rate_limit(value):
+    """Parse a SCOPE=RATE[:BURST] rate limit in (scope, rate, burst).
+
+    >>> rate_limit("node=1000")
+    ('node', 1000, None)
+    >>> rate_limit("user=1000:4000")
+    ('user', 1000, 4000)
+    """
+    try:
+        scope, limit = value.split("=")
+        rate, _, burst = limit.partition(":")
+        rate, burst = int(rate), int(burst) if burst else None
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(f"invalid rate limit '{value}'") from exc
+    if scope not in RATE_LIMIT_SCOPES:
+        raise argparse.ArgumentTypeError(f"invalid rate limit scope '{scope}'")
+    return scope, rate, burst
+
+
+def sample_rate(value):
+    """Parse a sample rate between 0 and 1.
+
+    >>> sample_rate("0.01")
+    0.01
+    """
+    try:
+        rate = float(value)
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(f"invalid sample rate '{value}'") from exc
+    if not 0 <= rate <= 1:
+        raise argparse.ArgumentTypeError(f"sample rate '{value}' not in [0, 1]")
+    return rate
+
+
+def positive_int(value):
+    """Parse a strictly positive integer.
+
+    >>> positive_int("1024")
+    1024
+    """
+    try:
+        number = int(value)
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(f"invalid integer '{value}'") from exc
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"'{value}' is not a positive integer")
+    return number
+
+
+def check_service_args(parser, args):
+    """Check the arguments depending on each other."""
+    if args.tcp_min_chunk_size > args.tcp_max_chunk_size:
+        parser.error("--tcp-min-chunk-size is larger than --tcp-max-chunk-size")
+    return args
 
 
 def service_cli_parser():
@@ -47,14 +142,254 @@ def service_cli_parser():
         default=os.getenv("API_PASSWORD", ""),
         help="password used to connect to the REST API",
     )
+    parser.add_argument(
+        "--api-cache-ttl",
+        type=float,
+        default=API_CACHE_TTL,
+        help="time in seconds REST API responses are cached (0 disables caching)",
+    )
+    parser.add_argument(
+        "--api-cache-size",
+        type=int,
+        default=API_CACHE_SIZE,
+        help="maximum number of REST API responses kept in cache",
+    )
+    parser.add_argument(
+        "--api-backend",
+        default="simple",
+        choices=API_BACKENDS,
+        help="HTTP client used to access the REST API, 'curl' requires pycurl "
+        "and keeps connections to the API alive",
+    )
+    parser.add_argument(
+        "--api-max-clients",
+        type=int,
+        default=API_MAX_CLIENTS,
+        help="maximum number of concurrent requests to the REST API",
+    )
+    parser.add_argument(
+        "--api-connect-timeout",
+        type=float,
+        default=API_CONNECT_TIMEOUT,
+        help="timeout in seconds for connecting to the REST API",
+    )
+    parser.add_argument(
+        "--api-request-timeout",
+        type=float,
+        default=API_REQUEST_TIMEOUT,
+        help="timeout in seconds for a request to the REST API",
+    )
     parser.add_argument(
         "--use-local-api",
         action="store_true",
         help="Start and use the local API handler.",
     )
+    parser.add_argument(
+        "--text-errors",
+        default=DEFAULT_TEXT_ERRORS,
+        choices=sorted(TEXT_ERRORS),
+        help="replace or skip invalid UTF-8 data sent to text websockets",
+    )
+    parser.add_argument(
+        "--line-max-latency",
+        type=float,
+        default=LINE_MAX_LATENCY,
+        help="maximum time in seconds text is buffered for line framed "
+        "websockets (framing=line query argument)",
+    )
+    parser.add_argument(
+        "--line-max-size",
+        type=int,
+        default=LINE_MAX_SIZE,
+        help="maximum number of characters buffered for line framed websockets",
+    )
+    parser.add_argument(
+        "--compression",
+        action="store_true",
+        help="enable permessage-deflate compression of websocket messages",
+    )
+    parser.add_argument(
+        "--compression-level",
+        type=int,
+        default=COMPRESSION_LEVEL,
+        choices=range(0, 10),
+        metavar="{0-9}",
+        help="deflate compression level",
+    )
+    parser.add_argument(
+        "--compression-mem-level",
+        type=int,
+        default=COMPRESSION_MEM_LEVEL,
+        choices=range(1, 10),
+        metavar="{1-9}",
+        help="deflate memory level of each compressed websocket",
+    )
+    parser.add_argument(
+        "--compression-window-bits",
+        type=int,
+        default=COMPRESSION_WINDOW_BITS,
+        choices=range(9, 16),
+        metavar="{9-15}",
+        help="maximum deflate window size (base 2 logarithm) of the server",
+    )
+    parser.add_argument(
+        "--compression-min-size",
+        type=int,
+        default=COMPRESSION_MIN_SIZE,
+        help="messages shorter than this number of bytes are not compressed",
+    )
+    parser.add_argument(
+        "--write-queue-size",
+        type=int,
+        default=WRITE_QUEUE_SIZE,
+        help="maximum number of bytes waiting to be sent to a websocket",
+    )
+    parser.add_argument(
+        "--write-queue-policy",
+        type=str,
+        default="drop-oldest",
+        choices=WRITE_QUEUE_POLICIES,
+        help="drop the oldest or the newest data, or disconnect slow websockets",
+    )
+    parser.add_argument(
+        "--write-high-water-mark",
+        type=int,
+        default=WRITE_HIGH_WATER_MARK,
+        help="pause reading from a node when all its websockets buffer more bytes",
+    )
+    parser.add_argument(
+        "--write-low-water-mark",
+        type=int,
+        default=WRITE_LOW_WATER_MARK,
+        help="resume reading from a node when one of its websockets buffers less",
+    )
+    parser.add_argument(
+        "--tcp-min-chunk-size",
+        type=positive_int,
+        default=CHUNK_SIZE,
+        help="minimum size of the adaptive reads from the nodes",
+    )
+    parser.add_argument(
+        "--tcp-max-chunk-size",
+        type=positive_int,
+        default=MAX_CHUNK_SIZE,
+        help="maximum size of the adaptive reads from the nodes",
+    )
+    parser.add_argument(
+        "--tcp-linger",
+        type=float,
+        default=0,
+        help="seconds the TCP connection to a node stays open after its last "
+        "websocket is closed, for the next websocket, 0 closes it at once",
+    )
+    parser.add_argument(
+        "--tcp-linger-buffer-size",
+        type=int,
+        default=LINGER_BUFFER_SIZE,
+        help="maximum number of the most recent bytes buffered for an idle node",
+    )
+    parser.add_argument(
+        "--tcp-linger-pool-size",
+        type=int,
+        default=LINGER_POOL_SIZE,
+        help="maximum number of idle TCP connections kept open",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=rate_limit,
+        action="append",
+        default=[],
+        metavar="{node,user,global}=RATE[:BURST]",
+        help=(
+            "limit the bytes per second received from each node, all nodes of "
+            "a user or all nodes, a null rate disables the limit "
+            "(default: node=15000:15000)"
+        ),
+    )
+    parser.add_argument(
+        "--rate-limit-action",
+        type=str,
+        default=DEFAULT_RATE_LIMIT_ACTION,
+        choices=RATE_LIMIT_ACTIONS,
+        help="delay reads, drop data or disconnect nodes exceeding rate limits",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of worker processes, each node is handled by one worker",
+    )
+    parser.add_argument(
+        "--event-loop",
+        type=str,
+        default=DEFAULT_EVENT_LOOP,
+        choices=EVENT_LOOPS,
+        help="event loop implementation, uvloop falls back to asyncio if missing",
+    )
+    parser.add_argument(
+        "--trace-sample-rate",
+        type=sample_rate,
+        default=0,
+        help="fraction of the node data whose relay latency is traced and "
+        "exposed on /metrics, 0 disables tracing",
+    )
+    parser.add_argument(
+        "--scrollback-size",
+        type=int,
+        default=0,
+        help="number of the last bytes of each node sent to its new websockets, "
+        "from the offset given by their since query argument, 0 disables it",
+    )
+    parser.add_argument(
+        "--scrollback-total-size",
+        type=int,
+        default=SCROLLBACK_TOTAL_SIZE,
+        help="maximum number of bytes of the scrollbacks of all the nodes",
+    )
+    parser.add_argument(
+        "--session-buffer-size",
+        type=positive_int,
+        default=SESSION_BUFFER_SIZE,
+        help="number of the last bytes of a resumable session sent again when "
+        "it is resumed",
+    )
+    parser.add_argument(
+        "--session-grace",
+        type=float,
+        default=SESSION_GRACE,
+        help="seconds a resumable session waits to be resumed once its "
+        "websocket is lost",
+    )
+    parser.add_argument(
+        "--group-send-timeout",
+        type=float,
+        default=GROUP_SEND_TIMEOUT,
+        help="maximum seconds to write the data of a group message of a "
+        "multiplexed websocket to the nodes",
+    )
+    parser.add_argument(
+        "--capture",
+        dest="capture_nodes",
+        action="append",
+        default=[],
+        metavar="NODE",
+        help="record the data received from the node, can be repeated",
+    )
+    parser.add_argument(
+        "--capture-dir",
+        type=str,
+        default=".",
+        help="directory of the capture files, replayed by iotlab-websocket-replay",
+    )
     parser.add_argument(
         "--log-file", type=str, default=None, help="Absolute path of the log file"
     )
+    parser.add_argument(
+        "--session-log",
+        type=str,
+        default=None,
+        help="Absolute path of the file of the JSON records of the websocket sessions",
+    )
     parser.add_argument(
         "--log-console", action="store_true", help="Print debug messages to console."
     )
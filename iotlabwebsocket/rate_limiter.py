@@ -0,0 +1,76 @@
+"""Token bucket limits of the data rate received from the nodes."""
+
+import time
+
+# Limits can apply to each node, to all the nodes of a user or to all nodes
+RATE_LIMIT_SCOPES = ("node", "user", "global")
+# What to do with data received above the limits: delay the next reads,
+# drop the data or close the connection to the node
+RATE_LIMIT_ACTIONS = ("throttle", "shed", "disconnect")
+DEFAULT_RATE_LIMIT_ACTION = "disconnect"
+# Default limit of each node, in bytes per second and bytes
+NODE_RATE = 15000
+NODE_BURST = 15000
+
+
+class TokenBucket:
+    """Token bucket filled with ``rate`` tokens per second up to ``burst``.
+
+    ``clock`` returns monotonic seconds, it defaults to `time.monotonic`
+    which is the clock of the asyncio IOLoop.
+    """
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        self.rate = rate
+        self.burst = rate if burst is None else burst
+        self.tokens = self.burst
+        self._clock = clock
+        self._last = clock()
+
+    def refill(self):
+        """Add the tokens accumulated since the last refill."""
+        now = self._clock()
+        self.tokens = min(self.burst, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def can_consume(self, amount):
+        """Return True if ``amount`` tokens are available.
+
+        Amounts larger than the burst are accepted when the bucket is full.
+        """
+        self.refill()
+        return self.tokens >= min(amount, self.burst)
+
+    def consume(self, amount):
+        """Remove ``amount`` tokens, the bucket may go in debt."""
+        self.tokens -= amount
+
+    def delay(self):
+        """Seconds to wait until the bucket is out of debt."""
+        return max(0.0, -self.tokens / self.rate)
+
+
+class RateLimiter:
+    """Apply ``action`` to the data exceeding any of the ``buckets``."""
+
+    def __init__(self, buckets, action=DEFAULT_RATE_LIMIT_ACTION):
+        self.buckets = buckets
+        self.action = action
+
+    def allow(self, amount):
+        """Consume ``amount`` tokens if all buckets have them.
+
+        Return False, without consuming anything, otherwise.
+        """
+        if not all(bucket.can_consume(amount) for bucket in self.buckets):
+            return False
+        for bucket in self.buckets:
+            bucket.consume(amount)
+        return True
+
+    def throttle(self, amount):
+        """Consume ``amount`` tokens and return the delay before next reads."""
+        for bucket in self.buckets:
+            bucket.refill()
+            bucket.consume(amount)
+        return max((bucket.delay() for bucket in self.buckets), default=0.0)
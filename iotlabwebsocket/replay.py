@@ -0,0 +1,126 @@
+"""Replay of a node capture.
+
+Serves a capture file recorded with ``--capture`` as a fake node: each TCP
+connection receives the captured data with their original timing, or
+accelerated by a speed factor. The file is memory mapped, so only the
+pages being replayed are loaded.
+"""
+
+import argparse
+import mmap
+import time
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.tcpserver import TCPServer
+
+from .capture import read_records
+from .clients.tcp_client import NODE_TCP_PORT
+from .logger import LOGGER, setup_server_logger
+
+# Records due at the same time are sent together, up to this size
+REPLAY_WRITE_SIZE = 64 * 1024
+
+
+class ReplayServer(TCPServer):
+    """Node stand-in sending the records of a capture to each connection.
+
+    ``speed`` divides the delays between the records, they are sent as fast
+    as possible when null. The connection is closed at the end of the
+    capture, unless ``loop`` is set.
+    """
+
+    def __init__(self, capture, speed=1, loop=False):
+        super().__init__()
+        self.capture = capture
+        self.speed = speed
+        self.loop = loop
+
+    @gen.coroutine
+    def handle_stream(self, stream, address):
+        LOGGER.info("Replaying capture to %s:%d", *address[:2])
+        try:
+            records = yield self.replay(stream)
+            while self.loop and records:
+                records = yield self.replay(stream)
+        except StreamClosedError:
+            LOGGER.info("Connection from %s:%d is closed", *address[:2])
+            return
+        stream.close()
+
+    @gen.coroutine
+    def replay(self, stream):
+        """Send the records of the capture to the stream.
+
+        Return the number of records sent.
+        """
+        start = time.monotonic()
+        origin = None
+        pending = []
+        size = 0
+        records = 0
+        for records, (timestamp, data) in enumerate(read_records(self.capture), 1):
+            if origin is None:
+                origin = timestamp
+            delay = 0
+            if self.speed:
+                delay = (timestamp - origin) / self.speed - time.monotonic() + start
+            if pending and (delay > 0 or size >= REPLAY_WRITE_SIZE):
+                yield stream.write(b"".join(pending))
+                pending = []
+                size = 0
+            if delay > 0:
+                yield gen.sleep(delay)
+            pending.append(data)
+            size += len(data)
+        if pending:
+            yield stream.write(b"".join(pending))
+        return records
+
+
+def main(args=None):
+    """Serve a capture file as a fake node."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("capture", help="capture file to replay")
+    parser.add_argument(
+        "--port", type=int, default=NODE_TCP_PORT, help="TCP port of the fake node"
+    )
+    parser.add_argument(
+        "--address", default="", help="address listened to, all interfaces by default"
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1,
+        help="replay speed factor, 0 replays as fast as possible",
+    )
+    parser.add_argument(
+        "--loop", action="store_true", help="replay the capture until disconnected"
+    )
+    parser.add_argument(
+        "--log-console", action="store_true", help="Print debug messages to console."
+    )
+    args = parser.parse_args(args)
+
+    listener = setup_server_logger(log_console=args.log_console)
+    try:
+        with open(args.capture, "rb") as capture_file:
+            capture = mmap.mmap(capture_file.fileno(), 0, access=mmap.ACCESS_READ)
+        next(read_records(capture), None)
+    except (OSError, ValueError) as exc:
+        parser.error(f"cannot replay {args.capture}: {exc}")
+    server = ReplayServer(capture, speed=args.speed, loop=args.loop)
+    server.listen(args.port, address=args.address)
+    try:
+        IOLoop.current().start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        if listener is not None:
+            listener.stop()
+
+
+if __name__ == "__main__":
+    main()
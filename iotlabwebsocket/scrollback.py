@@ -0,0 +1,104 @@
+"""Scrollback of the data received from the nodes."""
+
+from collections import OrderedDict
+
+# Maximum number of bytes kept for all the nodes
+SCROLLBACK_TOTAL_SIZE = 64 * 1024 * 1024
+
+
+class Scrollback:
+    """Ring buffer of the last ``size`` bytes received from a node.
+
+    Bytes are numbered from the first one received: `start` is the offset
+    of the oldest byte kept and `end` the offset of the next byte.
+
+    >>> scrollback = Scrollback(4)
+    >>> scrollback.write(b"abc")
+    >>> scrollback.write(b"def")
+    >>> scrollback.start, scrollback.end, scrollback.read()
+    (2, 6, b'cdef')
+    >>> scrollback.read(since=5)
+    b'f'
+    """
+
+    def __init__(self, size):
+        self._buffer = memoryview(bytearray(size))
+        self.end = 0
+
+    @property
+    def start(self):
+        """Offset of the oldest byte kept."""
+        return max(0, self.end - len(self._buffer))
+
+    def write(self, data):
+        """Add the bytes received from the node."""
+        size = len(self._buffer)
+        kept = memoryview(data)[-size:]
+        position = (self.end + len(data) - len(kept)) % size
+        first = min(len(kept), size - position)
+        self._buffer[position : position + first] = kept[:first]
+        self._buffer[: len(kept) - first] = kept[first:]
+        self.end += len(data)
+
+    def offset(self, since=None):
+        """Return the offset of the first byte kept from offset ``since``."""
+        if since is None:
+            return self.start
+        return min(max(since, self.start), self.end)
+
+    def read(self, since=None):
+        """Return the bytes kept from offset ``since``, or from `start`."""
+        since = self.offset(since)
+        size = len(self._buffer)
+        length = self.end - since
+        position = since % size
+        first = min(length, size - position)
+        return b"".join(
+            (
+                self._buffer[position : position + first],
+                self._buffer[: length - first],
+            )
+        )
+
+
+class Scrollbacks:
+    """Scrollbacks of ``size`` bytes of the nodes.
+
+    At most ``total_size`` bytes are allocated: the scrollback of the node
+    which received data least recently is dropped for a new node.
+    """
+
+    def __init__(self, size, total_size=SCROLLBACK_TOTAL_SIZE):
+        self.size = size
+        self.max_count = total_size // size
+        self._scrollbacks = OrderedDict()
+
+    def __len__(self):
+        return len(self._scrollbacks)
+
+    def write(self, node, data):
+        """Add the bytes received from a node to its scrollback."""
+        scrollback = self._scrollbacks.get(node)
+        if scrollback is not None:
+            self._scrollbacks.move_to_end(node)
+        elif self.max_count:
+            if len(self._scrollbacks) == self.max_count:
+                self._scrollbacks.popitem(last=False)
+            scrollback = self._scrollbacks[node] = Scrollback(self.size)
+        else:
+            return
+        scrollback.write(data)
+
+    def offset(self, node, since=None):
+        """Return the offset from which the scrollback of a node is read."""
+        scrollback = self._scrollbacks.get(node)
+        if scrollback is None:
+            return 0
+        return scrollback.offset(since)
+
+    def read(self, node, since=None):
+        """Return the bytes kept for a node from offset ``since``."""
+        scrollback = self._scrollbacks.get(node)
+        if scrollback is None:
+            return b""
+        return scrollback.read(since)
@@ -1,30 +1,148 @@
 """iotlabwebserial application command line interface"""
 
-import tornado
+import asyncio
 
-from .logger import LOGGER, setup_server_logger
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+from tornado.process import fork_processes
+
+from .event_loop import set_event_loop_policy
+from .logger import LOGGER, setup_server_logger, setup_session_logger
 from .web_application import WebApplication
 from .api import ApiClient
-from .parser import service_cli_parser
+from .parser import service_cli_parser, check_service_args
+from .rate_limiter import NODE_RATE, NODE_BURST
+from .workers import SharedConnectionCounters
+
+
+async def _wait_forever():
+    await asyncio.Event().wait()
+
+
+def _fork_workers(port, workers):
+    """Fork the workers and return the sockets and settings of this worker.
+
+    Workers share the listening socket. Each worker also listens on an
+    internal loopback socket where the others proxy the websockets of the
+    nodes it owns.
+    """
+    sockets = bind_sockets(port)
+    internal = [bind_sockets(0, "127.0.0.1")[0] for _ in range(workers)]
+    ports = [sock.getsockname()[1] for sock in internal]
+    user_connections = SharedConnectionCounters(workers)
+    worker_id = fork_processes(workers)
+    user_connections.attach(worker_id)
+    for index, sock in enumerate(internal):
+        if index != worker_id:
+            sock.close()
+    settings = dict(
+        worker_id=worker_id,
+        worker_ports=ports,
+        user_connections=user_connections,
+        # Autoreload is not compatible with multiple processes
+        autoreload=False,
+    )
+    return sockets + [internal[worker_id]], settings
+
+
+async def _serve(api, port, sockets=None, **settings):
+    # Built in the running loop, autoreload and the HTTP clients use it
+    app = WebApplication(api, **settings)
+    try:
+        if sockets is None:
+            app.listen(port)
+        else:
+            HTTPServer(app).add_sockets(sockets)
+        LOGGER.info("Application started, listening on port %s", port)
+        await _wait_forever()
+    finally:
+        LOGGER.debug("Shuting down service")
+        app.stop()
 
 
 def main(args=None):
     """Main function of the web application."""
-    args = service_cli_parser().parse_args(args)
-    setup_server_logger(log_file=args.log_file, log_console=args.log_console)
+    parser = service_cli_parser()
+    args = check_service_args(parser, parser.parse_args(args))
+    sockets, worker_settings = None, {}
+    if args.workers > 1:
+        try:
+            sockets, worker_settings = _fork_workers(args.port, args.workers)
+        except KeyboardInterrupt:
+            # Interrupted parent process, workers are interrupted too
+            return
+    # Each worker process starts its own log writer thread
+    listeners = [
+        setup_server_logger(log_file=args.log_file, log_console=args.log_console),
+        setup_session_logger(args.session_log),
+    ]
+    if worker_settings:
+        LOGGER.info(
+            "Worker %d started, internal port %d",
+            worker_settings["worker_id"],
+            worker_settings["worker_ports"][worker_settings["worker_id"]],
+        )
     api = ApiClient(
         args.api_protocol,
         args.api_host,
         args.api_port,
         args.api_user,
         args.api_password,
+        cache_ttl=args.api_cache_ttl,
+        cache_size=args.api_cache_size,
+        backend=args.api_backend,
+        max_clients=args.api_max_clients,
+        connect_timeout=args.api_connect_timeout,
+        request_timeout=args.api_request_timeout,
     )
-    app = WebApplication(api, use_local_api=args.use_local_api, token=args.token)
+    compression_options = None
+    if args.compression:
+        compression_options = {
+            "compression_level": args.compression_level,
+            "mem_level": args.compression_mem_level,
+        }
+    rate_limits = {"node": (NODE_RATE, NODE_BURST)}
+    for scope, rate, burst in args.rate_limit:
+        rate_limits[scope] = (rate, burst)
+    rate_limits = {scope: limit for scope, limit in rate_limits.items() if limit[0]}
+    settings = dict(
+        use_local_api=args.use_local_api,
+        token=args.token,
+        text_errors=args.text_errors,
+        line_max_latency=args.line_max_latency,
+        line_max_size=args.line_max_size,
+        websocket_compression_options=compression_options,
+        compression_window_bits=args.compression_window_bits,
+        compression_min_size=args.compression_min_size,
+        write_queue_size=args.write_queue_size,
+        write_queue_policy=args.write_queue_policy,
+        write_high_water_mark=args.write_high_water_mark,
+        write_low_water_mark=args.write_low_water_mark,
+        tcp_min_chunk_size=args.tcp_min_chunk_size,
+        tcp_max_chunk_size=args.tcp_max_chunk_size,
+        tcp_linger=args.tcp_linger,
+        tcp_linger_buffer_size=args.tcp_linger_buffer_size,
+        tcp_linger_pool_size=args.tcp_linger_pool_size,
+        rate_limits=rate_limits,
+        rate_limit_action=args.rate_limit_action,
+        trace_sample_rate=args.trace_sample_rate,
+        scrollback_size=args.scrollback_size,
+        scrollback_total_size=args.scrollback_total_size,
+        session_buffer_size=args.session_buffer_size,
+        session_grace=args.session_grace,
+        group_send_timeout=args.group_send_timeout,
+        capture_nodes=args.capture_nodes,
+        capture_dir=args.capture_dir,
+        **worker_settings,
+    )
+    event_loop = set_event_loop_policy(args.event_loop)
+    LOGGER.debug("Using the %s event loop", event_loop)
     try:
-        app.listen(args.port)
-        LOGGER.info(f"Application started, listening on port {args.port}")
-        tornado.ioloop.IOLoop.instance().start()
+        asyncio.run(_serve(api, args.port, sockets, **settings))
     except KeyboardInterrupt:
-        LOGGER.debug("Shuting down service")
-        app.stop()
-        tornado.ioloop.IOLoop.instance().stop()
+        pass
+    finally:
+        for listener in listeners:
+            if listener is not None:
+                # Write the pending log records
+                listener.stop()
@@ -0,0 +1,143 @@
+"""Resumable sessions of the websockets to the nodes."""
+
+import secrets
+import struct
+
+from tornado.ioloop import IOLoop
+from tornado.websocket import WebSocketClosedError
+
+from .broadcast import websocket_frame, frame_payload
+from .logger import LOGGER
+from .scrollback import Scrollback
+
+# Offset of the first byte of the data of a session frame
+OFFSET = struct.Struct("!Q")
+
+SESSION_BUFFER_SIZE = 64 * 1024
+SESSION_GRACE = 30  # seconds
+
+
+def session_id():
+    """Return a new unguessable session id."""
+    return secrets.token_urlsafe(16)
+
+
+def session_frame(offset, data):
+    """Return the binary frame of session data starting at ``offset``.
+
+    >>> session_frame(4, b"test")
+    b'\\x82\\x0c\\x00\\x00\\x00\\x00\\x00\\x00\\x00\\x04test'
+    """
+    return websocket_frame(OFFSET.pack(offset) + data, binary=True)
+
+
+class Session:
+    # pylint:disable=too-many-instance-attributes
+    """Resumable session of a websocket to a node.
+
+    The session replaces its websocket among the websockets of the node, so
+    the node connection is kept while the client reconnects. Each frame
+    sent to the client holds the `OFFSET` of its first byte in the data
+    received by the session, followed by the data. The last
+    ``buffer_size`` bytes are kept to be sent again to a websocket resuming
+    the session from the offset it received last.
+
+    When its websocket is closed abnormally, the session waits ``grace``
+    seconds for a websocket to resume it before ``on_end`` is called.
+    """
+
+    # Data are relayed in binary frames
+    text = False
+    framing = "chunk"
+
+    def __init__(self, websocket, buffer_size, grace, on_end):
+        # pylint:disable=too-many-arguments
+        self.id = websocket.session_id  # pylint:disable=invalid-name
+        self.site = websocket.site
+        self.experiment_id = websocket.experiment_id
+        self.node = websocket.node
+        self.user = websocket.user
+        self.websocket = websocket
+        self.grace = grace
+        self.on_end = on_end
+        self.closed = False
+        self._scrollback = Scrollback(buffer_size)
+        self._timeout = None
+
+    @property
+    def buffered_bytes(self):
+        """Number of bytes being written or queued for the websocket."""
+        if self.websocket is None:
+            return 0
+        return self.websocket.buffered_bytes
+
+    def write_frame(self, frame):
+        """Send the data of a binary frame built by the application."""
+        data, _ = frame_payload(frame)
+        offset = self._scrollback.end
+        self._scrollback.write(data)
+        self._write(session_frame(offset, data))
+
+    def trace_write(self, trace):
+        """Follow the write of the last frame given to `write_frame`."""
+        if self.websocket is not None:
+            self.websocket.trace_write(trace)
+
+    def _write(self, frame):
+        if self.websocket is None:
+            return
+        try:
+            self.websocket.write_frame(frame)
+        except WebSocketClosedError:
+            LOGGER.debug("Websocket of session '%s' is closed", self.id)
+
+    def attach(self, websocket, offset):
+        """Resume the session with a websocket from ``offset``.
+
+        The kept data from ``offset`` are sent in one frame, the previous
+        websocket of the session is closed.
+        """
+        if self._timeout is not None:
+            IOLoop.current().remove_timeout(self._timeout)
+            self._timeout = None
+        previous, self.websocket = self.websocket, websocket
+        if previous is not None:
+            previous.close(code=1000, reason="Session resumed")
+        offset = self._scrollback.offset(offset)
+        data = self._scrollback.read(offset)
+        if data:
+            self._write(session_frame(offset, data))
+
+    def detach(self, websocket):
+        """Wait for the session to be resumed once its websocket is closed.
+
+        The session ends at once when the client closed it normally.
+        """
+        if websocket is not self.websocket or self.closed:
+            return
+        self.websocket = None
+        if websocket.close_code == 1000:
+            self.end()
+            return
+        LOGGER.debug("Websocket of session '%s' lost, waiting", self.id)
+        self._timeout = IOLoop.current().call_later(self.grace, self.end)
+
+    def close(self, code=None, reason=None):
+        """Close the websocket of the session and end it."""
+        if self.closed:
+            return
+        self.closed = True
+        if self.websocket is not None:
+            self.websocket.close(code, reason)
+        # The application may be iterating on the websockets of the node
+        IOLoop.current().add_callback(self.end)
+
+    def end(self):
+        """End the session."""
+        if self._timeout is not None:
+            IOLoop.current().remove_timeout(self._timeout)
+            self._timeout = None
+        if self.on_end is not None:
+            on_end, self.on_end = self.on_end, None
+            self.closed = True
+            on_end(self)
@@ -4,11 +4,15 @@ import json
 import io
 import unittest
 import mock
+import pytest
 
-from tornado.testing import AsyncHTTPTestCase, gen_test
+from tornado import gen
+from tornado.httpclient import HTTPClientError
+from tornado.simple_httpclient import SimpleAsyncHTTPClient
+from tornado.testing import AsyncHTTPTestCase, AsyncTestCase, gen_test
 
-from iotlabwebsocket.api import ApiClient
-from iotlabwebsocket.handlers.http_handler import NODES
+from iotlabwebsocket.api import ApiClient, ApiCache, CurlAsyncHTTPClient
+from iotlabwebsocket.handlers.http_handler import NODES, _nodes
 from iotlabwebsocket.web_application import WebApplication
 
 
@@ -32,6 +36,189 @@ class TestApiClientAsync(AsyncHTTPTestCase):
         assert token == "token"
 
 
+@unittest.skipIf(CurlAsyncHTTPClient is None, "pycurl is not installed")
+class TestApiClientCurl(AsyncHTTPTestCase):
+    def get_app(self):
+        return WebApplication(self.api, use_local_api=True, token="token")
+
+    def setUp(self):
+        self.api = ApiClient("http", backend="curl", cache_ttl=0)
+        super(TestApiClientCurl, self).setUp()
+        self.api.port = self.get_http_port()
+
+    @gen_test
+    def test_fetch_async_curl(self):
+        assert self.api.client_class is CurlAsyncHTTPClient
+        nodes = yield self.api.fetch_nodes_async("123")
+        assert nodes == NODES["nodes"]
+        client = self.api.async_client
+        token = yield self.api.fetch_token_async("123")
+        assert token == "token"
+        # The HTTP client is shared between requests
+        assert self.api.async_client is client
+
+
+class TestApiClientCache(AsyncHTTPTestCase):
+    def get_app(self):
+        return WebApplication(self.api, use_local_api=True, token="token")
+
+    def setUp(self):
+        self.now = 0
+        self.api = ApiClient("http", cache_ttl=10, cache_size=2)
+        self.api.cache.clock = lambda: self.now
+        super(TestApiClientCache, self).setUp()
+        self.api.port = self.get_http_port()
+
+    @mock.patch("iotlabwebsocket.handlers.http_handler._nodes", wraps=_nodes)
+    @gen_test
+    def test_cache_hit(self, nodes):
+        for _ in range(3):
+            result = yield self.api.fetch_nodes_async("123")
+            assert result == NODES["nodes"]
+        assert nodes.call_count == 1
+        assert self.api.cache.misses == 1
+        assert self.api.cache.hits == 2
+
+        token = yield self.api.fetch_token_async("123")
+        assert token == "token"
+        token = yield self.api.fetch_token_async("123")
+        assert token == "token"
+        assert self.api.cache.misses == 2
+        assert self.api.cache.hits == 3
+
+    @mock.patch("iotlabwebsocket.handlers.http_handler._nodes")
+    @gen_test
+    def test_nodes_index(self, nodes):
+        nodes.return_value = json.dumps(
+            {"nodes": ["node-1.local", "node-2.local", "m3-1.grenoble.iot-lab.info"]}
+        )
+        index = yield self.api.fetch_nodes_index_async("123")
+        assert index == frozenset(
+            [("local", "node-1"), ("local", "node-2"), ("grenoble", "m3-1")]
+        )
+        # The index is built once and reused for the experiment
+        assert (yield self.api.fetch_nodes_index_async("123")) is index
+        assert nodes.call_count == 1
+
+        # Nodes list and index share the same API request
+        result = yield self.api.fetch_nodes_async("123")
+        assert len(result) == 3
+        assert nodes.call_count == 1
+
+    @mock.patch("iotlabwebsocket.handlers.http_handler._nodes", wraps=_nodes)
+    @gen_test
+    def test_cache_coalesced(self, nodes):
+        results = yield [self.api.fetch_nodes_async("123") for _ in range(10)]
+        assert results == [NODES["nodes"]] * 10
+        assert nodes.call_count == 1
+        assert self.api.cache.misses == 1
+        assert self.api.cache.coalesced == 9
+        assert self.api.cache.hits == 0
+
+    @mock.patch("iotlabwebsocket.handlers.http_handler._nodes", wraps=_nodes)
+    @gen_test
+    def test_cache_ttl(self, nodes):
+        yield self.api.fetch_nodes_async("123")
+        self.now = 9.9
+        yield self.api.fetch_nodes_async("123")
+        assert nodes.call_count == 1
+        self.now = 10
+        yield self.api.fetch_nodes_async("123")
+        assert nodes.call_count == 2
+        assert self.api.cache.misses == 2
+
+    @mock.patch("iotlabwebsocket.handlers.http_handler._nodes", wraps=_nodes)
+    @gen_test
+    def test_cache_lru(self, nodes):
+        yield self.api.fetch_nodes_async("1")
+        yield self.api.fetch_nodes_async("2")
+        yield self.api.fetch_nodes_async("1")
+        yield self.api.fetch_nodes_async("3")
+        assert len(self.api.cache) == 2
+        assert nodes.call_count == 3
+
+        # "2" was the least recently used entry and has been evicted
+        yield self.api.fetch_nodes_async("1")
+        assert nodes.call_count == 3
+        yield self.api.fetch_nodes_async("2")
+        assert nodes.call_count == 4
+
+    @mock.patch("iotlabwebsocket.handlers.http_handler._nodes", wraps=_nodes)
+    @gen_test
+    def test_cache_invalidate(self, nodes):
+        yield self.api.fetch_nodes_async("1")
+        yield self.api.fetch_token_async("1")
+        yield self.api.fetch_nodes_async("2")
+        self.api.invalidate("1")
+        assert len(self.api.cache) == 1
+        yield self.api.fetch_nodes_async("1")
+        yield self.api.fetch_nodes_async("2")
+        assert nodes.call_count == 3
+
+        self.api.invalidate()
+        assert len(self.api.cache) == 0
+        yield self.api.fetch_nodes_async("2")
+        assert nodes.call_count == 4
+
+
+class TestApiClientCacheError(AsyncHTTPTestCase):
+    def get_app(self):
+        # No token set, token requests fail
+        return WebApplication(self.api, use_local_api=True)
+
+    def setUp(self):
+        self.api = ApiClient("http")
+        super(TestApiClientCacheError, self).setUp()
+        self.api.port = self.get_http_port()
+
+    @gen_test
+    def test_cache_error(self):
+        futures = [self.api.fetch_token_async("123") for _ in range(2)]
+        for future in futures:
+            with self.assertRaises(HTTPClientError):
+                yield future
+        assert self.api.cache.coalesced == 1
+
+        # Errors are not cached
+        assert len(self.api.cache) == 0
+        with self.assertRaises(HTTPClientError):
+            yield self.api.fetch_token_async("123")
+        assert self.api.cache.misses == 2
+
+
+class TestApiCache(AsyncTestCase):
+    @gen_test
+    def test_cache_disabled(self):
+        @gen.coroutine
+        def _fetch():
+            raise gen.Return("value")
+
+        cache = ApiCache(ttl=0)
+        fetch = mock.Mock(side_effect=_fetch)
+        for _ in range(2):
+            value = yield cache.fetch("123", "", fetch)
+            assert value == "value"
+        assert fetch.call_count == 2
+        assert len(cache) == 0
+
+
+class TestApiClientBackend(unittest.TestCase):
+    def test_client_backend(self):
+        api = ApiClient("http", max_clients=3, request_timeout=1)
+        assert api.client_class is SimpleAsyncHTTPClient
+        assert api.client_options["max_clients"] == 3
+        assert api.client_options["defaults"]["request_timeout"] == 1
+        assert api.sync_client is api.sync_client
+
+        with pytest.raises(ValueError):
+            ApiClient("http", backend="invalid")
+
+    @mock.patch("iotlabwebsocket.api.CurlAsyncHTTPClient", None)
+    def test_client_backend_curl_unavailable(self):
+        api = ApiClient("http", backend="curl")
+        assert api.client_class is SimpleAsyncHTTPClient
+
+
 class ResponseBuffer(object):
     def __init__(self, buf):
         self.buffer = io.BytesIO(buf)
@@ -0,0 +1,262 @@
+"""iotlabwebsocket broadcast tests."""
+
+import random
+import struct
+
+import mock
+import pytest
+
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+from tornado.websocket import WebSocketClosedError
+
+from iotlabwebsocket.broadcast import (
+    LineFramer,
+    NodeBroadcast,
+    TEXT_ERRORS,
+    websocket_frame,
+)
+
+
+@pytest.mark.parametrize(
+    "length,header",
+    [
+        (0, b"\x82\x00"),
+        (125, b"\x82\x7d"),
+        (126, b"\x82\x7e" + struct.pack("!H", 126)),
+        (0xFFFF, b"\x82\x7e" + struct.pack("!H", 0xFFFF)),
+        (0x10000, b"\x82\x7f" + struct.pack("!Q", 0x10000)),
+    ],
+)
+def test_websocket_frame(length, header):
+    payload = b"a" * length
+    assert websocket_frame(payload, binary=True) == header + payload
+    text_header = bytes([0x81]) + header[1:]
+    assert websocket_frame(payload, binary=False) == text_header + payload
+
+
+def _websocket(text, framing="chunk"):
+    return mock.Mock(text=text, framing=framing)
+
+
+def test_broadcast_encode_once():
+    websockets = [_websocket(True), _websocket(False), _websocket(True)]
+    broadcast = NodeBroadcast("node-1", websockets)
+
+    data = "test°°°ééààà".encode("utf-8")
+    broadcast.send(data)
+
+    text_frame = websockets[0].write_frame.call_args[0][0]
+    binary_frame = websockets[1].write_frame.call_args[0][0]
+    assert text_frame == websocket_frame(data, binary=False)
+    assert binary_frame == websocket_frame(data, binary=True)
+    # Same frame object is written to all websockets of the same kind
+    assert websockets[2].write_frame.call_args[0][0] is text_frame
+
+
+def test_broadcast_invalid_utf8():
+    websockets = [_websocket(True), _websocket(False)]
+    broadcast = NodeBroadcast("node-1", websockets)
+
+    # Binary websocket listed after the text one still gets the raw bytes
+    data = b"\xaa\xbb\xcc\xff"
+    broadcast.send(data)
+    websockets[0].write_frame.assert_called_once_with(
+        websocket_frame("\ufffd".encode("utf-8") * 4, binary=False)
+    )
+    websockets[1].write_frame.assert_called_once_with(
+        websocket_frame(data, binary=True)
+    )
+
+
+def test_broadcast_invalid_utf8_skip():
+    websockets = [_websocket(True)]
+    broadcast = NodeBroadcast("node-1", websockets, text_errors="skip")
+
+    broadcast.send(b"\xaa\xbb\xcc\xff")
+    assert websockets[0].write_frame.call_count == 0
+
+    broadcast.send(b"a\xffb")
+    websockets[0].write_frame.assert_called_once_with(
+        websocket_frame(b"ab", binary=False)
+    )
+
+
+def _text_frames_payload(websocket):
+    payload = b""
+    for args, _ in websocket.write_frame.call_args_list:
+        frame = args[0]
+        assert frame[0] == 0x81
+        # Test messages are always shorter than 126 bytes
+        assert frame[1] == len(frame) - 2
+        payload += frame[2:]
+    return payload.decode("utf-8")
+
+
+MESSAGE = "aé°€𝄞\nb"
+
+
+@pytest.mark.parametrize("split", range(1, len(MESSAGE.encode("utf-8"))))
+def test_broadcast_split_utf8(split):
+    websockets = [_websocket(True)]
+    broadcast = NodeBroadcast("node-1", websockets)
+    data = MESSAGE.encode("utf-8")
+    broadcast.send(data[:split])
+    broadcast.send(data[split:])
+    assert _text_frames_payload(websockets[0]) == MESSAGE
+
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("text_errors", sorted(TEXT_ERRORS))
+def test_broadcast_fuzz_chunks(seed, text_errors):
+    rand = random.Random(seed)
+    data = (MESSAGE * 10).encode("utf-8")
+    websockets = [_websocket(True)]
+    broadcast = NodeBroadcast("node-1", websockets, text_errors=text_errors)
+    position = 0
+    while position < len(data):
+        size = rand.randint(1, 8)
+        broadcast.send(data[position : position + size])
+        position += size
+    assert _text_frames_payload(websockets[0]) == MESSAGE * 10
+
+
+def test_broadcast_reset_decoder():
+    websockets = [_websocket(False)]
+    broadcast = NodeBroadcast("node-1", websockets)
+    data = "é".encode("utf-8")
+
+    # Partial character received when there's no text websocket is dropped
+    broadcast.send(data[:1])
+    websockets.append(_websocket(True))
+    broadcast.send(b"a")
+    websockets[1].write_frame.assert_called_once_with(
+        websocket_frame(b"a", binary=False)
+    )
+
+
+def test_broadcast_closed_websocket():
+    websockets = [_websocket(False), _websocket(False)]
+    websockets[0].write_frame.side_effect = WebSocketClosedError
+    broadcast = NodeBroadcast("node-1", websockets)
+
+    broadcast.send(b"test")
+    websockets[1].write_frame.assert_called_once()
+
+
+def test_broadcast_send_scrollback():
+    binary, text = _websocket(False), _websocket(True)
+    broadcast = NodeBroadcast("node-1", [])
+    data = "testé".encode("utf-8")
+
+    broadcast.send_scrollback(binary, data[:-1])
+    binary.write_frame.assert_called_once_with(websocket_frame(data[:-1], True))
+    # The character split at the end is left to the next frames
+    broadcast.send_scrollback(text, data[:-1])
+    text.write_frame.assert_called_once_with(websocket_frame(b"test", False))
+
+    # Nothing is sent without scrollback
+    text.write_frame.reset_mock()
+    broadcast.send_scrollback(text, b"")
+    assert text.write_frame.call_count == 0
+
+
+class LineFramerTest(AsyncTestCase):
+    @gen_test
+    def test_line_framer_latency(self):
+        on_flush = mock.Mock()
+        framer = LineFramer(on_flush, max_latency=0.05)
+        framer.feed("line 1\n")
+        framer.feed("line 2\nline")
+        yield gen.sleep(0.01)
+        assert on_flush.call_count == 0
+        yield gen.sleep(0.06)
+        # Only complete lines are flushed
+        on_flush.assert_called_once_with("line 1\nline 2\n")
+
+        on_flush.reset_mock()
+        framer.feed(" 3\n")
+        yield gen.sleep(0.06)
+        on_flush.assert_called_once_with("line 3\n")
+
+        # Without any newline, text is flushed after the maximum latency
+        on_flush.reset_mock()
+        framer.feed("no newline")
+        yield gen.sleep(0.06)
+        on_flush.assert_called_once_with("no newline")
+        on_flush.reset_mock()
+        yield gen.sleep(0.06)
+        assert on_flush.call_count == 0
+
+    @gen_test
+    def test_line_framer_partial_line(self):
+        on_flush = mock.Mock()
+        framer = LineFramer(on_flush, max_latency=0.05)
+        framer.feed("line 1\npartial")
+        yield gen.sleep(0.06)
+        on_flush.assert_called_once_with("line 1\n")
+
+        # A partial line waits at most another max_latency period
+        on_flush.reset_mock()
+        yield gen.sleep(0.06)
+        on_flush.assert_called_once_with("partial")
+
+    @gen_test
+    def test_line_framer_max_size(self):
+        on_flush = mock.Mock()
+        framer = LineFramer(on_flush, max_size=10, max_latency=0.05)
+        framer.feed("12345\n")
+        assert on_flush.call_count == 0
+        framer.feed("6789\n0")
+        on_flush.assert_called_once_with("12345\n6789\n")
+
+        on_flush.reset_mock()
+        framer.feed("123456789012")
+        on_flush.assert_called_once_with("0123456789012")
+
+    @gen_test
+    def test_line_framer_close(self):
+        on_flush = mock.Mock()
+        framer = LineFramer(on_flush, max_latency=0.05)
+        framer.feed("line\n")
+        framer.close()
+        yield gen.sleep(0.06)
+        assert on_flush.call_count == 0
+
+    @gen_test
+    def test_broadcast_line_framing(self):
+        websockets = [_websocket(True, "line"), _websocket(True), _websocket(False)]
+        broadcast = NodeBroadcast("node-1", websockets, line_max_latency=0.05)
+        for i in range(10):
+            broadcast.send(f"line {i}\n".encode())
+
+        # Chunk framed and binary websockets receive one frame per chunk
+        assert websockets[1].write_frame.call_count == 10
+        assert websockets[2].write_frame.call_count == 10
+        assert websockets[0].write_frame.call_count == 0
+        yield gen.sleep(0.06)
+        expected = "".join(f"line {i}\n" for i in range(10)).encode()
+        websockets[0].write_frame.assert_called_once_with(
+            websocket_frame(expected, binary=False)
+        )
+
+        broadcast.send(b"test\n")
+        broadcast.close()
+        yield gen.sleep(0.06)
+        assert websockets[0].write_frame.call_count == 1
+
+    @gen_test
+    def test_broadcast_send_scrollback_line_framing(self):
+        websockets = [_websocket(True, "line")]
+        broadcast = NodeBroadcast("node-1", websockets, line_max_latency=0.05)
+        broadcast.send(b"line 1\nline 2\n")
+        yield gen.sleep(0.06)
+        broadcast.send(b"line 3\n")
+
+        # Text still buffered is only sent once, with the next lines
+        websocket = _websocket(True, "line")
+        broadcast.send_scrollback(websocket, b"line 1\nline 2\nline 3\n")
+        websocket.write_frame.assert_called_once_with(
+            websocket_frame(b"line 1\nline 2\n", binary=False)
+        )
+        broadcast.close()
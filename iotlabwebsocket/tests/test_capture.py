@@ -0,0 +1,98 @@
+"""iotlabwebsocket capture tests."""
+
+import os.path
+import threading
+
+import mock
+import pytest
+
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from iotlabwebsocket.capture import (
+    CaptureWriter,
+    capture_path,
+    read_records,
+    MAGIC,
+    START,
+    RECORD,
+    CAPTURE_DROPPED_BYTES,
+)
+
+
+def _records(path):
+    with open(path, "rb") as capture:
+        return [(ts, bytes(data)) for ts, data in read_records(capture.read())]
+
+
+def test_capture_path():
+    path = capture_path("/tmp", "m3-1")
+    assert path.startswith("/tmp/m3-1-")
+    assert path.endswith(".capture")
+    assert capture_path("/tmp", "m3-1") != path
+
+
+def test_read_records_invalid():
+    with pytest.raises(ValueError):
+        list(read_records(b"not a capture"))
+    assert not list(
+        read_records(MAGIC + START.pack(10.0) + RECORD.pack(1.0, 4) + b"te")
+    )
+    assert not list(read_records(MAGIC + b"trunc"))
+
+
+class CaptureWriterTest(AsyncTestCase):
+    @pytest.fixture(autouse=True)
+    def _tmpdir(self, tmpdir):
+        self.tmpdir = tmpdir.strpath
+
+    @gen_test
+    def test_capture_writer(self):
+        path = os.path.join(self.tmpdir, "node.capture")
+        with mock.patch("iotlabwebsocket.capture.time") as clock:
+            clock.time.return_value = 1000.0
+            clock.monotonic.return_value = 10.0
+            writer = CaptureWriter(path, batch_size=20, flush_interval=0.05)
+            # Records are timed with the monotonic clock from the start
+            clock.time.return_value = 0.0
+            clock.monotonic.return_value = 12.5
+            # Full batches are handed to the writer at once
+            writer.write(memoryview(b"0123456789"))
+            writer.write(b"test")
+        assert len(writer._batch) == RECORD.size + 4
+        # and other records after the flush interval
+        yield gen.sleep(0.1)
+        assert not writer._batch
+
+        writer.close()
+        writer.join()
+        assert _records(path) == [(1002.5, b"0123456789"), (1002.5, b"test")]
+
+    @gen_test
+    def test_capture_writer_slow_disk(self):
+        path = os.path.join(self.tmpdir, "node.capture")
+        blocked = threading.Event()
+        dropped = CAPTURE_DROPPED_BYTES.value
+        with mock.patch("iotlabwebsocket.capture.open", create=True) as capture_open:
+            capture_open.return_value.__enter__.return_value.write.side_effect = (
+                lambda _: blocked.wait()
+            )
+            writer = CaptureWriter(path, batch_size=1, queue_size=2)
+            for _ in range(5):
+                writer.write(b"data")
+            # The writer is blocked on the magic and 2 batches are waiting
+            size = RECORD.size + 4
+            assert writer.dropped == 3 * size
+            assert CAPTURE_DROPPED_BYTES.value == dropped + 3 * size
+            blocked.set()
+            writer.close()
+            writer.join()
+
+    @gen_test
+    def test_capture_writer_error(self):
+        path = os.path.join(self.tmpdir, "missing", "node.capture")
+        writer = CaptureWriter(path)
+        writer.write(b"data")
+        writer.close()
+        writer.join(1)
+        assert not writer._thread.is_alive()
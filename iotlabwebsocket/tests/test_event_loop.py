@@ -0,0 +1,35 @@
+"""iotlabwebsocket event loop selection tests."""
+
+import asyncio
+
+import mock
+import pytest
+
+from iotlabwebsocket.event_loop import set_event_loop_policy
+
+
+@pytest.fixture(autouse=True)
+def reset_policy():
+    yield
+    asyncio.set_event_loop_policy(None)
+
+
+def test_asyncio_event_loop():
+    assert set_event_loop_policy("asyncio") == "asyncio"
+    assert type(asyncio.get_event_loop_policy()) is asyncio.DefaultEventLoopPolicy
+
+
+def test_uvloop_event_loop():
+    uvloop = mock.Mock()
+    uvloop.EventLoopPolicy.return_value = asyncio.DefaultEventLoopPolicy()
+    with mock.patch("iotlabwebsocket.event_loop.uvloop", uvloop):
+        assert set_event_loop_policy("uvloop") == "uvloop"
+    assert asyncio.get_event_loop_policy() is uvloop.EventLoopPolicy.return_value
+
+
+@mock.patch("iotlabwebsocket.event_loop.uvloop", None)
+def test_uvloop_event_loop_missing():
+    with mock.patch("iotlabwebsocket.event_loop.LOGGER.warning") as warning:
+        assert set_event_loop_policy("uvloop") == "asyncio"
+    warning.assert_called_once()
+    assert type(asyncio.get_event_loop_policy()) is asyncio.DefaultEventLoopPolicy
@@ -4,9 +4,10 @@ import json
 from collections import namedtuple
 
 import tornado.testing
+import tornado.web
 
 from iotlabwebsocket.api import ApiClient
-from iotlabwebsocket.handlers.http_handler import NODES
+from iotlabwebsocket.handlers.http_handler import NODES, HttpApiRequestHandler
 from iotlabwebsocket.web_application import WebApplication
 
 Response = namedtuple("Response", ["code", "body"])
@@ -64,3 +65,21 @@ class TestHttpApiHandlerInvalidTokenApp(tornado.testing.AsyncHTTPTestCase):
         )
         assert response.code == expected_response.code
         assert response.body == expected_response.body
+
+
+class TestHttpApiHandlerNodesApp(tornado.testing.AsyncHTTPTestCase):
+    def get_app(self):
+        return tornado.web.Application(
+            [
+                (
+                    r"/api/experiments/[0-9]+/.*",
+                    HttpApiRequestHandler,
+                    dict(token="token", nodes=["node-1.local", "node-2.local"]),
+                )
+            ]
+        )
+
+    def test_nodes_request(self):
+        response = self.fetch("/api/experiments/123/", method="GET")
+        assert response.code == 200
+        assert json.loads(response.body) == {"nodes": ["node-1.local", "node-2.local"]}
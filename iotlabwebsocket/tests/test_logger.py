@@ -1,16 +1,34 @@
 """iotlab-websocket logger test."""
 
 import os.path
+import json
+import queue
 import logging
 from logging.handlers import RotatingFileHandler
 
-from iotlabwebsocket.logger import setup_server_logger, LOGGER
+from iotlabwebsocket.logger import (
+    setup_server_logger,
+    setup_session_logger,
+    SESSION_LOGGER,
+    DroppingQueueHandler,
+    BufferedRotatingFileHandler,
+    LOGGER,
+    DROPPED_LOGS,
+)
+
+
+def _teardown(logger, listener):
+    listener.stop()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    assert len(logger.handlers) == 0
+    logger.setLevel(logging.DEBUG)
 
 
 def test_server_empty_logger():
     logger = logging.getLogger("iotlabwebsocket")
     assert logger is LOGGER
-    setup_server_logger()
+    assert setup_server_logger() is None
     assert not logger.handlers
 
 
@@ -18,26 +36,107 @@ def test_server_file_logger(tmpdir):
     logger = logging.getLogger("iotlabwebsocket")
     assert logger is LOGGER
     log_file = os.path.join(tmpdir.strpath, "test.log")
-    setup_server_logger(log_file=log_file)
+    listener = setup_server_logger(log_file=log_file)
     assert len(logger.handlers) == 1
 
-    handler = logger.handlers[0]
-    assert isinstance(handler, RotatingFileHandler)
+    assert isinstance(logger.handlers[0], DroppingQueueHandler)
+    assert len(listener.handlers) == 1
+    assert isinstance(listener.handlers[0], RotatingFileHandler)
 
-    logger.info("Test logger")
+    logger.info("Test %s", "logger")
+    try:
+        raise ValueError("Test error")
+    except ValueError:
+        logger.exception("Test exception")
+    # Stopping the listener writes the queued records
+    _teardown(logger, listener)
     with open(log_file, "r") as f:
-        assert "Test logger" in f.read()
-
-    logger.removeHandler(handler)
-    assert len(logger.handlers) == 0
+        content = f.read()
+    assert "Test logger" in content
+    assert "ValueError: Test error" in content
 
 
 def test_server_console_logger(capsys):
     logger = logging.getLogger("iotlabwebsocket")
     assert logger is LOGGER
-    setup_server_logger(log_console=True)
+    listener = setup_server_logger(log_console=True)
     assert len(logger.handlers) == 1
-    handler = logger.handlers[0]
+    handler = listener.handlers[0]
     assert isinstance(handler, logging.StreamHandler)
-    logger.removeHandler(handler)
-    assert len(logger.handlers) == 0
+    # Debug records are not even created
+    assert not logger.isEnabledFor(logging.DEBUG)
+    _teardown(logger, listener)
+
+
+def test_dropping_queue_handler():
+    log_queue = queue.Queue(2)
+    handler = DroppingQueueHandler(log_queue)
+    dropped = DROPPED_LOGS.value
+    record = logging.makeLogRecord({"msg": "Test %d", "args": (1,)})
+    for _ in range(3):
+        handler.handle(record)
+    assert handler.dropped == 1
+    assert DROPPED_LOGS.value == dropped + 1
+
+    # Records are formatted by the listener, not when enqueued
+    queued = log_queue.get_nowait()
+    assert queued.msg == "Test %d"
+    assert queued.getMessage() == "Test 1"
+
+
+def test_buffered_rotating_file_handler(tmpdir):
+    log_file = os.path.join(tmpdir.strpath, "test.log")
+    handler = BufferedRotatingFileHandler(log_file, 100, 1, buffer_size=50)
+    record = logging.makeLogRecord({"msg": "x" * 29})
+    handler.handle(record)
+    # Records are buffered
+    assert os.path.getsize(log_file) == 0
+    handler.handle(record)
+    assert os.path.getsize(log_file) == 60
+
+    # The file is rotated before exceeding the maximum size
+    handler.handle(record)
+    handler.handle(record)
+    assert os.path.getsize(log_file) == 60
+    assert os.path.getsize(f"{log_file}.1") == 60
+    handler.handle(record)
+    handler.close()
+    assert os.path.getsize(log_file) == 90
+
+
+def test_buffered_rotating_file_handler_large_batch(tmpdir):
+    log_file = os.path.join(tmpdir.strpath, "test.log")
+    handler = BufferedRotatingFileHandler(log_file, 100, 1, buffer_size=200)
+    for _ in range(5):
+        handler.handle(logging.makeLogRecord({"msg": "x" * 29}))
+    # A batch larger than the maximum size is written to the empty file
+    handler.flush()
+    assert os.path.getsize(log_file) == 150
+    assert not os.path.exists(f"{log_file}.1")
+    handler.handle(logging.makeLogRecord({"msg": "x" * 29}))
+    handler.close()
+    assert os.path.getsize(log_file) == 30
+    assert os.path.getsize(f"{log_file}.1") == 150
+
+
+def test_session_logger(tmpdir):
+    assert setup_session_logger() is None
+    assert not SESSION_LOGGER.isEnabledFor(logging.INFO)
+
+    session_log = os.path.join(tmpdir.strpath, "sessions.log")
+    listener = setup_session_logger(session_log)
+    assert SESSION_LOGGER.isEnabledFor(logging.INFO)
+    SESSION_LOGGER.info({"node": "m3-1", "bytes_in": 4})
+    SESSION_LOGGER.info({"node": "m3-2", "bytes_in": 0})
+    listener.stop()
+    for handler in list(SESSION_LOGGER.handlers):
+        SESSION_LOGGER.removeHandler(handler)
+    SESSION_LOGGER.setLevel(logging.WARNING)
+
+    with open(session_log, "r") as f:
+        records = [json.loads(line) for line in f]
+    assert [record["node"] for record in records] == ["m3-1", "m3-2"]
+    assert records[0]["bytes_in"] == 4
+    assert "time" in records[0]
+    # Session records are not written to the server log
+    assert not LOGGER.handlers
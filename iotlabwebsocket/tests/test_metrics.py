@@ -0,0 +1,85 @@
+"""iotlabwebsocket metrics tests."""
+
+import codecs
+
+from iotlabwebsocket import metrics
+from iotlabwebsocket.broadcast import TEXT_ERRORS
+from iotlabwebsocket.metrics import Counter, Histogram, Gauge, exposition
+
+
+def test_counter():
+    counter = Counter("test", "Test counter.")
+    counter.inc()
+    counter.inc(41)
+    assert counter.value == 42
+    assert counter.exposition() == (
+        "# HELP iotlab_websocket_test Test counter.\n"
+        "# TYPE iotlab_websocket_test counter\n"
+        "iotlab_websocket_test_total 42"
+    )
+
+
+def test_counter_labels():
+    counter = Counter("test", "Test counter.", ("result", "reason"))
+    child = counter.labels("rejected", "token")
+    assert counter.labels("rejected", "token") is child
+    child.inc()
+    counter.labels("accepted", "").inc(2)
+    assert counter.samples() == [
+        'iotlab_websocket_test_total{result="accepted",reason=""} 2',
+        'iotlab_websocket_test_total{result="rejected",reason="token"} 1',
+    ]
+
+
+def test_histogram():
+    histogram = Histogram("test", "Test histogram.", ("resource",), buckets=(0.1, 1))
+    histogram.labels("token").observe(0.05)
+    histogram.labels("token").observe(0.1)
+    histogram.labels("token").observe(2)
+    assert histogram.samples() == [
+        'iotlab_websocket_test_bucket{resource="token",le="0.1"} 2',
+        'iotlab_websocket_test_bucket{resource="token",le="1"} 2',
+        'iotlab_websocket_test_bucket{resource="token",le="+Inf"} 3',
+        'iotlab_websocket_test_sum{resource="token"} 2.15',
+        'iotlab_websocket_test_count{resource="token"} 3',
+    ]
+
+
+def test_gauge():
+    values = {("node-2",): 1, ("node-1",): 2}
+    gauge = Gauge("test", "Test gauge.", ("node",), collect=lambda: values)
+    assert gauge.exposition().splitlines()[1:] == [
+        "# TYPE iotlab_websocket_test gauge",
+        'iotlab_websocket_test{node="node-1"} 2',
+        'iotlab_websocket_test{node="node-2"} 1',
+    ]
+    values.clear()
+    assert gauge.samples() == []
+
+
+def test_exposition():
+    text = exposition(metrics.METRICS)
+    assert text.endswith("\n")
+    for metric in metrics.METRICS:
+        assert f"# TYPE {metric.name} {metric.kind}\n" in text
+
+
+def test_exposition_labels():
+    counter = Counter("test", "Test counter.", ("result",))
+    counter.labels("accepted").inc()
+    gauge = Gauge("gauge", "Test gauge.", collect=lambda: {(): 3})
+    lines = exposition((counter, gauge), {"worker": 1}).splitlines()
+    assert 'iotlab_websocket_test_total{result="accepted",worker="1"} 1' in lines
+    assert 'iotlab_websocket_gauge{worker="1"} 3' in lines
+
+
+def test_decode_errors():
+    errors = metrics.DECODE_ERRORS.value
+    assert b"a\xffb\xfe".decode("utf-8", TEXT_ERRORS["replace"]) == "a�b�"
+    assert b"a\xffb".decode("utf-8", TEXT_ERRORS["skip"]) == "ab"
+    assert metrics.DECODE_ERRORS.value == errors + 3
+
+    decoder = codecs.getincrementaldecoder("utf-8")(TEXT_ERRORS["replace"])
+    assert decoder.decode(b"\xc3") == ""
+    assert decoder.decode(b"\xa9") == "\xe9"
+    assert metrics.DECODE_ERRORS.value == errors + 3
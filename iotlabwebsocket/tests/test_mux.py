@@ -0,0 +1,28 @@
+"""iotlabwebsocket multiplexed websockets tests."""
+
+import mock
+
+from iotlabwebsocket.broadcast import websocket_frame
+from iotlabwebsocket.mux import Subscription, control_frame, mux_frame
+
+
+def test_subscription():
+    websocket = mock.Mock(
+        site="local", experiment_id="123", user="user", buffered_bytes=10
+    )
+    subscription = Subscription(websocket, "node-1", 3)
+    assert (subscription.node, subscription.user) == ("node-1", "user")
+    assert subscription.buffered_bytes == 10
+
+    # Frames are tagged with the id of the subscription
+    subscription.write_frame(websocket_frame(b"test", binary=True))
+    websocket.write_frame.assert_called_with(mux_frame(3, b"test"))
+    subscription.write_message("No TCP connection opened")
+    websocket.write_frame.assert_called_with(
+        control_frame(error="No TCP connection opened", id=3)
+    )
+
+    # The multiplexed websocket is told once when it is closed
+    subscription.close(code=1000, reason="closed")
+    subscription.close(code=1001, reason="again")
+    websocket.unsubscribe.assert_called_once_with(subscription, 1000, "closed")
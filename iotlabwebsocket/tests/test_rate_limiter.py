@@ -0,0 +1,89 @@
+"""iotlabwebsocket rate limiter tests."""
+
+import pytest
+
+from iotlabwebsocket.rate_limiter import TokenBucket, RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket():
+    clock = FakeClock()
+    bucket = TokenBucket(100, 200, clock=clock)
+    assert bucket.tokens == 200
+
+    assert bucket.can_consume(200)
+    bucket.consume(150)
+    assert not bucket.can_consume(100)
+
+    # Tokens are added at the configured rate
+    clock.now += 0.5
+    assert bucket.can_consume(100)
+    assert bucket.tokens == 100
+
+    # up to the burst size
+    clock.now += 10
+    bucket.refill()
+    assert bucket.tokens == 200
+
+
+def test_token_bucket_default_burst():
+    bucket = TokenBucket(100, clock=FakeClock())
+    assert bucket.burst == 100
+
+
+def test_token_bucket_debt():
+    clock = FakeClock()
+    bucket = TokenBucket(100, 100, clock=clock)
+    assert bucket.delay() == 0
+
+    # Amounts larger than the burst are accepted by a full bucket
+    assert bucket.can_consume(150)
+    bucket.consume(150)
+    assert bucket.delay() == pytest.approx(0.5)
+
+    clock.now += 0.5
+    assert not bucket.can_consume(1)
+    clock.now += 0.01
+    assert bucket.can_consume(1)
+
+
+def test_rate_limiter_allow():
+    clock = FakeClock()
+    node = TokenBucket(100, 100, clock=clock)
+    shared = TokenBucket(50, 150, clock=clock)
+    limiter = RateLimiter([node, shared])
+    assert limiter.action == "disconnect"
+
+    assert limiter.allow(100)
+    assert node.tokens == 0
+    assert shared.tokens == 50
+
+    # Nothing is consumed when any bucket lacks tokens
+    clock.now += 1
+    assert not limiter.allow(120)
+    assert node.tokens == 100
+    assert shared.tokens == 100
+    assert limiter.allow(50)
+
+
+def test_rate_limiter_throttle():
+    clock = FakeClock()
+    limiter = RateLimiter(
+        [TokenBucket(100, 100, clock=clock), TokenBucket(50, 100, clock=clock)],
+        action="throttle",
+    )
+    assert limiter.throttle(100) == 0
+    # The slowest bucket sets the delay
+    assert limiter.throttle(50) == pytest.approx(1)
+
+    clock.now += 1
+    assert limiter.throttle(0) == 0
+
+    assert RateLimiter([], action="throttle").throttle(100) == 0
@@ -0,0 +1,74 @@
+"""iotlabwebsocket capture replay tests."""
+
+import os.path
+import time
+
+import pytest
+
+from tornado.tcpclient import TCPClient
+from tornado.testing import AsyncTestCase, gen_test, bind_unused_port
+
+from iotlabwebsocket.capture import MAGIC, START, RECORD
+from iotlabwebsocket.replay import ReplayServer, main
+
+CAPTURE = (
+    MAGIC
+    + START.pack(1000.0)
+    + RECORD.pack(100.0, 5)
+    + b"start"
+    + RECORD.pack(100.0, 1)
+    + b"\n"
+    + RECORD.pack(100.2, 4)
+    + b"end\n"
+)
+
+
+class ReplayServerTest(AsyncTestCase):
+    server = None
+
+    def tearDown(self):
+        if self.server is not None:
+            self.server.stop()
+        super().tearDown()
+
+    def _server(self, **kwargs):
+        sock, port = bind_unused_port()
+        self.server = ReplayServer(CAPTURE, **kwargs)
+        self.server.add_socket(sock)
+        return port
+
+    @gen_test
+    def test_replay(self):
+        port = self._server()
+        start = time.monotonic()
+        stream = yield TCPClient().connect("localhost", port)
+        data = yield stream.read_until_close()
+        assert data == b"start\nend\n"
+        assert time.monotonic() - start >= 0.2
+
+    @gen_test
+    def test_replay_speed(self):
+        port = self._server(speed=0)
+        start = time.monotonic()
+        stream = yield TCPClient().connect("localhost", port)
+        data = yield stream.read_until_close()
+        assert data == b"start\nend\n"
+        assert time.monotonic() - start < 0.2
+
+    @gen_test
+    def test_replay_loop(self):
+        port = self._server(speed=10, loop=True)
+        stream = yield TCPClient().connect("localhost", port)
+        data = yield stream.read_bytes(3 * len(b"start\nend\n"))
+        assert data == 3 * b"start\nend\n"
+        stream.close()
+
+
+def test_replay_main_invalid_capture(tmpdir):
+    path = os.path.join(tmpdir.strpath, "node.capture")
+    with pytest.raises(SystemExit):
+        main([path])
+    with open(path, "wb") as capture:
+        capture.write(b"not a capture")
+    with pytest.raises(SystemExit):
+        main([path])
@@ -0,0 +1,49 @@
+"""iotlabwebsocket scrollback tests."""
+
+import pytest
+
+from iotlabwebsocket.scrollback import Scrollback, Scrollbacks
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 10, 25])
+def test_scrollback(chunk_size):
+    data = bytes(range(100))
+    scrollback = Scrollback(10)
+    for index in range(0, len(data), chunk_size):
+        scrollback.write(memoryview(data)[index : index + chunk_size])
+        end = min(index + chunk_size, len(data))
+        assert scrollback.end == end
+        assert scrollback.read() == data[max(0, end - 10) : end]
+
+    assert scrollback.start == 90
+    assert scrollback.read(since=95) == data[95:]
+    # Offsets are bounded by the bytes kept
+    assert scrollback.read(since=0) == data[90:]
+    assert scrollback.read(since=200) == b""
+    assert scrollback.offset(since=0) == 90
+    assert scrollback.offset(since=200) == 100
+
+
+def test_scrollbacks():
+    scrollbacks = Scrollbacks(4, total_size=10)
+    assert scrollbacks.max_count == 2
+    assert scrollbacks.offset("node-1") == 0
+    assert scrollbacks.read("node-1") == b""
+
+    scrollbacks.write("node-1", b"abcdef")
+    scrollbacks.write("node-2", b"test")
+    scrollbacks.write("node-1", b"g")
+    assert scrollbacks.offset("node-1") == 3
+    assert scrollbacks.read("node-1", since=5) == b"fg"
+
+    # The scrollback which received data least recently is dropped
+    scrollbacks.write("node-3", b"new")
+    assert len(scrollbacks) == 2
+    assert scrollbacks.read("node-2") == b""
+    assert scrollbacks.read("node-1") == b"defg"
+    assert scrollbacks.read("node-3") == b"new"
+
+    # Nothing is kept when the total size is smaller than one scrollback
+    scrollbacks = Scrollbacks(4, total_size=3)
+    scrollbacks.write("node-1", b"test")
+    assert len(scrollbacks) == 0
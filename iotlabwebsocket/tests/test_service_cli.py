@@ -1,35 +1,66 @@
 """iotlabwebsocket service cli tests."""
 
+import asyncio
 import os
 import os.path
 import unittest
 
 import mock
+import pytest
 
 from iotlabwebsocket.api import ApiClient
 from iotlabwebsocket.service_cli import main
 
+# Default settings passed to the web application
+APP_SETTINGS = dict(
+    text_errors="replace",
+    line_max_latency=0.005,
+    line_max_size=4096,
+    websocket_compression_options=None,
+    compression_window_bits=15,
+    compression_min_size=128,
+    write_queue_size=262144,
+    write_queue_policy="drop-oldest",
+    write_high_water_mark=65536,
+    write_low_water_mark=16384,
+    tcp_min_chunk_size=1024,
+    tcp_max_chunk_size=65536,
+    tcp_linger=0,
+    tcp_linger_buffer_size=65536,
+    tcp_linger_pool_size=100,
+    rate_limits={"node": (15000, 15000)},
+    rate_limit_action="disconnect",
+    trace_sample_rate=0,
+    scrollback_size=0,
+    scrollback_total_size=67108864,
+    session_buffer_size=65536,
+    session_grace=30,
+    group_send_timeout=5,
+    capture_nodes=[],
+    capture_dir=".",
+)
+
 
 @mock.patch("iotlabwebsocket.web_application.WebApplication.stop")
 @mock.patch("iotlabwebsocket.web_application.WebApplication.listen")
 @mock.patch("iotlabwebsocket.web_application.WebApplication.__init__")
-@mock.patch("tornado.ioloop.IOLoop.instance")
+@mock.patch("iotlabwebsocket.service_cli._wait_forever")
 class ServiceCliTest(unittest.TestCase):
-    def test_main_service_cli_default(self, ioloop, init, listen, stop_app):
+    def test_main_service_cli_default(self, wait_forever, init, listen, stop_app):
         init.return_value = None
         args = []
 
         default_api = ApiClient("https")
         main(args)
 
-        ioloop.assert_called_once()  # for the start
+        wait_forever.assert_called_once()  # for the start
         args, kwargs = init.call_args
         assert len(args) == 1
         assert args[0] == default_api
-        assert kwargs == dict(use_local_api=False, token="")
+        assert kwargs == dict(use_local_api=False, token="", **APP_SETTINGS)
         listen.assert_called_with("8000")
 
-    def test_main_service_cli_args(self, ioloop, init, listen, stop_app):
+    def test_main_service_cli_args(self, wait_forever, init, listen, stop_app):
         init.return_value = None
         api_host_test = "testhost"
         api_port_test = "8080"
@@ -49,46 +80,325 @@ class ServiceCliTest(unittest.TestCase):
         ]
         main(args)
 
-        ioloop.assert_called_once()  # for the start
+        wait_forever.assert_called_once()  # for the start
         args, kwargs = init.call_args
         assert len(args) == 1
         assert args[0] == api_test
-        assert kwargs == dict(use_local_api=True, token=token_test)
+        assert kwargs == dict(use_local_api=True, token=token_test, **APP_SETTINGS)
         listen.assert_called_with(port_test)
 
-    def test_main_service_http(self, ioloop, init, listen, stop_app):
+    def test_main_service_running_loop(self, wait_forever, init, listen, stop_app):
+        loops = []
+        init.side_effect = lambda *args, **kwargs: loops.append(
+            asyncio.get_running_loop()
+        )
+        main([])
+
+        # The application is built in the loop serving it
+        assert len(loops) == 1
+
+    def test_main_service_http(self, wait_forever, init, listen, stop_app):
         init.return_value = None
         args = ["--api-protocol", "http"]
 
         http_api = ApiClient("http")
         main(args)
 
-        ioloop.assert_called_once()  # for the start
+        wait_forever.assert_called_once()  # for the start
         args, kwargs = init.call_args
         assert len(args) == 1
         assert args[0] == http_api
-        assert kwargs == dict(use_local_api=False, token="")
+        assert kwargs == dict(use_local_api=False, token="", **APP_SETTINGS)
         listen.assert_called_with("8000")
 
+    def test_main_service_api_cache(self, wait_forever, init, listen, stop_app):
+        init.return_value = None
+        args = ["--api-cache-ttl", "2.5", "--api-cache-size", "12"]
+        main(args)
+
+        args, _ = init.call_args
+        assert args[0].cache.ttl == 2.5
+        assert args[0].cache.size == 12
+
+    def test_main_service_api_client(self, wait_forever, init, listen, stop_app):
+        init.return_value = None
+        args = [
+            "--api-backend",
+            "curl",
+            "--api-max-clients",
+            "42",
+            "--api-connect-timeout",
+            "1",
+            "--api-request-timeout",
+            "2.5",
+        ]
+        main(args)
+
+        args, _ = init.call_args
+        assert args[0].client_class is ApiClient._client_class("curl")
+        assert args[0].client_options == {
+            "max_clients": 42,
+            "defaults": {"connect_timeout": 1, "request_timeout": 2.5},
+        }
+
+    def test_main_service_text(self, wait_forever, init, listen, stop_app):
+        init.return_value = None
+        args = [
+            "--text-errors",
+            "skip",
+            "--line-max-latency",
+            "0.1",
+            "--line-max-size",
+            "100",
+        ]
+        main(args)
+
+        _, kwargs = init.call_args
+        assert kwargs["text_errors"] == "skip"
+        assert kwargs["line_max_latency"] == 0.1
+        assert kwargs["line_max_size"] == 100
+
+    def test_main_service_compression(self, wait_forever, init, listen, stop_app):
+        init.return_value = None
+        args = [
+            "--compression",
+            "--compression-level",
+            "1",
+            "--compression-mem-level",
+            "4",
+            "--compression-window-bits",
+            "10",
+            "--compression-min-size",
+            "64",
+        ]
+        main(args)
+
+        _, kwargs = init.call_args
+        assert kwargs["websocket_compression_options"] == {
+            "compression_level": 1,
+            "mem_level": 4,
+        }
+        assert kwargs["compression_window_bits"] == 10
+        assert kwargs["compression_min_size"] == 64
+
+    def test_main_service_write_queue(self, wait_forever, init, listen, stop_app):
+        init.return_value = None
+        args = ["--write-queue-size", "1024", "--write-queue-policy", "disconnect"]
+        main(args)
+
+        _, kwargs = init.call_args
+        assert kwargs["write_queue_size"] == 1024
+        assert kwargs["write_queue_policy"] == "disconnect"
+
+    def test_main_service_water_marks(self, wait_forever, init, listen, stop_app):
+        init.return_value = None
+        args = ["--write-high-water-mark", "2048", "--write-low-water-mark", "512"]
+        main(args)
+
+        _, kwargs = init.call_args
+        assert kwargs["write_high_water_mark"] == 2048
+        assert kwargs["write_low_water_mark"] == 512
+
+    def test_main_service_chunk_size(self, wait_forever, init, listen, stop_app):
+        init.return_value = None
+        main(["--tcp-min-chunk-size", "256", "--tcp-max-chunk-size", "4096"])
+
+        _, kwargs = init.call_args
+        assert kwargs["tcp_min_chunk_size"] == 256
+        assert kwargs["tcp_max_chunk_size"] == 4096
+
+        for args in (
+            ["--tcp-min-chunk-size", "0"],
+            ["--tcp-max-chunk-size", "-1"],
+            ["--tcp-min-chunk-size", "8192", "--tcp-max-chunk-size", "4096"],
+        ):
+            with pytest.raises(SystemExit):
+                main(args)
+
+    def test_main_service_tcp_linger(self, wait_forever, init, listen, stop_app):
+        init.return_value = None
+        args = [
+            "--tcp-linger",
+            "2.5",
+            "--tcp-linger-buffer-size",
+            "1024",
+            "--tcp-linger-pool-size",
+            "10",
+        ]
+        main(args)
+
+        _, kwargs = init.call_args
+        assert kwargs["tcp_linger"] == 2.5
+        assert kwargs["tcp_linger_buffer_size"] == 1024
+        assert kwargs["tcp_linger_pool_size"] == 10
+
+    def test_main_service_rate_limits(self, wait_forever, init, listen, stop_app):
+        init.return_value = None
+        args = [
+            "--rate-limit",
+            "node=0",
+            "--rate-limit",
+            "user=1000",
+            "--rate-limit",
+            "global=10000:20000",
+            "--rate-limit-action",
+            "throttle",
+        ]
+        main(args)
+
+        _, kwargs = init.call_args
+        assert kwargs["rate_limits"] == {"user": (1000, None), "global": (10000, 20000)}
+        assert kwargs["rate_limit_action"] == "throttle"
+
+    def test_main_service_trace_sample_rate(self, wait_forever, init, listen, stop_app):
+        init.return_value = None
+        main(["--trace-sample-rate", "0.01"])
+
+        _, kwargs = init.call_args
+        assert kwargs["trace_sample_rate"] == 0.01
+
+        with pytest.raises(SystemExit):
+            main(["--trace-sample-rate", "2"])
+
+    def test_main_service_scrollback(self, wait_forever, init, listen, stop_app):
+        init.return_value = None
+        main(["--scrollback-size", "8192", "--scrollback-total-size", "1048576"])
+
+        _, kwargs = init.call_args
+        assert kwargs["scrollback_size"] == 8192
+        assert kwargs["scrollback_total_size"] == 1048576
+
+    def test_main_service_sessions(self, wait_forever, init, listen, stop_app):
+        init.return_value = None
+        main(["--session-buffer-size", "1024", "--session-grace", "5"])
+
+        _, kwargs = init.call_args
+        assert kwargs["session_buffer_size"] == 1024
+        assert kwargs["session_grace"] == 5
+
+        # The session buffer is a ring buffer, it can't be empty
+        with pytest.raises(SystemExit):
+            main(["--session-buffer-size", "0"])
+
+    def test_main_service_group_send_timeout(
+        self, wait_forever, init, listen, stop_app
+    ):
+        init.return_value = None
+        main(["--group-send-timeout", "0.5"])
+
+        _, kwargs = init.call_args
+        assert kwargs["group_send_timeout"] == 0.5
+
+    def test_main_service_capture(self, wait_forever, init, listen, stop_app):
+        init.return_value = None
+        args = ["--capture", "m3-1", "--capture", "m3-2", "--capture-dir", "/tmp"]
+        main(args)
+
+        _, kwargs = init.call_args
+        assert kwargs["capture_nodes"] == ["m3-1", "m3-2"]
+        assert kwargs["capture_dir"] == "/tmp"
+
+    @mock.patch("iotlabwebsocket.service_cli.set_event_loop_policy")
+    def test_main_service_event_loop(
+        self, set_policy, wait_forever, init, listen, stop_app
+    ):
+        init.return_value = None
+        set_policy.return_value = "asyncio"
+        main([])
+        set_policy.assert_called_with("asyncio")
+
+        main(["--event-loop", "uvloop"])
+        set_policy.assert_called_with("uvloop")
+
+    @mock.patch("iotlabwebsocket.service_cli.HTTPServer")
+    @mock.patch("iotlabwebsocket.service_cli.fork_processes")
+    @mock.patch("iotlabwebsocket.service_cli.bind_sockets")
+    def test_main_service_workers(
+        self, bind_sockets, fork, server, wait_forever, init, listen, stop_app
+    ):
+        init.return_value = None
+        public = mock.Mock()
+        internal = [mock.Mock(), mock.Mock()]
+        for port, sock in enumerate(internal):
+            sock.getsockname.return_value = ("127.0.0.1", 9000 + port)
+        bind_sockets.side_effect = [[public], [internal[0]], [internal[1]]]
+        fork.return_value = 1
+        main(["--workers", "2", "--port", "8082"])
+
+        fork.assert_called_once_with(2)
+        assert bind_sockets.call_args_list[0] == mock.call("8082")
+        internal[0].close.assert_called_once()
+        assert internal[1].close.call_count == 0
+        server.return_value.add_sockets.assert_called_once_with([public, internal[1]])
+        assert listen.call_count == 0
+
+        _, kwargs = init.call_args
+        user_connections = kwargs.pop("user_connections")
+        assert user_connections.worker_id == 1
+        assert kwargs == dict(
+            use_local_api=False,
+            token="",
+            worker_id=1,
+            worker_ports=[9000, 9001],
+            autoreload=False,
+            **APP_SETTINGS,
+        )
+
+        # Interrupting the parent process
+        stop_app.call_count = 0
+        fork.side_effect = KeyboardInterrupt
+        bind_sockets.side_effect = [[public], [internal[0]], [internal[1]]]
+        main(["--workers", "2"])
+        assert stop_app.call_count == 0
+
+    def test_main_service_invalid_rate_limit(
+        self, wait_forever, init, listen, stop_app
+    ):
+        for value in ("node", "node=fast", "site=1000"):
+            with pytest.raises(SystemExit):
+                main(["--rate-limit", value])
+
     @mock.patch("iotlabwebsocket.service_cli.setup_server_logger")
-    def test_main_service_logging(self, setup_logger, ioloop, init, listen, stop_app):
+    def test_main_service_logging(
+        self, setup_logger, wait_forever, init, listen, stop_app
+    ):
         init.return_value = None
         log_file_test = os.path.join("/tmp/test.log")
         args = ["--log-file", log_file_test, "--log-console"]
         main(args)
 
-        ioloop.assert_called_once()  # for the start
+        wait_forever.assert_called_once()  # for the start
         setup_logger.assert_called_with(log_file=log_file_test, log_console=True)
 
-    def test_main_service_exit(self, ioloop, init, listen, stop_app):
+    @mock.patch("iotlabwebsocket.service_cli.setup_session_logger")
+    def test_main_service_session_log(
+        self, setup_session_logger, wait_forever, init, listen, stop_app
+    ):
+        init.return_value = None
+        main([])
+        setup_session_logger.assert_called_with(None)
+
+        setup_session_logger.reset_mock()
+        main(["--session-log", "/tmp/sessions.log"])
+        setup_session_logger.assert_called_with("/tmp/sessions.log")
+        # Pending records are written on exit
+        setup_session_logger.return_value.stop.assert_called_once()
+
+    def test_main_service_exit(self, wait_forever, init, listen, stop_app):
         init.return_value = None
         listen.side_effect = KeyboardInterrupt
         args = []
         main(args)
 
-        ioloop.assert_called_once()  # for the stop
+        stop_app.assert_called_once()
+
+        # Interrupting the event loop stops the application
+        listen.side_effect = None
+        wait_forever.side_effect = KeyboardInterrupt
+        main(args)
+        assert stop_app.call_count == 2
 
-    def test_main_service_env(self, ioloop, init, listen, stop_app):
+    def test_main_service_env(self, wait_forever, init, listen, stop_app):
         init.return_value = None
         api_host_test = "testhost"
         api_port_test = "8080"
@@ -116,9 +426,9 @@ class ServiceCliTest(unittest.TestCase):
         os.environ.pop("API_USER")
         os.environ.pop("API_PASSWORD")
 
-        ioloop.assert_called_once()  # for the start
+        wait_forever.assert_called_once()  # for the start
         args, kwargs = init.call_args
         assert len(args) == 1
         assert args[0] == api_test
-        assert kwargs == dict(use_local_api=True, token=token_test)
+        assert kwargs == dict(use_local_api=True, token=token_test, **APP_SETTINGS)
         listen.assert_called_with(port_test)
@@ -0,0 +1,89 @@
+"""iotlabwebsocket resumable sessions tests."""
+
+import mock
+
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+from tornado.websocket import WebSocketClosedError
+
+from iotlabwebsocket.broadcast import websocket_frame
+from iotlabwebsocket.sessions import Session, session_frame, session_id
+
+
+def _websocket():
+    return mock.Mock(
+        session_id=session_id(),
+        site="local",
+        experiment_id="123",
+        node="node-1",
+        user="user",
+        buffered_bytes=10,
+        close_code=None,
+    )
+
+
+class SessionTest(AsyncTestCase):
+    @gen_test
+    def test_session(self):
+        websocket = _websocket()
+        on_end = mock.Mock()
+        session = Session(websocket, buffer_size=8, grace=0.05, on_end=on_end)
+        assert session.id == websocket.session_id
+        assert session.buffered_bytes == 10
+
+        # Frames hold the offset of their data
+        session.write_frame(websocket_frame(b"01234", binary=True))
+        session.write_frame(websocket_frame(b"56789", binary=True))
+        assert websocket.write_frame.call_args_list == [
+            mock.call(session_frame(0, b"01234")),
+            mock.call(session_frame(5, b"56789")),
+        ]
+
+        # Data are kept while the websocket is lost
+        session.detach(websocket)
+        assert session.buffered_bytes == 0
+        session.write_frame(websocket_frame(b"ab", binary=True))
+        assert websocket.write_frame.call_count == 2
+
+        # and sent again from the offset received last
+        resumed = _websocket()
+        session.attach(resumed, 7)
+        resumed.write_frame.assert_called_once_with(session_frame(7, b"789ab"))
+        yield gen.sleep(0.1)
+        assert on_end.call_count == 0
+
+        # Only the kept data are sent again
+        other = _websocket()
+        session.attach(other, 0)
+        resumed.close.assert_called_once_with(code=1000, reason="Session resumed")
+        other.write_frame.assert_called_once_with(session_frame(4, b"456789ab"))
+        session.detach(resumed)
+        assert session.websocket is other
+
+    @gen_test
+    def test_session_end(self):
+        websocket = _websocket()
+        on_end = mock.Mock()
+        session = Session(websocket, buffer_size=8, grace=0.05, on_end=on_end)
+
+        # The session ends after the grace period
+        session.detach(websocket)
+        yield gen.sleep(0.1)
+        on_end.assert_called_once_with(session)
+        assert session.closed
+
+        # or at once when the client closed it
+        websocket.close_code = 1000
+        session = Session(websocket, buffer_size=8, grace=0.05, on_end=on_end)
+        session.detach(websocket)
+        assert on_end.call_count == 2
+
+        # or when it is closed
+        session = Session(websocket, buffer_size=8, grace=0.05, on_end=on_end)
+        websocket.write_frame.side_effect = WebSocketClosedError
+        session.write_frame(websocket_frame(b"test", binary=True))
+        session.close(code=1000, reason="closed")
+        websocket.close.assert_called_with(1000, "closed")
+        session.detach(websocket)
+        yield gen.sleep(0.01)
+        assert on_end.call_count == 3
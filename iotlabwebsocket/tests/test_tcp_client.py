@@ -2,7 +2,6 @@
 # -*- coding: utf-8 -*-
 
 import sys
-import math
 
 import mock
 
@@ -16,8 +15,18 @@ from iotlabwebsocket.clients.tcp_client import (
     TCPClient,
     NODE_TCP_PORT,
     CHUNK_SIZE,
-    MAX_BYTES_RECEIVED_PER_PERIOD,
 )
+from iotlabwebsocket.rate_limiter import (
+    RateLimiter,
+    TokenBucket,
+    NODE_RATE,
+    NODE_BURST,
+)
+
+
+def _copy(on_data):
+    """Copy the received data which is only valid during the on_data call."""
+    return lambda node, data: on_data(node, bytes(data))
 
 
 class TCPServerStub(TCPServer):
@@ -39,7 +48,7 @@ class TCPServerStub(TCPServer):
 class NodeHandlerTest(AsyncTestCase):
     @gen_test
     def test_tcp_connection(self):
-        client = TCPClient()
+        client = TCPClient(max_chunk_size=CHUNK_SIZE)
 
         sock, _ = bind_unused_port()
         server = TCPServerStub()
@@ -50,7 +59,7 @@ class NodeHandlerTest(AsyncTestCase):
         on_data = mock.Mock()
 
         # Connect to the TCP server stub
-        yield client.start("localhost", on_data, on_close)
+        yield client.start("localhost", _copy(on_data), on_close)
         assert client.ready
         assert client.node == "localhost"
 
@@ -111,7 +120,7 @@ class NodeHandlerTest(AsyncTestCase):
         assert not server.received
 
         # When the TCP connection is lost, all websockets are closed
-        yield client.start("localhost", on_data, on_close)
+        yield client.start("localhost", _copy(on_data), on_close)
         assert client.ready
         assert client.node == "localhost"
 
@@ -121,8 +130,8 @@ class NodeHandlerTest(AsyncTestCase):
         on_close.assert_called_once()
         assert not client.ready
 
-    @gen_test
-    def test_tcp_too_fast(self):
+    @gen.coroutine
+    def _start_limited(self, limiter):
         client = TCPClient()
 
         sock, _ = bind_unused_port()
@@ -134,23 +143,151 @@ class NodeHandlerTest(AsyncTestCase):
         on_data = mock.Mock()
 
         # Connect to the TCP server stub
-        yield client.start("localhost", on_data, on_close)
+        yield client.start("localhost", _copy(on_data), on_close, limiter=limiter)
         assert client.ready
-        assert client.node == "localhost"
+        assert client.limiter is limiter
+        raise gen.Return((server, on_data, on_close))
 
-        # String is sent via websocket character by character
-        message = b"A" * MAX_BYTES_RECEIVED_PER_PERIOD
-        server.stream.write(message)
+    @gen_test
+    def test_tcp_too_fast(self):
+        now = [0]
+        bucket = TokenBucket(NODE_RATE, NODE_BURST, clock=lambda: now[0])
+        server, on_data, on_close = yield self._start_limited(RateLimiter([bucket]))
+
+        # The burst is accepted
+        server.stream.write(b"A" * NODE_BURST)
         yield gen.sleep(0.01)
-        assert (
-            on_data.call_count
-            == (math.floor(MAX_BYTES_RECEIVED_PER_PERIOD / CHUNK_SIZE)) + 1
-        )
-        yield gen.sleep(1)
+        assert sum(len(args[1]) for args, _ in on_data.call_args_list) == NODE_BURST
+        assert on_close.call_count == 0
+
+        on_data.reset_mock()
         server.stream.write(b"Too fast")
         yield gen.sleep(0.01)
+        assert on_data.call_count == 0
         on_close.assert_called_once()
 
+        # The bucket is refilled over time
+        now[0] += 1
+        server.stream.write(b"Not too fast")
+        yield gen.sleep(0.01)
+        on_data.assert_called_once_with("localhost", b"Not too fast")
+
+    @gen_test
+    def test_tcp_too_fast_shed(self):
+        now = [0]
+        bucket = TokenBucket(1000, CHUNK_SIZE, clock=lambda: now[0])
+        limiter = RateLimiter([bucket], action="shed")
+        server, on_data, on_close = yield self._start_limited(limiter)
+
+        server.stream.write(b"A" * CHUNK_SIZE)
+        yield gen.sleep(0.01)
+        on_data.assert_called_once()
+
+        # Data exceeding the limit is dropped
+        server.stream.write(b"dropped")
+        yield gen.sleep(0.01)
+        on_data.assert_called_once()
+        assert on_close.call_count == 0
+
+        now[0] += 0.1
+        server.stream.write(b"kept")
+        yield gen.sleep(0.01)
+        on_data.assert_called_with("localhost", b"kept")
+
+    @gen_test
+    def test_tcp_too_fast_throttle(self):
+        bucket = TokenBucket(10 * CHUNK_SIZE, CHUNK_SIZE, clock=lambda: 0)
+        limiter = RateLimiter([bucket], action="throttle")
+        server, on_data, on_close = yield self._start_limited(limiter)
+
+        # The second chunk puts the bucket in debt for 0.1 second
+        server.stream.write(b"A" * 2 * CHUNK_SIZE)
+        yield gen.sleep(0.01)
+        assert on_data.call_count == 2
+
+        # Reading is delayed
+        server.stream.write(b"delayed")
+        yield gen.sleep(0.05)
+        assert on_data.call_count == 2
+        yield gen.sleep(0.1)
+        on_data.assert_called_with("localhost", b"delayed")
+        assert on_close.call_count == 0
+
+    @gen_test
+    def test_tcp_adaptive_chunk_size(self):
+        client = TCPClient(min_chunk_size=64, max_chunk_size=256)
+
+        sock, _ = bind_unused_port()
+        server = TCPServerStub()
+        server.add_socket(sock)
+        server.listen(NODE_TCP_PORT)
+
+        on_data = mock.Mock()
+        yield client.start("localhost", _copy(on_data), mock.Mock())
+        assert client.chunk_size == 64
+
+        # Reads filling the buffer grow it up to the maximum size
+        server.stream.write(b"a" * 1024)
+        yield gen.sleep(0.01)
+        assert [len(args[1]) for args, _ in on_data.call_args_list] == [
+            64,
+            128,
+            256,
+            256,
+            256,
+            64,
+        ]
+        assert client.chunk_size == 256
+
+        # Sparse reads shrink it down to the minimum size
+        for size in (256, 128):
+            server.stream.write(b"a")
+            yield gen.sleep(0.01)
+            assert client.chunk_size == size // 2
+        server.stream.write(b"a")
+        yield gen.sleep(0.01)
+        assert client.chunk_size == 64
+        assert on_data.call_args[0] == ("localhost", b"a")
+
+    @gen_test
+    def test_tcp_pause(self):
+        client = TCPClient()
+
+        sock, _ = bind_unused_port()
+        server = TCPServerStub()
+        server.add_socket(sock)
+        server.listen(NODE_TCP_PORT)
+
+        on_close = mock.Mock()
+        on_data = mock.Mock()
+
+        yield client.start("localhost", _copy(on_data), on_close)
+        assert not client.paused
+
+        # The pending read completes, then no data is read while paused
+        client.pause()
+        assert client.paused
+        server.stream.write(b"pending")
+        yield gen.sleep(0.01)
+        on_data.assert_called_once_with("localhost", b"pending")
+        server.stream.write(b"paused")
+        yield gen.sleep(0.01)
+        assert on_data.call_count == 1
+
+        client.resume()
+        assert not client.paused
+        yield gen.sleep(0.01)
+        on_data.assert_called_with("localhost", b"paused")
+        assert on_data.call_count == 2
+
+        # Stopping a paused client closes the connection
+        client.pause()
+        yield gen.sleep(0.01)
+        client.stop()
+        yield gen.sleep(0.01)
+        on_close.assert_called_once()
+        assert not client.ready
+
     @gen_test
     def test_tcp_failed_connection(self):
         client = TCPClient()
@@ -0,0 +1,47 @@
+"""iotlabwebsocket relay tracing tests."""
+
+import mock
+
+from iotlabwebsocket.tracing import Trace, Tracer, DISPATCH, WRITE, TOTAL
+
+
+def test_tracer_sampling():
+    tracer = Tracer(0.1)
+    assert tracer.interval == 10
+    sampled = 0
+    for _ in range(100):
+        tracer.read()
+        sampled += tracer.pop() is not None
+    assert sampled == 10
+    # The trace is only returned once
+    assert tracer.pop() is None
+
+    tracer = Tracer(1)
+    tracer.read()
+    assert tracer.pop() is not None
+
+
+@mock.patch("iotlabwebsocket.tracing.time.monotonic")
+def test_trace(monotonic):
+    dispatch, write, total = DISPATCH.sum, WRITE.sum, TOTAL.sum
+    trace = Trace(10.0)
+    monotonic.return_value = 10.5
+    trace.dispatch()
+    assert DISPATCH.sum == dispatch + 0.5
+
+    future = mock.Mock()
+    future.cancelled.return_value = False
+    future.exception.return_value = None
+    trace.follow(future)
+    written = future.add_done_callback.call_args[0][0]
+    monotonic.return_value = 12.0
+    written(future)
+    assert WRITE.sum == write + 1.5
+    assert TOTAL.sum == total + 2
+
+    # Failed and cancelled writes are not accounted
+    future.exception.return_value = OSError()
+    written(future)
+    future.cancelled.return_value = True
+    written(future)
+    assert WRITE.sum == write + 1.5
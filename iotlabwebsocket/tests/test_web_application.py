@@ -2,23 +2,38 @@
 # -*- coding: utf-8 -*-
 
 import json
+import os
+import shutil
 import sys
+import tempfile
+import threading
 
 import mock
+import pytest
 
 import tornado
 from tornado import gen
+from tornado.httpserver import HTTPServer
 from tornado.tcpserver import TCPServer
+from tornado.concurrent import Future
 from tornado.iostream import StreamClosedError
 from tornado.testing import AsyncHTTPTestCase, gen_test, bind_unused_port
 
 from iotlabwebsocket.api import ApiClient
+from iotlabwebsocket.broadcast import websocket_frame
+from iotlabwebsocket.capture import read_records
+from iotlabwebsocket.scrollback import Scrollbacks
+from iotlabwebsocket.sessions import OFFSET
+from iotlabwebsocket.mux import group_message
 from iotlabwebsocket.web_application import (
     WebApplication,
     MAX_WEBSOCKETS_PER_NODE,
     MAX_WEBSOCKETS_PER_USER,
 )
 from iotlabwebsocket.clients.tcp_client import NODE_TCP_PORT
+from iotlabwebsocket.workers import worker_of
+from iotlabwebsocket.metrics import HANDSHAKES, RELAY_LATENCY_SECONDS
+from iotlabwebsocket.tracing import Tracer
 
 
 class TCPServerStub(TCPServer):
@@ -69,10 +84,13 @@ class TestWebApplication(AsyncHTTPTestCase):
 
         assert len(args) == 1
         assert args[0] == "node-1"
+        limiter = kwargs.pop("limiter")
         assert kwargs == dict(
             on_data=self.application.handle_tcp_data,
             on_close=self.application.handle_tcp_close,
         )
+        assert limiter.action == "disconnect"
+        assert [(b.rate, b.burst) for b in limiter.buckets] == [(15000, 15000)]
 
         # Forcing TCP client to be ready, just for the test
         self.application.tcp_clients["node-1"].ready = True
@@ -113,6 +131,95 @@ class TestWebApplication(AsyncHTTPTestCase):
         assert len(self.application.websockets["node-1"]) == 0
         assert "node-1" not in self.application.tcp_clients
 
+    @mock.patch("iotlabwebsocket.clients.tcp_client.TCPClient.start")
+    @mock.patch("iotlabwebsocket.handlers.http_handler._nodes")
+    @gen_test
+    def test_metrics(self, nodes, start):
+        url = f"ws://localhost:{self.api.port}/ws/local/123/node-1/serial/raw"
+        nodes.return_value = json.dumps({"nodes": ["node-1.local"]})
+        accepted = HANDSHAKES.labels("accepted", "").value
+        rejected = HANDSHAKES.labels("rejected", "token").value
+
+        websocket = yield tornado.websocket.websocket_connect(
+            url, subprotocols=["user", "token", "token"]
+        )
+        with pytest.raises(tornado.httpclient.HTTPClientError):
+            yield tornado.websocket.websocket_connect(
+                url, subprotocols=["user", "token", "invalid"]
+            )
+        assert HANDSHAKES.labels("accepted", "").value == accepted + 1
+        assert HANDSHAKES.labels("rejected", "token").value == rejected + 1
+
+        response = yield self.http_client.fetch(
+            f"http://localhost:{self.api.port}/metrics"
+        )
+        assert response.headers["Content-Type"].startswith("text/plain")
+        lines = response.body.decode().splitlines()
+        assert 'iotlab_websocket_node_websockets{node="node-1"} 1' in lines
+        assert "iotlab_websocket_user_websockets 1" in lines
+        assert "iotlab_websocket_users 1" in lines
+        assert b'"user"' not in response.body
+        assert 'iotlab_websocket_write_queue_bytes{node="node-1"} 0' in lines
+        assert any(
+            line.startswith(
+                'iotlab_websocket_api_fetch_seconds_count{resource="token"}'
+            )
+            for line in lines
+        )
+
+        websocket.close()
+        yield gen.sleep(0.1)
+        response = yield self.http_client.fetch(
+            f"http://localhost:{self.api.port}/metrics"
+        )
+        assert b"iotlab_websocket_node_websockets{" not in response.body
+        assert b"\niotlab_websocket_users 0\n" in response.body
+
+    @mock.patch("iotlabwebsocket.handlers.websocket_handler.SESSION_LOGGER")
+    @mock.patch("iotlabwebsocket.clients.tcp_client.TCPClient.send")
+    @mock.patch("iotlabwebsocket.clients.tcp_client.TCPClient.start")
+    @mock.patch("iotlabwebsocket.handlers.http_handler._nodes")
+    @gen_test
+    def test_session_record(self, nodes, start, send, session_logger):
+        url = f"ws://localhost:{self.api.port}/ws/local/123/node-1/serial/raw"
+        nodes.return_value = json.dumps({"nodes": ["node-1.local"]})
+        session_logger.isEnabledFor.return_value = True
+
+        websocket = yield tornado.websocket.websocket_connect(
+            url, subprotocols=["user", "token", "token"]
+        )
+        self.application.tcp_clients["node-1"].ready = True
+        websocket.write_message(b"reset", binary=True)
+        yield gen.sleep(0.1)
+        websocket_srv = self.application.websockets["node-1"][0]
+        websocket_srv.write_frame(websocket_frame(b"test", binary=True))
+        yield websocket.read_message()
+        websocket.close(code=1000, reason="done")
+        yield gen.sleep(0.1)
+
+        session_logger.info.assert_called_once()
+        record = session_logger.info.call_args[0][0]
+        durations = {key: record.pop(key) for key in ("handshake_duration", "duration")}
+        assert all(duration >= 0 for duration in durations.values())
+        assert sorted(record.pop("api_durations")) == ["nodes", "token"]
+        assert record == dict(
+            user="user",
+            site="local",
+            experiment_id="123",
+            node="node-1",
+            text=False,
+            framing="chunk",
+            compressed=False,
+            frames_in=1,
+            bytes_in=5,
+            frames_out=1,
+            bytes_out=6,
+            dropped_frames=0,
+            dropped_bytes=0,
+            close_code=1000,
+            close_reason="done",
+        )
+
     @mock.patch("iotlabwebsocket.handlers.http_handler._nodes")
     @gen_test
     def test_tcp_connection_server(self, nodes):
@@ -137,14 +244,17 @@ class TestWebApplication(AsyncHTTPTestCase):
         # Send some data
         websocket_srv = self.application.websockets["localhost"][0]
         websocket_srv.write_message = mock.Mock()
+        websocket_srv.write_frame = mock.Mock()
         message = "test°°°ééààà"
         if sys.version_info[0] > 2:
             message = message.encode("utf-8")
         yield server.stream.write(message)
 
         yield gen.sleep(0.1)
-        assert websocket_srv.write_message.call_count == 1
-        websocket_srv.write_message.call_count = 0
+        websocket_srv.write_frame.assert_called_once_with(
+            websocket_frame(message, binary=True)
+        )
+        assert websocket_srv.write_message.call_count == 0
 
         # Smoke test to check that the websocket gets a message when the TCP
         # connection is not opened yet
@@ -154,6 +264,12 @@ class TestWebApplication(AsyncHTTPTestCase):
         websocket_srv.write_message.assert_called_with(
             "No TCP connection opened, cannot send message 'test'.\n"
         )
+        # Invalid UTF-8 data are replaced in the message
+        websocket.write_message(b"te\xffst", binary=True)
+        yield gen.sleep(0.1)
+        websocket_srv.write_message.assert_called_with(
+            "No TCP connection opened, cannot send message 'te\ufffdst'.\n"
+        )
         self.application.tcp_clients["localhost-1"].ready = True
 
         # Force close from TCP server, all websockets should be closed
@@ -187,22 +303,606 @@ class TestWebApplication(AsyncHTTPTestCase):
 
         # Send some data
         websocket_srv = self.application.websockets["localhost"][0]
-        websocket_srv.write_message = mock.Mock()
+        websocket_srv.write_frame = mock.Mock()
         message = "test".encode("utf-8")
         yield server.stream.write(message)
 
         yield gen.sleep(0.1)
-        assert websocket_srv.write_message.call_count == 1
+        websocket_srv.write_frame.assert_called_once_with(
+            websocket_frame(message, binary=False)
+        )
 
-        # Send some pure binary data
-        websocket_srv.write_message.call_count = 0
+        # Send some pure binary data, invalid bytes are replaced
+        websocket_srv.write_frame.call_count = 0
         websocket_srv = self.application.websockets["localhost"][0]
-        websocket_srv.write_message = mock.Mock()
+        websocket_srv.write_frame = mock.Mock()
         message = b"\xaa\xbb\xcc\xff"
         yield server.stream.write(message)
 
         yield gen.sleep(0.1)
-        assert websocket_srv.write_message.call_count == 0
+        websocket_srv.write_frame.assert_called_once_with(
+            websocket_frame("\ufffd".encode("utf-8") * 4, binary=False)
+        )
+
+        # A multi-byte character split across TCP reads is not lost
+        websocket_srv.write_frame = mock.Mock()
+        yield server.stream.write("é".encode("utf-8")[:1])
+        yield gen.sleep(0.1)
+        assert websocket_srv.write_frame.call_count == 0
+        yield server.stream.write("é".encode("utf-8")[1:])
+        yield gen.sleep(0.1)
+        websocket_srv.write_frame.assert_called_once_with(
+            websocket_frame("é".encode("utf-8"), binary=False)
+        )
+
+    @mock.patch("iotlabwebsocket.handlers.http_handler._nodes")
+    @gen_test
+    def test_relay_tracing(self, nodes):
+        url = f"ws://localhost:{self.api.port}/ws/local/123/localhost/serial"
+        nodes.return_value = json.dumps({"nodes": ["localhost.local"]})
+        self.application.tracer = Tracer(1)
+        counts = {
+            stage: sum(RELAY_LATENCY_SECONDS.labels(stage).counts)
+            for stage in ("dispatch", "write", "total")
+        }
+
+        sock, _ = bind_unused_port()
+        server = TCPServerStub()
+        server.add_socket(sock)
+        server.listen(NODE_TCP_PORT)
+
+        websocket = yield tornado.websocket.websocket_connect(
+            url, subprotocols=["user", "token", "token"]
+        )
+        yield gen.sleep(0.1)
+        assert self.application.tcp_clients["localhost"].tracer is not None
+
+        yield server.stream.write(b"test")
+        received = yield websocket.read_message()
+        assert received == "test"
+        yield gen.sleep(0.1)
+        for stage, count in counts.items():
+            assert sum(RELAY_LATENCY_SECONDS.labels(stage).counts) == count + 1
+
+    @mock.patch("iotlabwebsocket.handlers.http_handler._nodes")
+    @gen_test
+    def test_tcp_connection_server_text_and_raw(self, nodes):
+        url = f"ws://localhost:{self.api.port}/ws/local/123/localhost/serial"
+        nodes.return_value = json.dumps({"nodes": ["localhost.local"]})
+
+        sock, _ = bind_unused_port()
+        server = TCPServerStub()
+        server.add_socket(sock)
+        server.listen(NODE_TCP_PORT)
+
+        websocket_text = yield tornado.websocket.websocket_connect(
+            url, subprotocols=["user", "token", "token"]
+        )
+        websocket_raw = yield tornado.websocket.websocket_connect(
+            f"{url}/raw", subprotocols=["user", "token", "token"]
+        )
+
+        # Leave some time for the TCP connection to be ready
+        yield gen.sleep(0.1)
+        assert self.application.tcp_clients["localhost"].ready
+
+        message = "test°°°ééààà"
+        yield server.stream.write(message.encode("utf-8"))
+        received = yield websocket_text.read_message()
+        assert received == message
+        received = yield websocket_raw.read_message()
+        assert received == message.encode("utf-8")
+
+    @mock.patch("iotlabwebsocket.handlers.http_handler._nodes")
+    @gen_test
+    def test_tcp_connection_server_line_framing(self, nodes):
+        url = f"ws://localhost:{self.api.port}/ws/local/123/localhost/serial"
+        nodes.return_value = json.dumps({"nodes": ["localhost.local"]})
+
+        sock, _ = bind_unused_port()
+        server = TCPServerStub()
+        server.add_socket(sock)
+        server.listen(NODE_TCP_PORT)
+
+        self.application.settings["line_max_latency"] = 0.1
+        websocket = yield tornado.websocket.websocket_connect(
+            f"{url}?framing=line", subprotocols=["user", "token", "token"]
+        )
+
+        # Leave some time for the TCP connection to be ready
+        yield gen.sleep(0.1)
+        assert self.application.tcp_clients["localhost"].ready
+
+        for i in range(3):
+            yield server.stream.write(f"line {i}\n".encode())
+            yield gen.sleep(0.01)
+        received = yield websocket.read_message()
+        assert received == "line 0\nline 1\nline 2\n"
+
+    def test_rate_limiter_scopes(self):
+        application = WebApplication(
+            self.api,
+            rate_limits={"node": (10, 10), "user": (20, 40), "global": (30, None)},
+            rate_limit_action="shed",
+        )
+        limiter = application._rate_limiter("user")
+        assert limiter.action == "shed"
+        assert [(b.rate, b.burst) for b in limiter.buckets] == [
+            (10, 10),
+            (20, 40),
+            (30, 30),
+        ]
+
+        # User and global buckets are shared, node buckets are not
+        other = application._rate_limiter("user")
+        assert other.buckets[0] is not limiter.buckets[0]
+        assert other.buckets[1] is limiter.buckets[1]
+        assert other.buckets[2] is limiter.buckets[2]
+        assert application._rate_limiter("other").buckets[1] is not limiter.buckets[1]
+
+        assert WebApplication(self.api, rate_limits={})._rate_limiter("user") is None
+
+    def test_tcp_backpressure(self):
+        websockets = [mock.Mock(node="node-1", buffered_bytes=0) for _ in range(2)]
+        self.application.websockets["node-1"] = websockets
+        self.application.broadcasts["node-1"] = mock.Mock()
+        tcp_client = self.application.tcp_clients["node-1"]
+        high_water_mark = self.application.settings["write_high_water_mark"]
+
+        # Reads are paused only when all websockets are saturated
+        websockets[0].buffered_bytes = high_water_mark
+        self.application.handle_tcp_data("node-1", b"data")
+        assert not tcp_client.paused
+        websockets[1].buffered_bytes = high_water_mark
+        self.application.handle_tcp_data("node-1", b"data")
+        assert tcp_client.paused
+
+        # and resumed when one of them is drained
+        self.application.handle_websocket_drain(websockets[0])
+        assert not tcp_client.paused
+
+        # or when a websocket is closed
+        tcp_client.pause()
+        self.application.handle_websocket_close(websockets[1])
+        assert not tcp_client.paused
+
+    @mock.patch("iotlabwebsocket.handlers.http_handler._nodes")
+    @gen_test
+    def test_tcp_linger(self, nodes):
+        url = f"ws://localhost:{self.api.port}/ws/local/123/localhost/serial/raw"
+        nodes.return_value = json.dumps({"nodes": ["localhost.local"]})
+        self.application.settings["tcp_linger"] = 0.2
+        self.application.settings["tcp_linger_buffer_size"] = 4
+
+        server = TCPServerStub()
+        server.listen(NODE_TCP_PORT)
+
+        websocket = yield tornado.websocket.websocket_connect(
+            url, subprotocols=["user", "token", "token"]
+        )
+        yield gen.sleep(0.1)
+        tcp_client = self.application.tcp_clients["localhost"]
+        stream = server.stream
+        websocket.close()
+        yield gen.sleep(0.05)
+
+        # The idle connection stays open and buffers the most recent bytes
+        assert "localhost" in self.application.lingering
+        assert tcp_client.ready
+        yield stream.write(b"abcdef")
+        yield gen.sleep(0.05)
+
+        # A rejected websocket leaves it idle with its buffered bytes
+        self.application.user_connections._counts["user"] = MAX_WEBSOCKETS_PER_USER
+        websocket = yield tornado.websocket.websocket_connect(
+            url, subprotocols=["user", "token", "token"]
+        )
+        assert (yield websocket.read_message()) is None
+        assert websocket.close_reason.startswith("Max number of connections")
+        assert "localhost" in self.application.lingering
+        self.application.user_connections._counts["user"] = 0
+
+        # and is reused by the next websocket of the node
+        websocket = yield tornado.websocket.websocket_connect(
+            url, subprotocols=["user", "token", "token"]
+        )
+        message = yield websocket.read_message()
+        assert message == b"cdef"
+        assert "localhost" not in self.application.lingering
+        assert self.application.tcp_clients["localhost"] is tcp_client
+        assert server.stream is stream
+
+        # Unused connections are closed after the linger
+        websocket.close()
+        yield gen.sleep(0.3)
+        assert "localhost" not in self.application.lingering
+        assert "localhost" not in self.application.tcp_clients
+        assert not tcp_client.ready
+        server.stop()
+
+    @mock.patch("iotlabwebsocket.clients.tcp_client.TCPClient.stop")
+    def test_tcp_linger_pool_size(self, stop):
+        self.application.settings["tcp_linger"] = 10
+        self.application.settings["tcp_linger_pool_size"] = 2
+        for node in ("node-1", "node-2", "node-3"):
+            websocket = mock.Mock(node=node, user="user")
+            self.application.broadcasts[node] = mock.Mock()
+            self.application.tcp_clients[node].ready = True
+            self.application.handle_websocket_close(websocket)
+
+        # The oldest idle connection is closed
+        assert list(self.application.lingering) == ["node-2", "node-3"]
+        assert list(self.application.tcp_clients) == ["node-2", "node-3"]
+        stop.assert_called_once()
+
+        # Idle connections are closed with the application
+        self.application.stop()
+        assert not self.application.lingering
+        assert not self.application.tcp_clients
+        assert stop.call_count == 3
+
+    @mock.patch("iotlabwebsocket.handlers.http_handler._nodes")
+    @gen_test
+    def test_scrollback(self, nodes):
+        url = f"ws://localhost:{self.api.port}/ws/local/123/localhost/serial/raw"
+        nodes.return_value = json.dumps({"nodes": ["localhost.local"]})
+        self.application.scrollbacks = Scrollbacks(16)
+
+        server = TCPServerStub()
+        server.listen(NODE_TCP_PORT)
+
+        websocket = yield tornado.websocket.websocket_connect(
+            url, subprotocols=["user", "token", "token"]
+        )
+        assert websocket.headers["X-Scrollback-Offset"] == "0"
+        yield gen.sleep(0.1)
+        yield server.stream.write(b"0123456789abcdefXYZ")
+        message = yield websocket.read_message()
+        assert message == b"0123456789abcdefXYZ"
+
+        # A late joiner first receives the scrollback
+        late = yield tornado.websocket.websocket_connect(
+            url, subprotocols=["user", "token", "token"]
+        )
+        assert late.headers["X-Scrollback-Offset"] == "3"
+        message = yield late.read_message()
+        assert message == b"3456789abcdefXYZ"
+        late.close()
+        yield gen.sleep(0.1)
+
+        # A reconnecting client only receives what it missed
+        late = yield tornado.websocket.websocket_connect(
+            f"{url}?since=17", subprotocols=["user", "token", "token"]
+        )
+        assert late.headers["X-Scrollback-Offset"] == "17"
+        message = yield late.read_message()
+        assert message == b"YZ"
+
+        with pytest.raises(tornado.httpclient.HTTPClientError) as exc_info:
+            yield tornado.websocket.websocket_connect(
+                f"{url}?since=-1", subprotocols=["user", "token", "token"]
+            )
+        assert exc_info.value.code == 400
+        server.stop()
+
+    @mock.patch("iotlabwebsocket.handlers.http_handler._nodes")
+    @gen_test
+    def test_resumable_session(self, nodes):
+        url = f"ws://localhost:{self.api.port}/ws/local/123/localhost/serial/session"
+        nodes.return_value = json.dumps({"nodes": ["localhost.local"]})
+        self.application.settings["session_grace"] = 0.5
+
+        server = TCPServerStub()
+        server.listen(NODE_TCP_PORT)
+
+        websocket = yield tornado.websocket.websocket_connect(
+            url, subprotocols=["user", "token", "token"]
+        )
+        session_id = websocket.headers["X-Session-Id"]
+        session = self.application.sessions[session_id]
+        assert self.application.websockets["localhost"] == [session]
+        yield gen.sleep(0.1)
+        yield server.stream.write(b"0123")
+        message = yield websocket.read_message()
+        assert message == OFFSET.pack(0) + b"0123"
+
+        # The connection to the client is lost, the node is still connected
+        websocket.protocol.stream.close()
+        yield gen.sleep(0.1)
+        assert session.websocket is None
+        assert self.application.tcp_clients["localhost"].ready
+        yield server.stream.write(b"4567")
+        yield gen.sleep(0.1)
+
+        # The session is resumed without authentication
+        nodes.reset_mock()
+        websocket = yield tornado.websocket.websocket_connect(
+            f"{url}?session={session_id}&offset=4"
+        )
+        assert websocket.headers["X-Session-Id"] == session_id
+        message = yield websocket.read_message()
+        assert message == OFFSET.pack(4) + b"4567"
+        assert nodes.call_count == 0
+        assert self.application.websockets["localhost"] == [session]
+
+        for query in (f"session={session_id}&offset=x", "session=unknown"):
+            with pytest.raises(tornado.httpclient.HTTPClientError) as exc_info:
+                yield tornado.websocket.websocket_connect(f"{url}?{query}")
+            assert exc_info.value.code in (400, 404)
+
+        # Sessions end when the client closes them normally
+        websocket.close(code=1000)
+        yield gen.sleep(0.1)
+        assert not self.application.sessions
+        assert not self.application.websockets["localhost"]
+        assert "localhost" not in self.application.tcp_clients
+
+        # or after the grace period
+        websocket = yield tornado.websocket.websocket_connect(
+            url, subprotocols=["user", "token", "token"]
+        )
+        websocket.protocol.stream.close()
+        yield gen.sleep(0.1)
+        assert len(self.application.sessions) == 1
+        yield gen.sleep(0.5)
+        assert not self.application.sessions
+        assert self.application.user_connections["user"] == 0
+        server.stop()
+
+    @mock.patch("iotlabwebsocket.clients.tcp_client.TCPClient.stop")
+    @mock.patch("iotlabwebsocket.clients.tcp_client.TCPClient.start")
+    @mock.patch("iotlabwebsocket.handlers.http_handler._nodes")
+    @gen_test
+    def test_mux(self, nodes, start, stop):
+        url = f"ws://localhost:{self.api.port}/ws/local/123/mux"
+        nodes.return_value = json.dumps({"nodes": ["node-1.local", "node-2.local"]})
+
+        websocket = yield tornado.websocket.websocket_connect(
+            url, subprotocols=["user", "token", "token"]
+        )
+        for node_id, node in ((1, "node-1"), (2, "node-2")):
+            websocket.write_message(json.dumps({"subscribe": node, "id": node_id}))
+            message = yield websocket.read_message()
+            assert json.loads(message) == {"subscribed": node_id, "node": node}
+            self.application.tcp_clients[node].ready = True
+        assert start.call_count == 2
+        assert nodes.call_count == 1
+        # The subscriptions only count in the websockets of the nodes
+        assert len(self.application.websockets["node-1"]) == 1
+        assert len(self.application.websockets["node-2"]) == 1
+        assert self.application.user_connections["user"] == 1
+
+        # Frames are tagged with the id of the node subscription
+        self.application.handle_tcp_data("node-2", b"from node")
+        message = yield websocket.read_message()
+        assert message == b"\x00\x02from node"
+
+        tcp_client = self.application.tcp_clients["node-1"]
+        with mock.patch.object(tcp_client, "send") as send:
+            yield websocket.write_message(b"\x00\x01reset", binary=True)
+            yield gen.sleep(0.1)
+            send.assert_called_once_with(b"reset")
+
+        for request, reply in (
+            ({"subscribe": "node-3", "id": 3}, "Invalid node"),
+            ({"subscribe": "node-1", "id": 3}, "Node already subscribed"),
+            ({"subscribe": "node-1", "id": 1}, "Subscription id already used"),
+            ({"subscribe": "node-1", "id": 70000}, "Invalid subscription id"),
+            ({"unsubscribe": 3}, "Unknown subscription"),
+            ({"node": "node-1"}, "Invalid control message"),
+        ):
+            websocket.write_message(json.dumps(request))
+            message = json.loads((yield websocket.read_message()))
+            assert reply in (message.get("reason"), message.get("error"))
+
+        # The client unsubscribes from a node
+        websocket.write_message(json.dumps({"unsubscribe": 1}))
+        message = yield websocket.read_message()
+        assert json.loads(message) == {
+            "unsubscribed": 1,
+            "node": "node-1",
+            "code": 1000,
+            "reason": "Unsubscribed",
+        }
+        yield gen.sleep(0.1)
+        assert not self.application.websockets["node-1"]
+        assert stop.call_count == 1
+
+        # or the server ends the subscription
+        self.application.handle_tcp_close("node-2", "Connection to node-2 is closed")
+        message = yield websocket.read_message()
+        assert json.loads(message)["reason"] == "Connection to node-2 is closed"
+        yield gen.sleep(0.1)
+        assert not self.application.websockets["node-2"]
+
+        websocket.close()
+        yield gen.sleep(0.1)
+        assert not self.application.muxes
+        assert self.application.user_connections["user"] == 0
+
+    @mock.patch("iotlabwebsocket.clients.tcp_client.TCPClient.start")
+    @mock.patch("iotlabwebsocket.handlers.http_handler._nodes")
+    @gen_test
+    def test_mux_group(self, nodes, start):
+        url = f"ws://localhost:{self.api.port}/ws/local/123/mux"
+        nodes.return_value = json.dumps(
+            {"nodes": [f"node-{index}.local" for index in range(1, 6)]}
+        )
+        self.application.settings["group_send_timeout"] = 0.1
+
+        websocket = yield tornado.websocket.websocket_connect(
+            url, subprotocols=["user", "token", "token"]
+        )
+        for index in range(1, 6):
+            node = f"node-{index}"
+            websocket.write_message(json.dumps({"subscribe": node, "id": index}))
+            yield websocket.read_message()
+        written, closed = Future(), Future()
+        written.set_result(None)
+        closed.set_exception(StreamClosedError())
+        sends = {
+            "node-1": mock.Mock(return_value=written),
+            "node-2": mock.Mock(return_value=written),
+            "node-3": mock.Mock(return_value=Future()),
+            "node-4": mock.Mock(return_value=closed),
+            "node-5": mock.Mock(return_value=None),
+        }
+        for node, send in sends.items():
+            self.application.tcp_clients[node].send = send
+
+        # The data are written to all the nodes and each result is reported
+        websocket.write_message(group_message([1, 2, 3, 4, 5, 9], b"reset"), True)
+        message = yield websocket.read_message()
+        assert json.loads(message) == {
+            "group": 1,
+            "sent": {
+                "1": "sent",
+                "2": "sent",
+                "3": "timeout",
+                "4": "closed",
+                "5": "not connected",
+                "9": "unknown subscription",
+            },
+        }
+        # from a single buffer
+        data = {send.call_args[0][0].obj for send in sends.values()}
+        assert len(data) == 1
+        assert bytes(sends["node-1"].call_args[0][0]) == b"reset"
+
+        websocket.write_message(b"\xff\xff\x00\x02\x00", binary=True)
+        message = yield websocket.read_message()
+        assert json.loads(message) == {"error": "Invalid group message", "group": 2}
+
+        # The data are written once to a node whose id is repeated
+        sends["node-1"].reset_mock()
+        websocket.write_message(group_message([1, 1, 2, 1], b"reset"), True)
+        message = yield websocket.read_message()
+        assert json.loads(message) == {
+            "group": 3,
+            "sent": {"1": "sent", "2": "sent"},
+        }
+        sends["node-1"].assert_called_once()
+        websocket.close()
+        yield gen.sleep(0.1)
+
+    @mock.patch("iotlabwebsocket.clients.tcp_client.TCPClient.start")
+    @mock.patch("iotlabwebsocket.handlers.http_handler._nodes")
+    @gen_test
+    def test_mux_limits(self, nodes, start):
+        url = f"ws://localhost:{self.api.port}/ws/local/123/mux"
+        nodes.return_value = json.dumps({"nodes": ["node-1.local"]})
+
+        # Each subscription counts in the websockets of the node
+        for _ in range(MAX_WEBSOCKETS_PER_NODE):
+            websocket = yield tornado.websocket.websocket_connect(
+                url, subprotocols=["user", "token", "token"]
+            )
+            websocket.write_message(json.dumps({"subscribe": "node-1", "id": 1}))
+            message = yield websocket.read_message()
+            assert json.loads(message)["subscribed"] == 1
+        websocket = yield tornado.websocket.websocket_connect(
+            url, subprotocols=["user", "token", "token"]
+        )
+        websocket.write_message(json.dumps({"subscribe": "node-1", "id": 1}))
+        yield websocket.read_message()
+        message = json.loads((yield websocket.read_message()))
+        assert message["unsubscribed"] == 1
+        assert message["reason"].startswith("Cannot open more than")
+        assert len(self.application.websockets["node-1"]) == MAX_WEBSOCKETS_PER_NODE
+
+        # The multiplexed websockets count in the websockets of the user
+        assert len(self.application.muxes) == MAX_WEBSOCKETS_PER_NODE + 1
+        self.application.user_connections._counts["user"] = MAX_WEBSOCKETS_PER_USER
+        websocket = yield tornado.websocket.websocket_connect(
+            url, subprotocols=["user", "token", "token"]
+        )
+        message = yield websocket.read_message()
+        assert message is None
+        assert websocket.close_reason.startswith("Max number of connections")
+
+    @mock.patch("iotlabwebsocket.handlers.http_handler._nodes")
+    @gen_test
+    def test_capture(self, nodes):
+        url = f"ws://localhost:{self.api.port}/ws/local/123/localhost/serial/raw"
+        nodes.return_value = json.dumps({"nodes": ["localhost.local"]})
+        capture_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, capture_dir)
+        self.application.settings["capture_nodes"] = ["localhost"]
+        self.application.settings["capture_dir"] = capture_dir
+
+        server = TCPServerStub()
+        server.listen(NODE_TCP_PORT)
+
+        websocket = yield tornado.websocket.websocket_connect(
+            url, subprotocols=["user", "token", "token"]
+        )
+        yield gen.sleep(0.1)
+        capture = self.application.captures["localhost"]
+        yield server.stream.write(b"test")
+        message = yield websocket.read_message()
+        assert message == b"test"
+
+        # The capture is closed with the TCP connection
+        websocket.close()
+        yield gen.sleep(0.1)
+        assert not self.application.captures
+        capture.join()
+        (filename,) = os.listdir(capture_dir)
+        assert filename.startswith("localhost-")
+        with open(os.path.join(capture_dir, filename), "rb") as capture_file:
+            records = list(read_records(capture_file.read()))
+        assert [bytes(data) for _, data in records] == [b"test"]
+        server.stop()
+
+    @mock.patch("iotlabwebsocket.clients.tcp_client.TCPClient.start")
+    @mock.patch("iotlabwebsocket.handlers.http_handler._nodes")
+    @gen_test
+    def test_capture_connecting(self, nodes, start):
+        url = f"ws://localhost:{self.api.port}/ws/local/123/node-1/serial/raw"
+        nodes.return_value = json.dumps({"nodes": ["node-1.local"]})
+        capture_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, capture_dir)
+        self.application.settings["capture_nodes"] = ["node-1"]
+        self.application.settings["capture_dir"] = capture_dir
+
+        # A rejected websocket doesn't connect to the node
+        self.application.user_connections._counts["user"] = MAX_WEBSOCKETS_PER_USER
+        websocket = yield tornado.websocket.websocket_connect(
+            url, subprotocols=["user", "token", "token"]
+        )
+        assert (yield websocket.read_message()) is None
+        assert start.call_count == 0
+        assert not self.application.captures
+        assert "node-1" not in self.application.broadcasts
+        self.application.user_connections._counts["user"] = 0
+
+        # The websockets of the node are closed while it is connecting
+        websocket = yield tornado.websocket.websocket_connect(
+            url, subprotocols=["user", "token", "token"]
+        )
+        yield gen.sleep(0.1)
+        capture = self.application.captures["node-1"]
+        websocket.close()
+        yield gen.sleep(0.1)
+        assert start.call_count == 1
+
+        # so the next websocket replaces the capture
+        websocket = yield tornado.websocket.websocket_connect(
+            url, subprotocols=["user", "token", "token"]
+        )
+        yield gen.sleep(0.1)
+        assert start.call_count == 2
+        capture.join(1)
+        assert not capture._thread.is_alive()
+
+        # The captures are closed when the application stops
+        capture = self.application.captures["node-1"]
+        self.application.stop()
+        capture.join(1)
+        assert not capture._thread.is_alive()
+        assert not any(
+            thread.name.startswith("capture-") for thread in threading.enumerate()
+        )
 
     @mock.patch("iotlabwebsocket.handlers.http_handler._nodes")
     @gen_test
@@ -253,3 +953,263 @@ class TestWebApplication(AsyncHTTPTestCase):
                 self.application.user_connections["user"] == MAX_WEBSOCKETS_PER_USER - i
             )
             i += 1
+
+
+class TestWebApplicationCompression(AsyncHTTPTestCase):
+    def get_app(self):
+        self.application = WebApplication(
+            self.api,
+            use_local_api=True,
+            token="token",
+            websocket_compression_options={"compression_level": 1},
+            compression_window_bits=10,
+            compression_min_size=16,
+        )
+        return self.application
+
+    def setUp(self):
+        self.api = ApiClient("http")
+        super(TestWebApplicationCompression, self).setUp()
+        self.api.port = self.get_http_port()
+
+    @mock.patch("iotlabwebsocket.handlers.http_handler._nodes")
+    @gen_test
+    def test_compression(self, nodes):
+        url = f"ws://localhost:{self.api.port}/ws/local/123/localhost/serial"
+        nodes.return_value = json.dumps({"nodes": ["localhost.local"]})
+
+        sock, _ = bind_unused_port()
+        server = TCPServerStub()
+        server.add_socket(sock)
+        server.listen(NODE_TCP_PORT)
+
+        websocket = yield tornado.websocket.websocket_connect(
+            url, subprotocols=["user", "token", "token"], compression_options={}
+        )
+        extensions = websocket.headers["Sec-WebSocket-Extensions"]
+        assert extensions == "permessage-deflate; server_max_window_bits=10"
+
+        # Leave some time for the TCP connection to be ready
+        yield gen.sleep(0.1)
+        websocket_srv = self.application.websockets["localhost"][0]
+        assert websocket_srv.compressed
+        write_message = mock.Mock(wraps=websocket_srv.ws_connection.write_message)
+        websocket_srv.ws_connection.write_message = write_message
+
+        # Short messages are not compressed
+        yield server.stream.write(b"short")
+        received = yield websocket.read_message()
+        assert received == "short"
+        assert write_message.call_count == 0
+
+        message = "compressed line\n" * 10
+        yield server.stream.write(message.encode())
+        received = yield websocket.read_message()
+        assert received == message
+        write_message.assert_called_once_with(message.encode(), binary=False)
+
+        # Uncompressed websockets of the same node are not affected
+        websocket_raw = yield tornado.websocket.websocket_connect(
+            f"{url}/raw", subprotocols=["user", "token", "token"]
+        )
+        assert "Sec-WebSocket-Extensions" not in websocket_raw.headers
+        yield gen.sleep(0.1)
+        assert not self.application.websockets["localhost"][1].compressed
+        yield server.stream.write(message.encode())
+        received = yield websocket_raw.read_message()
+        assert received == message.encode()
+        received = yield websocket.read_message()
+        assert received == message
+
+
+class TestWebApplicationWorkers(AsyncHTTPTestCase):
+    def get_app(self):
+        self.application = WebApplication(self.api, use_local_api=True, token="token")
+        return self.application
+
+    def setUp(self):
+        self.api = ApiClient("http")
+        super(TestWebApplicationWorkers, self).setUp()
+        self.api.port = self.get_http_port()
+
+        # The other worker owns the node
+        owner = worker_of("localhost", 2)
+        sock, port = bind_unused_port()
+        self.owner = WebApplication(self.api, worker_id=owner)
+        self.owner_server = HTTPServer(self.owner)
+        self.owner_server.add_sockets([sock])
+        ports = [self.get_http_port()] * 2
+        ports[owner] = port
+        self.application.settings["worker_id"] = 1 - owner
+        self.application.settings["worker_ports"] = ports
+        self.owner.settings["worker_ports"] = ports
+
+    def tearDown(self):
+        self.owner_server.stop()
+        super(TestWebApplicationWorkers, self).tearDown()
+
+    @mock.patch("iotlabwebsocket.handlers.http_handler._nodes")
+    @gen_test
+    def test_proxy(self, nodes):
+        url = f"ws://localhost:{self.api.port}/ws/local/123/localhost/serial/raw"
+        nodes.return_value = json.dumps({"nodes": ["localhost.local"]})
+
+        sock, _ = bind_unused_port()
+        server = TCPServerStub()
+        server.add_socket(sock)
+        server.listen(NODE_TCP_PORT)
+
+        websocket = yield tornado.websocket.websocket_connect(
+            url, subprotocols=["user", "token", "token"]
+        )
+        assert websocket.selected_subprotocol == "token"
+        yield gen.sleep(0.1)
+
+        # The websocket is handled by the worker owning the node
+        assert not self.application.websockets["localhost"]
+        assert len(self.owner.websockets["localhost"]) == 1
+        assert self.owner.user_connections["user"] == 1
+        assert self.owner.tcp_clients["localhost"].ready
+
+        yield server.stream.write(b"from node")
+        message = yield websocket.read_message()
+        assert message == b"from node"
+
+        with mock.patch.object(self.owner.tcp_clients["localhost"], "send") as send:
+            yield websocket.write_message(b"to node", binary=True)
+            yield gen.sleep(0.1)
+            send.assert_called_once_with(b"to node")
+
+        # Closing the node connection closes the proxied websocket
+        server.stream.close()
+        message = yield websocket.read_message()
+        assert message is None
+        assert websocket.close_reason == "Connection to localhost is closed"
+        yield gen.sleep(0.1)
+        assert self.owner.user_connections["user"] == 0
+
+    @mock.patch("iotlabwebsocket.handlers.http_handler._nodes")
+    @gen_test
+    def test_proxy_scrollback(self, nodes):
+        url = f"ws://localhost:{self.api.port}/ws/local/123/localhost/serial/raw"
+        nodes.return_value = json.dumps({"nodes": ["localhost.local"]})
+        self.owner.scrollbacks = Scrollbacks(16)
+        self.owner.scrollbacks.write("localhost", b"before")
+
+        server = TCPServerStub()
+        server.listen(NODE_TCP_PORT)
+
+        # The scrollback of the worker owning the node is sent
+        websocket = yield tornado.websocket.websocket_connect(
+            f"{url}?since=2", subprotocols=["user", "token", "token"]
+        )
+        assert websocket.headers["X-Scrollback-Offset"] == "2"
+        message = yield websocket.read_message()
+        assert message == b"fore"
+        websocket.close()
+        yield gen.sleep(0.1)
+        server.stop()
+
+    @mock.patch("iotlabwebsocket.handlers.http_handler._nodes")
+    @gen_test
+    def test_proxy_client_close(self, nodes):
+        url = f"ws://localhost:{self.api.port}/ws/local/123/localhost/serial"
+        nodes.return_value = json.dumps({"nodes": ["localhost.local"]})
+
+        sock, _ = bind_unused_port()
+        server = TCPServerStub()
+        server.add_socket(sock)
+        server.listen(NODE_TCP_PORT)
+
+        websocket = yield tornado.websocket.websocket_connect(
+            f"{url}?framing=line", subprotocols=["user", "token", "token"]
+        )
+        yield gen.sleep(0.1)
+        assert self.owner.websockets["localhost"][0].framing == "line"
+
+        websocket.close(code=1000, reason="client exit")
+        yield gen.sleep(0.1)
+        assert not self.owner.websockets["localhost"]
+        assert "localhost" not in self.owner.tcp_clients
+
+    @mock.patch("iotlabwebsocket.handlers.http_handler._nodes")
+    @gen_test
+    def test_proxy_errors(self, nodes):
+        url = f"ws://localhost:{self.api.port}/ws/local/123/localhost/serial/raw"
+        nodes.return_value = json.dumps({"nodes": ["localhost.local"]})
+
+        # The owner checks the token
+        with pytest.raises(tornado.httpclient.HTTPClientError) as exc_info:
+            yield tornado.websocket.websocket_connect(
+                url, subprotocols=["user", "token", "invalid"]
+            )
+        assert exc_info.value.code == 401
+        assert exc_info.value.response.body == b"Invalid token 'invalid'"
+
+        self.owner_server.stop()
+        with pytest.raises(tornado.httpclient.HTTPClientError) as exc_info:
+            yield tornado.websocket.websocket_connect(
+                url, subprotocols=["user", "token", "token"]
+            )
+        assert exc_info.value.code == 502
+
+    @mock.patch("iotlabwebsocket.handlers.http_handler._nodes")
+    @gen_test
+    def test_mux_proxy(self, nodes):
+        url = f"ws://localhost:{self.api.port}/ws/local/123/mux"
+        nodes.return_value = json.dumps({"nodes": ["localhost.local"]})
+
+        server = TCPServerStub()
+        server.listen(NODE_TCP_PORT)
+
+        websocket = yield tornado.websocket.websocket_connect(
+            url, subprotocols=["user", "token", "token"]
+        )
+        websocket.write_message(json.dumps({"subscribe": "localhost", "id": 7}))
+        message = yield websocket.read_message()
+        assert json.loads(message) == {"subscribed": 7, "node": "localhost"}
+        yield gen.sleep(0.1)
+
+        # The subscription is handled by the worker owning the node
+        assert not self.application.websockets["localhost"]
+        assert len(self.owner.websockets["localhost"]) == 1
+        assert self.owner.tcp_clients["localhost"].ready
+        # and the client connection only counts once for the user
+        assert self.application.user_connections["user"] == 1
+        assert self.owner.user_connections["user"] == 0
+        assert not self.owner.muxes
+
+        yield server.stream.write(b"from node")
+        message = yield websocket.read_message()
+        assert message == b"\x00\x07from node"
+
+        with mock.patch.object(self.owner.tcp_clients["localhost"], "send") as send:
+            yield websocket.write_message(b"\x00\x07to node", binary=True)
+            yield gen.sleep(0.1)
+            send.assert_called_once_with(b"to node")
+
+        # Group messages are sent once by the worker owning the node
+        written = Future()
+        written.set_result(None)
+        with mock.patch.object(
+            self.owner.tcp_clients["localhost"], "send", return_value=written
+        ) as send:
+            websocket.write_message(group_message([7, 9, 7], b"reset"), binary=True)
+            message = yield websocket.read_message()
+            send.assert_called_once()
+        assert json.loads(message) == {
+            "group": 1,
+            "sent": {"9": "unknown subscription", "7": "sent"},
+        }
+
+        websocket.write_message(json.dumps({"unsubscribe": 7}))
+        message = yield websocket.read_message()
+        assert json.loads(message)["unsubscribed"] == 7
+        yield gen.sleep(0.1)
+        assert not self.owner.websockets["localhost"]
+
+        # The connection to the worker is closed with the websocket
+        websocket.close()
+        yield gen.sleep(0.1)
+        assert not self.owner.muxes
+        server.stop()
@@ -4,10 +4,12 @@ import json
 
 import pytest
 
-from mock import patch
+from mock import Mock, patch
 
 import tornado
 from tornado import gen
+from tornado.concurrent import Future
+from tornado.httputil import HTTPServerRequest
 from tornado.testing import AsyncHTTPTestCase, gen_test
 
 from iotlabwebsocket.api import ApiClient
@@ -69,6 +71,10 @@ class TestWebsocketHandler(AsyncHTTPTestCase):
             ws_close.assert_called_once()
             ws_close.assert_called_with(ws_handler)
 
+        # Frames cannot be written once the connection is closed
+        with pytest.raises(tornado.websocket.WebSocketClosedError):
+            ws_handler.write_frame(b"\x82\x00")
+
     @patch("iotlabwebsocket.handlers.http_handler._nodes")
     @gen_test
     def test_websocket_connection_text(self, nodes, ws_open):
@@ -146,6 +152,121 @@ class TestWebsocketHandler(AsyncHTTPTestCase):
             yield gen.sleep(0.1)
             assert ws_data.call_count == 0
 
+    @patch("iotlabwebsocket.handlers.http_handler._nodes")
+    @gen_test
+    def test_websocket_connection_framing(self, nodes, ws_open):
+        url = f"ws://localhost:{self.api.port}/ws/local/123/node-1/serial"
+        nodes.return_value = json.dumps({"nodes": ["node-1.local"]})
+
+        _ = yield tornado.websocket.websocket_connect(
+            f"{url}?framing=line", subprotocols=["user", "token", "token"]
+        )
+        args, _ = ws_open.call_args
+        assert args[0].framing == "line"
+
+        # Framing is ignored by raw websockets
+        _ = yield tornado.websocket.websocket_connect(
+            f"{url}/raw?framing=line", subprotocols=["user", "token", "token"]
+        )
+        args, _ = ws_open.call_args
+        assert args[0].framing == "chunk"
+
+        ws_open.call_count = 0
+        with pytest.raises(tornado.httpclient.HTTPClientError) as exc_info:
+            _ = yield tornado.websocket.websocket_connect(
+                f"{url}?framing=invalid", subprotocols=["user", "token", "token"]
+            )
+        assert "HTTP 400: Bad Request" in str(exc_info.value)
+        assert ws_open.call_count == 0
+
+    @gen.coroutine
+    def _slow_websocket(self, ws_open, policy):
+        url = f"ws://localhost:{self.api.port}/ws/local/123/node-1/serial/raw"
+        self._app.settings["write_queue_size"] = 10
+        self._app.settings["write_queue_policy"] = policy
+        connection = yield tornado.websocket.websocket_connect(
+            url, subprotocols=["user", "token", "token"]
+        )
+        args, _ = ws_open.call_args
+        handler = args[0]
+        writes = []
+
+        def _write(data):
+            writes.append((data, Future()))
+            return writes[-1][1]
+
+        handler.ws_connection.stream.write = _write
+        raise gen.Return((connection, handler, writes))
+
+    @patch("iotlabwebsocket.handlers.http_handler._nodes")
+    @gen_test
+    def test_websocket_write_queue_drop_oldest(self, nodes, ws_open):
+        nodes.return_value = json.dumps({"nodes": ["node-1.local"]})
+        _, handler, writes = yield self._slow_websocket(ws_open, "drop-oldest")
+
+        for frame in (b"1111", b"2222", b"3333", b"4444"):
+            handler.write_frame(frame)
+        # Only one write is pending, the oldest queued frame was dropped
+        assert [data for data, _ in writes] == [b"1111"]
+        assert list(handler.queue) == [b"3333", b"4444"]
+        assert handler.queue_bytes == 8
+        assert handler.dropped_frames == 1
+        assert handler.dropped_bytes == 4
+
+        # Frames larger than the queue are dropped
+        handler.write_frame(b"x" * 11)
+        assert list(handler.queue) == [b"3333", b"4444"]
+        assert handler.dropped_frames == 2
+
+        # Queued frames are sent at once when the pending write completes
+        assert handler.buffered_bytes == 12
+        with patch.object(self._app, "handle_websocket_drain") as drain:
+            writes[0][1].set_result(None)
+            yield gen.moment
+            drain.assert_called_once_with(handler)
+        assert [data for data, _ in writes] == [b"1111", b"33334444"]
+        assert not handler.queue
+        assert handler.queue_bytes == 0
+        assert handler.buffered_bytes == 8
+
+        writes[1][1].set_result(None)
+        yield gen.moment
+        handler.write_frame(b"5555")
+        assert writes[2][0] == b"5555"
+
+    @patch("iotlabwebsocket.handlers.http_handler._nodes")
+    @gen_test
+    def test_websocket_write_queue_drop_newest(self, nodes, ws_open):
+        nodes.return_value = json.dumps({"nodes": ["node-1.local"]})
+        _, handler, writes = yield self._slow_websocket(ws_open, "drop-newest")
+
+        for frame in (b"1111", b"2222", b"3333", b"4444"):
+            handler.write_frame(frame)
+        assert list(handler.queue) == [b"2222", b"3333"]
+        assert handler.dropped_frames == 1
+
+        writes[0][1].set_result(None)
+        yield gen.moment
+        assert writes[1][0] == b"22223333"
+
+    @patch("iotlabwebsocket.handlers.http_handler._nodes")
+    @gen_test
+    def test_websocket_write_queue_disconnect(self, nodes, ws_open):
+        nodes.return_value = json.dumps({"nodes": ["node-1.local"]})
+        _, handler, _ = yield self._slow_websocket(ws_open, "disconnect")
+
+        with patch.object(handler, "close") as close:
+            for frame in (b"1111", b"2222", b"3333"):
+                handler.write_frame(frame)
+            assert close.call_count == 0
+            handler.write_frame(b"4444")
+            close.assert_called_once_with(
+                code=1008, reason="Websocket client is too slow"
+            )
+        assert not handler.queue
+        assert handler.queue_bytes == 0
+        assert handler.dropped_frames == 3
+
     @gen_test
     def test_websocket_connection_invalid_url(self, ws_open):
         url = f"ws://localhost:{self.api.port}/ws/local///serial"
@@ -192,3 +313,80 @@ class TestWebsocketHandler(AsyncHTTPTestCase):
             )
         assert "HTTP 401: Unauthorized" in str(exc_info.value)
         assert ws_open.call_count == 0
+
+    @patch("iotlabwebsocket.api.ApiClient.fetch_nodes_index_async")
+    @patch("iotlabwebsocket.api.ApiClient.fetch_token_async")
+    @gen_test
+    def test_websocket_connection_parallel_checks(self, token, nodes, ws_open):
+        url = f"ws://localhost:{self.api.port}/ws/local/123/node-1/serial"
+        events = []
+
+        @gen.coroutine
+        def _fetch(resource, result):
+            events.append(resource)
+            yield gen.sleep(0.05)
+            events.append(f"{resource} done")
+            return result
+
+        token.side_effect = lambda exp_id: _fetch("token", "token")
+        nodes.side_effect = lambda exp_id: _fetch("nodes", {("local", "node-1")})
+
+        _ = yield tornado.websocket.websocket_connect(
+            url, subprotocols=["user", "token", "token"]
+        )
+        ws_open.assert_called_once()
+        # Both requests are sent before any response is received
+        assert events[:2] == ["token", "nodes"]
+
+        # When the token is invalid, the pending nodes request is ignored
+        events.clear()
+        ws_open.call_count = 0
+        with pytest.raises(tornado.httpclient.HTTPClientError) as exc_info:
+            _ = yield tornado.websocket.websocket_connect(
+                url, subprotocols=["user", "token", "invalid"]
+            )
+        assert "HTTP 401: Unauthorized" in str(exc_info.value)
+        assert ws_open.call_count == 0
+        assert events[:3] == ["token", "nodes", "token done"]
+
+
+@patch("iotlabwebsocket.web_application.WebApplication.handle_websocket_open")
+class TestWebsocketHandlerApiError(AsyncHTTPTestCase):
+    def get_app(self):
+        # No token set, token requests to the API fail
+        return WebApplication(self.api, use_local_api=True)
+
+    def setUp(self):
+        self.api = ApiClient("http")
+        super(TestWebsocketHandlerApiError, self).setUp()
+        self.api.port = self.get_http_port()
+
+    @gen_test
+    def test_websocket_connection_api_error(self, ws_open):
+        url = f"ws://localhost:{self.api.port}/ws/local/123/localhost/serial"
+
+        with pytest.raises(tornado.httpclient.HTTPClientError) as exc_info:
+            _ = yield tornado.websocket.websocket_connect(
+                url, subprotocols=["user", "token", "token"]
+            )
+        assert "HTTP 500: Internal Server Error" in str(exc_info.value)
+        assert ws_open.call_count == 0
+
+
+@patch("iotlabwebsocket.handlers.websocket_handler.SESSION_LOGGER")
+@patch("iotlabwebsocket.web_application.WebApplication.handle_websocket_close")
+def test_websocket_close_before_open(ws_close, session_logger):
+    application = WebApplication(ApiClient("http"))
+    request = HTTPServerRequest(
+        uri="/ws/local/123/node-1/serial/raw", connection=Mock()
+    )
+    handler = WebsocketClientHandler(application, request, api=None, text=False)
+    handler._check_path()
+    session_logger.isEnabledFor.return_value = True
+
+    # The connection is lost while the handshake is checked
+    handler.on_close()
+    record = session_logger.info.call_args[0][0]
+    assert record["handshake_duration"] is None
+    assert record["duration"] is None
+    ws_close.assert_called_once_with(handler)
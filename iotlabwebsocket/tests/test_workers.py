@@ -0,0 +1,98 @@
+"""iotlabwebsocket workers tests."""
+
+import multiprocessing
+
+import mock
+
+from iotlabwebsocket.workers import (
+    worker_of,
+    ConnectionCounters,
+    SharedConnectionCounters,
+)
+
+
+def test_worker_of():
+    nodes = [f"m3-{index}" for index in range(1000)]
+    workers = [worker_of(node, 4) for node in nodes]
+    assert workers == [worker_of(node, 4) for node in nodes]
+    assert set(workers) == {0, 1, 2, 3}
+    assert all(worker_of(node, 1) == 0 for node in nodes)
+
+
+def test_connection_counters():
+    counters = ConnectionCounters()
+    assert counters["user"] == 0
+    assert counters.acquire("user", 2)
+    assert counters.acquire("user", 2)
+    assert not counters.acquire("user", 2)
+    assert counters["user"] == 2
+    assert counters["other"] == 0
+
+    counters.release("user")
+    assert counters["user"] == 1
+    counters.release("user")
+    counters.release("user")
+    assert counters["user"] == 0
+
+
+def test_shared_connection_counters():
+    counters = SharedConnectionCounters(2, size=4, key_size=8)
+    assert counters.acquire("user", 3)
+    assert counters.acquire("user", 3)
+    assert counters.acquire("", 3)
+    assert counters["user"] == 2
+    assert counters[""] == 1
+
+    # Limits apply to the connections of all workers
+    counters.attach(1)
+    assert counters.acquire("user", 3)
+    assert not counters.acquire("user", 3)
+    counters.release("user")
+    counters.release("user")
+    assert counters["user"] == 2
+    counters.release("unknown")
+
+    # Restarted workers forget their connections
+    counters.acquire("user", 3)
+    counters.attach(1)
+    assert counters["user"] == 2
+
+    # Long keys are truncated
+    assert counters.acquire("long-user-name", 3)
+    assert counters["long-user-na"] == 1
+
+
+def test_shared_connection_counters_full():
+    counters = SharedConnectionCounters(1, size=2)
+    assert counters.acquire("user-1", 1)
+    assert counters.acquire("user-2", 1)
+    with mock.patch("iotlabwebsocket.workers.LOGGER.warning") as warning:
+        assert counters.acquire("user-3", 1)
+        assert counters.acquire("user-3", 1)
+    assert warning.call_count == 2
+    assert counters["user-3"] == 0
+
+    # Slots without connections are reused
+    counters.release("user-1")
+    assert counters.acquire("user-3", 1)
+    assert not counters.acquire("user-3", 1)
+    assert counters["user-1"] == 0
+
+
+def _acquire(counters, worker_id, results):
+    counters.attach(worker_id)
+    results.put([counters.acquire("user", 3) for _ in range(3)])
+
+
+def test_shared_connection_counters_processes():
+    counters = SharedConnectionCounters(2)
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    assert counters.acquire("user", 3)
+
+    worker = context.Process(target=_acquire, args=(counters, 1, results))
+    worker.start()
+    assert results.get(timeout=5) == [True, True, False]
+    worker.join()
+    assert counters["user"] == 3
+    assert not counters.acquire("user", 3)
@@ -0,0 +1,69 @@
+"""Sampled tracing of the latency of the data relayed from the nodes.
+
+A sampled chunk of data is timestamped when it's read from the node, when
+`WebApplication.handle_tcp_data` has dispatched it to the websockets and
+when each websocket write containing it is done. The latencies of these
+stages are accounted in the ``relay_latency_seconds`` histograms.
+"""
+
+import time
+
+from .metrics import RELAY_LATENCY_SECONDS
+
+DISPATCH = RELAY_LATENCY_SECONDS.labels("dispatch")
+WRITE = RELAY_LATENCY_SECONDS.labels("write")
+TOTAL = RELAY_LATENCY_SECONDS.labels("total")
+
+
+class Trace:
+    """Timestamps of a sampled chunk of data."""
+
+    __slots__ = ("read", "dispatched")
+
+    def __init__(self, read):
+        self.read = read
+        self.dispatched = read
+
+    def dispatch(self):
+        """Timestamp the end of the dispatch to the websockets."""
+        self.dispatched = time.monotonic()
+        DISPATCH.observe(self.dispatched - self.read)
+
+    def follow(self, future):
+        """Timestamp the end of the websocket write ``future``."""
+        future.add_done_callback(self._written)
+
+    def _written(self, future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        now = time.monotonic()
+        WRITE.observe(now - self.dispatched)
+        TOTAL.observe(now - self.read)
+
+
+class Tracer:
+    """Samples one chunk of data read from the nodes out of ``1 / sample_rate``.
+
+    >>> tracer = Tracer(0.5)
+    >>> [tracer.read() or tracer.pop() is not None for _ in range(4)]
+    [False, True, False, True]
+    """
+
+    def __init__(self, sample_rate):
+        self.interval = max(1, round(1 / sample_rate))
+        self._countdown = self.interval
+        self._current = None
+
+    def read(self):
+        """Start the trace of the chunk just read, if it is sampled."""
+        self._countdown -= 1
+        if self._countdown:
+            self._current = None
+            return
+        self._countdown = self.interval
+        self._current = Trace(time.monotonic())
+
+    def pop(self):
+        """Return the trace of the chunk being handled, or None."""
+        trace, self._current = self._current, None
+        return trace
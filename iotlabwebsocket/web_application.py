@@ -1,24 +1,160 @@
 """iotlabwebserial main web application."""
 
-from collections import defaultdict
+import asyncio
+from collections import defaultdict, OrderedDict
 
 import tornado
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
 
 from . import DEFAULT_API_HOST
 from .logger import LOGGER
-from .clients.tcp_client import TCPClient
+from .broadcast import (
+    NodeBroadcast,
+    DEFAULT_TEXT_ERRORS,
+    LINE_MAX_LATENCY,
+    LINE_MAX_SIZE,
+)
+from .clients.tcp_client import (
+    TCPClient,
+    CHUNK_SIZE,
+    MAX_CHUNK_SIZE,
+    LINGER_POOL_SIZE,
+    LINGER_BUFFER_SIZE,
+)
+from .capture import CaptureWriter, capture_path
+from .scrollback import Scrollbacks, SCROLLBACK_TOTAL_SIZE
+from .sessions import Session, SESSION_BUFFER_SIZE, SESSION_GRACE
+from .mux import Subscription, GROUP_SEND_TIMEOUT
+from .workers import ConnectionCounters, worker_of
+from .metrics import METRICS, HANDSHAKES, Gauge
+from .tracing import Tracer
+from .rate_limiter import (
+    TokenBucket,
+    RateLimiter,
+    DEFAULT_RATE_LIMIT_ACTION,
+    NODE_RATE,
+    NODE_BURST,
+)
 from .handlers.http_handler import HttpApiRequestHandler
-from .handlers.websocket_handler import WebsocketClientHandler
+from .handlers.metrics_handler import MetricsHandler
+from .handlers.mux_handler import MuxWebsocketHandler
+from .handlers.session_handler import SessionWebsocketHandler
+from .handlers.websocket_handler import (
+    WebsocketClientHandler,
+    COMPRESSION_WINDOW_BITS,
+    COMPRESSION_MIN_SIZE,
+    WRITE_QUEUE_SIZE,
+    WRITE_HIGH_WATER_MARK,
+    WRITE_LOW_WATER_MARK,
+)
 
 MAX_WEBSOCKETS_PER_NODE = 2
 MAX_WEBSOCKETS_PER_USER = 10
 
 
 class WebApplication(tornado.web.Application):
-    """IoT-LAB websocket to tcp redirector."""
+    """IoT-LAB websocket to tcp redirector.
 
-    def __init__(self, api, use_local_api=False, token=""):
-        settings = {"debug": True}
+    Extra keyword arguments are added to the application settings:
+
+    - ``text_errors``: policy applied to invalid UTF-8 data sent to text
+      websockets, ``"replace"`` (default) or ``"skip"``.
+    - ``line_max_latency``, ``line_max_size``: maximum delay in seconds and
+      size in characters of the text buffered for line framed websockets.
+    - ``websocket_compression_options``: permessage-deflate options
+      (``compression_level``, ``mem_level``), compression is disabled when
+      None (default).
+    - ``compression_window_bits``: maximum deflate window size of the server.
+    - ``compression_min_size``: frames shorter than this are not compressed.
+    - ``write_queue_size``: maximum number of bytes queued for a websocket.
+    - ``write_queue_policy``: what to do when a websocket queue is full,
+      ``"drop-oldest"`` (default), ``"drop-newest"`` or ``"disconnect"``.
+    - ``write_high_water_mark``, ``write_low_water_mark``: reads from a node
+      are paused when all its websockets buffer more bytes than the high-water
+      mark and resumed when one of them buffers less than the low-water mark.
+    - ``tcp_min_chunk_size``, ``tcp_max_chunk_size``: bounds of the adaptive
+      size of the reads from the nodes.
+    - ``rate_limits``: maximum ``(rate, burst)`` of the data received from
+      each ``"node"``, from all nodes of a ``"user"`` (the user who opened the
+      TCP connection) and from all nodes (``"global"``), in bytes per second
+      and bytes. Scopes missing from the dictionary are not limited.
+    - ``rate_limit_action``: what to do with data exceeding the rate limits,
+      ``"throttle"``, ``"shed"`` or ``"disconnect"`` (default).
+    - ``worker_id``, ``worker_ports``: index of this worker process and
+      internal ports of all the workers. Websockets to nodes owned by
+      another worker are proxied to it. Single process when empty (default).
+    - ``user_connections``: `SharedConnectionCounters` of the websockets of
+      each user in all the workers.
+    - ``trace_sample_rate``: fraction of the chunks of node data whose relay
+      latency is traced, tracing is disabled when null (default).
+    - ``tcp_linger``: time in seconds the TCP connection to a node stays
+      open after its last websocket is closed, to be reused by the next
+      websocket of the node. Connections are closed at once when null
+      (default).
+    - ``tcp_linger_buffer_size``: maximum number of the most recent bytes
+      received from an idle node, sent to the websocket reusing the
+      connection.
+    - ``tcp_linger_pool_size``: maximum number of idle connections, the
+      oldest one is closed when a new one would exceed it.
+    - ``scrollback_size``: number of the last bytes received from each node
+      sent to its new websockets, from the offset given by their ``since``
+      query argument. Disabled when null (default).
+    - ``scrollback_total_size``: maximum number of bytes of the scrollbacks
+      of all the nodes.
+    - ``session_buffer_size``: number of the last bytes sent by a resumable
+      session kept to be sent again when it is resumed.
+    - ``session_grace``: time in seconds a resumable session waits to be
+      resumed once its websocket is lost.
+    - ``group_send_timeout``: maximum time in seconds to write the data of a
+      group message of a multiplexed websocket to the nodes.
+    - ``capture_nodes``, ``capture_dir``: the data received from these nodes
+      are recorded to a new capture file in the directory for each TCP
+      connection. No node is captured by default.
+
+    The nodes of an experiment are multiplexed on one websocket with
+    ``/ws/<site>/<exp_id>/mux``, see `MuxWebsocketHandler`. Each node
+    subscription counts in the websockets of the node, the multiplexed
+    websocket counts once in the websockets of its user.
+
+    The metrics of the process are exposed to Prometheus on ``/metrics``,
+    with a ``worker`` label in a worker process. Users are only counted,
+    their names are not published.
+    """
+
+    # pylint:disable=too-many-instance-attributes
+
+    def __init__(self, api, use_local_api=False, token="", **settings):
+        # pylint:disable=too-many-statements
+        settings.setdefault("text_errors", DEFAULT_TEXT_ERRORS)
+        settings.setdefault("line_max_latency", LINE_MAX_LATENCY)
+        settings.setdefault("line_max_size", LINE_MAX_SIZE)
+        settings.setdefault("websocket_compression_options", None)
+        settings.setdefault("compression_window_bits", COMPRESSION_WINDOW_BITS)
+        settings.setdefault("compression_min_size", COMPRESSION_MIN_SIZE)
+        settings.setdefault("write_queue_size", WRITE_QUEUE_SIZE)
+        settings.setdefault("write_queue_policy", "drop-oldest")
+        settings.setdefault("write_high_water_mark", WRITE_HIGH_WATER_MARK)
+        settings.setdefault("write_low_water_mark", WRITE_LOW_WATER_MARK)
+        settings.setdefault("tcp_min_chunk_size", CHUNK_SIZE)
+        settings.setdefault("tcp_max_chunk_size", MAX_CHUNK_SIZE)
+        settings.setdefault("rate_limits", {"node": (NODE_RATE, NODE_BURST)})
+        settings.setdefault("rate_limit_action", DEFAULT_RATE_LIMIT_ACTION)
+        settings.setdefault("worker_id", 0)
+        settings.setdefault("worker_ports", [])
+        settings.setdefault("trace_sample_rate", 0)
+        settings.setdefault("tcp_linger", 0)
+        settings.setdefault("tcp_linger_buffer_size", LINGER_BUFFER_SIZE)
+        settings.setdefault("tcp_linger_pool_size", LINGER_POOL_SIZE)
+        settings.setdefault("scrollback_size", 0)
+        settings.setdefault("scrollback_total_size", SCROLLBACK_TOTAL_SIZE)
+        settings.setdefault("session_buffer_size", SESSION_BUFFER_SIZE)
+        settings.setdefault("session_grace", SESSION_GRACE)
+        settings.setdefault("group_send_timeout", GROUP_SEND_TIMEOUT)
+        settings.setdefault("capture_nodes", ())
+        settings.setdefault("capture_dir", ".")
+        settings["debug"] = True
         handlers = [
             (
                 r"/ws/[a-z0-9\-_]+/[0-9]+/[a-z0-9]+-?[a-z0-9]*-?[0-9]*/serial",
@@ -30,6 +166,17 @@ class WebApplication(tornado.web.Application):
                 WebsocketClientHandler,
                 dict(api=api, text=False),
             ),
+            (
+                r"/ws/[a-z0-9\-_]+/[0-9]+/[a-z0-9]+-?[a-z0-9]*-?[0-9]*/serial/session",
+                SessionWebsocketHandler,
+                dict(api=api),
+            ),
+            (
+                r"/ws/[a-z0-9\-_]+/[0-9]+/mux",
+                MuxWebsocketHandler,
+                dict(api=api),
+            ),
+            (r"/metrics", MetricsHandler),
         ]
 
         if use_local_api:
@@ -43,9 +190,73 @@ class WebApplication(tornado.web.Application):
                 )
             )
 
-        self.tcp_clients = defaultdict(TCPClient)
+        self.tracer = None
+        if settings["trace_sample_rate"]:
+            self.tracer = Tracer(settings["trace_sample_rate"])
+        self.tcp_clients = defaultdict(
+            lambda: TCPClient(
+                settings["tcp_min_chunk_size"],
+                settings["tcp_max_chunk_size"],
+                tracer=self.tracer,
+            )
+        )
         self.websockets = defaultdict(list)
-        self.user_connections = defaultdict(int)
+        self.broadcasts = {}
+        # Idle nodes, oldest first, with their reaping timeout and buffer
+        self.lingering = OrderedDict()
+        self.captures = {}
+        self.sessions = {}
+        self.muxes = []
+        self.scrollbacks = None
+        if settings["scrollback_size"] > 0:
+            self.scrollbacks = Scrollbacks(
+                settings["scrollback_size"], settings["scrollback_total_size"]
+            )
+        self.user_connections = settings.get("user_connections")
+        if self.user_connections is None:
+            self.user_connections = ConnectionCounters()
+        self.user_buckets = {}
+        self.global_bucket = None
+        if "global" in settings["rate_limits"]:
+            self.global_bucket = TokenBucket(*settings["rate_limits"]["global"])
+        # Requests are served by any worker, their samples are told apart
+        self.metric_labels = {}
+        if settings["worker_ports"]:
+            self.metric_labels["worker"] = settings["worker_id"]
+        self.metrics = METRICS + (
+            Gauge(
+                "node_websockets",
+                "Websockets connected to each node.",
+                ("node",),
+                collect=self._node_websockets,
+            ),
+            Gauge(
+                "user_websockets",
+                "Websockets opened by the users.",
+                collect=lambda: {(): sum(self._user_websockets().values())},
+            ),
+            Gauge(
+                "users",
+                "Users with opened websockets.",
+                collect=lambda: {(): len(self._user_websockets())},
+            ),
+            Gauge(
+                "write_queue_bytes",
+                "Bytes being written or queued for the websockets of each node.",
+                ("node",),
+                collect=self._write_queue_bytes,
+            ),
+            Gauge(
+                "scrollback_bytes",
+                "Bytes allocated to the scrollbacks of the nodes.",
+                collect=self._scrollback_bytes,
+            ),
+            Gauge(
+                "lingering_tcp_connections",
+                "Idle TCP connections kept open for the next websockets.",
+                collect=lambda: {(): len(self.lingering)},
+            ),
+        )
 
         super(WebApplication, self).__init__(handlers, **settings)
 
@@ -53,14 +264,9 @@ class WebApplication(tornado.web.Application):
         """Handle the websocket connection once authentified."""
         node = websocket.node
         user = websocket.user
-        site = websocket.site
         tcp_client = self.tcp_clients[node]
-        if not self.websockets[node]:
-            # Open the tcp connection on first websocket connection.
-            tcp_client.start(
-                node, on_data=self.handle_tcp_data, on_close=self.handle_tcp_close
-            )
         if len(self.websockets[node]) == MAX_WEBSOCKETS_PER_NODE:
+            HANDSHAKES.labels("rejected", "node_limit").inc()
             websocket.close(
                 code=1000,
                 reason=(
@@ -68,17 +274,171 @@ class WebApplication(tornado.web.Application):
                     f"connections to node {node}."
                 ),
             )
-        elif self.user_connections[user] == MAX_WEBSOCKETS_PER_USER:
-            websocket.close(
-                code=1000,
-                reason=(
-                    f"Max number of connections ({MAX_WEBSOCKETS_PER_USER}) "
-                    f"reached for user {user} on site {site}."
-                ),
+        elif self._acquire_user(websocket):
+            HANDSHAKES.labels("accepted", "").inc()
+            buffered = None
+            if not self.websockets[node] and node in self.lingering:
+                # Reuse the idle tcp connection, it lingers on if rejected
+                LOGGER.debug("Reusing TCP connection to node '%s'", node)
+                timeout, buffered = self.lingering.pop(node)
+                IOLoop.current().remove_timeout(timeout)
+                tcp_client.limiter = self._rate_limiter(user)
+            elif not self.websockets[node]:
+                # Open the tcp connection on first accepted websocket.
+                self._start_tcp_client(node, user)
+            self.websockets[node].append(websocket)
+            if self.scrollbacks is not None:
+                # Includes the data buffered by an idle connection
+                self.broadcasts[node].send_scrollback(
+                    websocket, self.scrollbacks.read(node, websocket.since)
+                )
+            elif buffered:
+                self.broadcasts[node].send(buffered)
+            # The new websocket can keep up with the node
+            tcp_client.resume()
+
+    def _start_tcp_client(self, node, user):
+        # The websockets of the node may have been closed while connecting
+        broadcast = self.broadcasts.pop(node, None)
+        if broadcast is not None:
+            broadcast.close()
+        self._close_capture(node)
+        self.broadcasts[node] = NodeBroadcast(
+            node,
+            self.websockets[node],
+            text_errors=self.settings["text_errors"],
+            line_max_size=self.settings["line_max_size"],
+            line_max_latency=self.settings["line_max_latency"],
+        )
+        if node in self.settings["capture_nodes"]:
+            path = capture_path(self.settings["capture_dir"], node)
+            LOGGER.info("Capturing node '%s' to %s", node, path)
+            self.captures[node] = CaptureWriter(path)
+        self.tcp_clients[node].start(
+            node,
+            on_data=self.handle_tcp_data,
+            on_close=self.handle_tcp_close,
+            limiter=self._rate_limiter(user),
+        )
+
+    def _acquire_user(self, websocket):
+        # Subscriptions are counted with their multiplexed websocket
+        if isinstance(websocket, Subscription) or self.user_connections.acquire(
+            websocket.user, MAX_WEBSOCKETS_PER_USER
+        ):
+            return True
+        HANDSHAKES.labels("rejected", "user_limit").inc()
+        websocket.close(
+            code=1000,
+            reason=(
+                f"Max number of connections ({MAX_WEBSOCKETS_PER_USER}) "
+                f"reached for user {websocket.user} on site {websocket.site}."
+            ),
+        )
+        return False
+
+    def handle_mux_open(self, websocket):
+        """Handle the multiplexed websocket connection once authentified.
+
+        The websockets forwarding the subscriptions of another worker are
+        counted by this worker.
+        """
+        if not websocket.forwarding and self._acquire_user(websocket):
+            self.muxes.append(websocket)
+
+    def handle_mux_close(self, websocket):
+        """Handle the disconnection of a multiplexed websocket."""
+        if websocket in self.muxes:
+            self.muxes.remove(websocket)
+            self.user_connections.release(websocket.user)
+            if not self.user_connections[websocket.user]:
+                self.user_buckets.pop(websocket.user, None)
+
+    def handle_session_open(self, websocket):
+        """Start or resume the session of a websocket."""
+        session = websocket.resumable_session
+        if session is None:
+            session = Session(
+                websocket,
+                self.settings["session_buffer_size"],
+                self.settings["session_grace"],
+                on_end=self._end_session,
             )
+            websocket.resumable_session = session
+            self.sessions[session.id] = session
+            self.handle_websocket_open(session)
         else:
-            self.user_connections[user] += 1
-            self.websockets[node].append(websocket)
+            LOGGER.info("Resuming session of node '%s'", session.node)
+            HANDSHAKES.labels("resumed", "").inc()
+            session.attach(websocket, websocket.resume_offset)
+            # The new websocket can keep up with the node
+            self.handle_websocket_drain(session)
+
+    def handle_session_close(self, websocket):
+        """Wait for the session of a closed websocket to be resumed."""
+        if websocket.resumable_session is not None:
+            websocket.resumable_session.detach(websocket)
+
+    def _end_session(self, session):
+        self.sessions.pop(session.id, None)
+        self.handle_websocket_close(session)
+
+    def worker_port(self, node):
+        """Return the internal port of the worker owning the node.
+
+        Return None when the node is owned by this process.
+        """
+        ports = self.settings["worker_ports"]
+        if not ports:
+            return None
+        owner = worker_of(node, len(ports))
+        if owner == self.settings["worker_id"]:
+            return None
+        return ports[owner]
+
+    def _rate_limiter(self, user):
+        limits = self.settings["rate_limits"]
+        buckets = []
+        if "node" in limits:
+            buckets.append(TokenBucket(*limits["node"]))
+        if "user" in limits:
+            if user not in self.user_buckets:
+                self.user_buckets[user] = TokenBucket(*limits["user"])
+            buckets.append(self.user_buckets[user])
+        if self.global_bucket is not None:
+            buckets.append(self.global_bucket)
+        if not buckets:
+            return None
+        return RateLimiter(buckets, action=self.settings["rate_limit_action"])
+
+    def _node_websockets(self):
+        return {
+            (node,): len(websockets)
+            for node, websockets in self.websockets.items()
+            if websockets
+        }
+
+    def _user_websockets(self):
+        counts = defaultdict(int)
+        for websockets in self.websockets.values():
+            for websocket in websockets:
+                if not isinstance(websocket, Subscription):
+                    counts[websocket.user] += 1
+        for websocket in self.muxes:
+            counts[websocket.user] += 1
+        return counts
+
+    def _scrollback_bytes(self):
+        if self.scrollbacks is None:
+            return {}
+        return {(): len(self.scrollbacks) * self.scrollbacks.size}
+
+    def _write_queue_bytes(self):
+        return {
+            (node,): sum(websocket.buffered_bytes for websocket in websockets)
+            for node, websockets in self.websockets.items()
+            if websockets
+        }
 
     def handle_websocket_data(self, websocket, data):
         """Handle a message coming from a websocket."""
@@ -87,10 +447,47 @@ class WebApplication(tornado.web.Application):
             tcp_client.send(data)
         else:
             LOGGER.debug("No TCP connection opened, skipping message")
+            # Binary data may not be valid UTF-8
+            message = data.decode("utf-8", "replace")
             websocket.write_message(
-                f"No TCP connection opened, cannot send "
-                f"message '{data.decode('utf-8')}'.\n"
+                f"No TCP connection opened, cannot send message '{message}'.\n"
+            )
+
+    @gen.coroutine
+    def handle_group_data(self, websockets, data):
+        """Send the same data to the nodes of several websockets.
+
+        The writes to all the nodes share the data buffer and are started at
+        once. Return the result of each websocket: ``"sent"`` once the data
+        are written to the node connection, ``"not connected"``,
+        ``"closed"`` or ``"timeout"`` when they are not written within the
+        ``group_send_timeout`` setting.
+        """
+        results = {}
+        writes = {}
+        for websocket in dict.fromkeys(websockets):
+            tcp_client = self.tcp_clients.get(websocket.node)
+            try:
+                write = tcp_client.send(data) if tcp_client is not None else None
+            except StreamClosedError:
+                results[websocket] = "closed"
+                continue
+            if write is None:
+                results[websocket] = "not connected"
+            else:
+                writes[websocket] = write
+        if writes:
+            yield asyncio.wait(
+                writes.values(), timeout=self.settings["group_send_timeout"]
             )
+        for websocket, write in writes.items():
+            if not write.done():
+                results[websocket] = "timeout"
+            elif write.exception() is not None:
+                results[websocket] = "closed"
+            else:
+                results[websocket] = "sent"
+        return results
 
     def handle_websocket_close(self, websocket):
         """Handle the disconnection of a websocket."""
@@ -99,29 +496,95 @@ class WebApplication(tornado.web.Application):
         tcp_client = self.tcp_clients[node]
         if websocket in self.websockets[node]:
             self.websockets[node].remove(websocket)
-        if self.user_connections[user] > 0:
-            self.user_connections[user] -= 1
+            if not isinstance(websocket, Subscription):
+                self.user_connections.release(user)
+        if not self.user_connections[user]:
+            self.user_buckets.pop(user, None)
 
         # websockets list is now empty for given node, closing tcp connection.
         if tcp_client.ready and not self.websockets[node]:
-            LOGGER.debug(f"Closing TCP connection to node '{node}'")
-            tcp_client.stop()
-            self.tcp_clients.pop(node)
-            del tcp_client
+            if not self._linger(node):
+                self._close_tcp_client(node)
+        elif self.websockets[node]:
+            # The remaining websockets may keep up with the node
+            tcp_client.resume()
+
+    def _linger(self, node):
+        """Keep the idle tcp connection of a node open, if enabled."""
+        linger = self.settings["tcp_linger"]
+        pool_size = self.settings["tcp_linger_pool_size"]
+        if node in self.lingering:
+            return True
+        if not linger or pool_size <= 0:
+            return False
+        while len(self.lingering) >= pool_size:
+            self._reap(next(iter(self.lingering)))
+        LOGGER.debug("Keeping idle TCP connection to node '%s'", node)
+        timeout = IOLoop.current().call_later(linger, self._reap, node)
+        self.lingering[node] = (timeout, bytearray())
+        # Idle nodes are buffered, not throttled
+        self.tcp_clients[node].resume()
+        return True
+
+    def _reap(self, node):
+        timeout, _ = self.lingering.pop(node)
+        IOLoop.current().remove_timeout(timeout)
+        self._close_tcp_client(node)
+
+    def _close_tcp_client(self, node):
+        LOGGER.debug("Closing TCP connection to node '%s'", node)
+        self.tcp_clients.pop(node).stop()
+        self.broadcasts.pop(node).close()
+        self._close_capture(node)
+
+    def _close_capture(self, node):
+        capture = self.captures.pop(node, None)
+        if capture is not None:
+            capture.close()
+
+    def handle_websocket_drain(self, websocket):
+        """Resume reading from a node once one of its websockets keeps up."""
+        tcp_client = self.tcp_clients.get(websocket.node)
+        if tcp_client is not None:
+            tcp_client.resume()
 
     def handle_tcp_data(self, node, data):
         """Forwards data from TCP connection to all websocket clients."""
-        for websocket in self.websockets[node]:
-            if websocket.text:
-                try:
-                    data = data.decode("utf-8")
-                except UnicodeDecodeError:
-                    LOGGER.debug(f"Cannot decode message: {data}")
-                    continue
-            websocket.write_message(data, binary=not websocket.text)
+        trace = self.tracer.pop() if self.tracer is not None else None
+        capture = self.captures.get(node)
+        if capture is not None:
+            capture.write(data)
+        if self.scrollbacks is not None:
+            self.scrollbacks.write(node, data)
+        if node in self.lingering:
+            buffered = self.lingering[node][1]
+            buffered += data
+            # Keep the most recent bytes
+            excess = len(buffered) - self.settings["tcp_linger_buffer_size"]
+            if excess > 0:
+                del buffered[:excess]
+        elif node in self.broadcasts:
+            self.broadcasts[node].send(data)
+            websockets = self.websockets[node]
+            if trace is not None:
+                trace.dispatch()
+                for websocket in websockets:
+                    # Line framed text is written later
+                    if not websocket.text or websocket.framing != "line":
+                        websocket.trace_write(trace)
+            high_water_mark = self.settings["write_high_water_mark"]
+            if websockets and all(
+                websocket.buffered_bytes >= high_water_mark for websocket in websockets
+            ):
+                # Let the kernel TCP flow control throttle the node
+                self.tcp_clients[node].pause()
 
     def handle_tcp_close(self, node, reason="Cannot connect"):
         """Close all websockets connected to a node when TCP is closed."""
+        if node in self.lingering:
+            LOGGER.debug("Idle TCP connection to node '%s' is closed", node)
+            self._reap(node)
+        self._close_capture(node)
         for websocket in self.websockets[node]:
             websocket.close(code=1000, reason=reason)
 
@@ -130,3 +593,9 @@ class WebApplication(tornado.web.Application):
         for websockets in self.websockets.values():
             for websocket in websockets:
                 websocket.close(code=1001, reason="server is restarting")
+        for websocket in self.muxes:
+            websocket.close(code=1001, reason="server is restarting")
+        for node in list(self.lingering):
+            self._reap(node)
+        for node in list(self.captures):
+            self._close_capture(node)
@@ -0,0 +1,131 @@
+"""Routing of the nodes and connection counters of the worker processes."""
+
+import ctypes
+import multiprocessing
+import zlib
+
+from .logger import LOGGER
+
+# Maximum number of users and user name length of the shared counters
+SHARED_COUNTERS_SIZE = 4096
+SHARED_COUNTERS_KEY_SIZE = 64
+
+
+def worker_of(node, workers):
+    """Return the index of the worker owning the TCP connection to ``node``.
+
+    >>> worker_of("m3-1", 1)
+    0
+    >>> worker_of("m3-1", 4) == worker_of("m3-1", 4)
+    True
+    """
+    return zlib.crc32(node.encode()) % workers
+
+
+class ConnectionCounters:
+    """Number of connections of each key, in a single process."""
+
+    def __init__(self):
+        self._counts = {}
+
+    def __getitem__(self, key):
+        return self._counts.get(key, 0)
+
+    def acquire(self, key, limit):
+        """Count a connection of ``key``, unless it already has ``limit``."""
+        if self[key] >= limit:
+            return False
+        self._counts[key] = self[key] + 1
+        return True
+
+    def release(self, key):
+        """Uncount a connection of ``key``."""
+        if self[key] > 1:
+            self._counts[key] -= 1
+        else:
+            self._counts.pop(key, None)
+
+
+class SharedConnectionCounters:
+    """Number of connections of each key, shared by forked workers.
+
+    Counters live in shared memory allocated before forking: an open
+    addressing table of ``size`` keys truncated to ``key_size - 1`` bytes, with
+    one counter per worker so `attach` can drop the connections of a
+    restarted worker. Keys are never removed, slots whose counters are null
+    are reused. When the table is full, connections are not limited.
+    """
+
+    def __init__(
+        self, workers, size=SHARED_COUNTERS_SIZE, key_size=SHARED_COUNTERS_KEY_SIZE
+    ):
+        self.workers = workers
+        self.worker_id = 0
+        self._size = size
+        self._key_size = key_size
+        self._keys = multiprocessing.RawArray(ctypes.c_char, size * key_size)
+        self._counts = multiprocessing.RawArray(ctypes.c_int, size * workers)
+        self._lock = multiprocessing.Lock()
+
+    def attach(self, worker_id):
+        """Count the connections of ``worker_id`` from now on.
+
+        Its previous counters are reset, in case the worker was restarted.
+        """
+        self.worker_id = worker_id
+        with self._lock:
+            for slot in range(self._size):
+                self._counts[slot * self.workers + worker_id] = 0
+
+    def _key(self, slot):
+        start = slot * self._key_size
+        return self._keys[start : start + self._key_size].rstrip(b"\0")
+
+    def _total(self, slot):
+        start = slot * self.workers
+        return sum(self._counts[start : start + self.workers])
+
+    def _slot(self, key, insert=False):
+        # Stored keys are prefixed so they are never empty
+        key = b"\x01" + key.encode()[: self._key_size - 1]
+        first = zlib.crc32(key) % self._size
+        free = None
+        for index in range(self._size):
+            slot = (first + index) % self._size
+            stored = self._key(slot)
+            if stored == key:
+                return slot
+            if free is None and not self._total(slot):
+                free = slot
+            if not stored:
+                break
+        if insert and free is not None:
+            start = free * self._key_size
+            self._keys[start : start + self._key_size] = key.ljust(
+                self._key_size, b"\0"
+            )
+        return free if insert else None
+
+    def __getitem__(self, key):
+        with self._lock:
+            slot = self._slot(key)
+            return 0 if slot is None else self._total(slot)
+
+    def acquire(self, key, limit):
+        """Count a connection of ``key``, unless it already has ``limit``."""
+        with self._lock:
+            slot = self._slot(key, insert=True)
+            if slot is None:
+                LOGGER.warning("Shared connection counters are full")
+                return True
+            if self._total(slot) >= limit:
+                return False
+            self._counts[slot * self.workers + self.worker_id] += 1
+            return True
+
+    def release(self, key):
+        """Uncount a connection of ``key``."""
+        with self._lock:
+            slot = self._slot(key)
+            if slot is not None and self._counts[slot * self.workers + self.worker_id]:
+                self._counts[slot * self.workers + self.worker_id] -= 1
@@ -40,16 +40,23 @@ if __name__ == "__main__":
         entry_points={
             "console_scripts": [
                 "iotlab-websocket-service = " "iotlabwebsocket.service_cli:main",
+                "iotlab-websocket-benchmark = iotlabwebsocket.benchmarks.load:main",
+                "iotlab-websocket-replay = iotlabwebsocket.replay:main",
             ],
         },
+        python_requires=">=3.7",
         install_requires=[
             "tornado>=6.1",
         ],
+        extras_require={
+            "curl": ["pycurl"],
+            "uvloop": ["uvloop"],
+        },
         classifiers=[
             "Development Status :: 4 - Beta",
-            "Programming Language :: Python :: 3.6",
             "Programming Language :: Python :: 3.7",
             "Programming Language :: Python :: 3.8",
+            "Programming Language :: Python :: 3.9",
             "Intended Audience :: Developers",
             "Environment :: Console",
             "Topic :: Communications",